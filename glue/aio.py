@@ -0,0 +1,142 @@
+import os
+import weakref
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+
+from glue.api import Options, MemorySprite, Result, get_output_name
+from glue.core import Sprite
+from glue.discovery import Discovery
+from glue.formats import formats
+from glue.helpers import read_file
+
+
+class AsyncBuilder(object):
+    """Build sprites from asyncio code without blocking the event loop.
+
+    Reading files, decoding, packing and encoding run in ``executor`` and
+    at most ``limit`` builds run at the same time, no matter how many
+    coroutines use this builder. Pillow releases the GIL while decoding,
+    resizing and encoding, so builds run in parallel using threads.
+
+    Builds can be cancelled as any other task. The stage running in the
+    executor finishes, but the build stops before the next one (e.g.
+    before encoding each output).
+    """
+
+    def __init__(self, limit=None, executor=None):
+        """Builder constructor.
+
+        :param limit: Maximum number of builds running at the same time.
+                      By default, the number of CPUs.
+        :param executor: ``concurrent.futures.Executor`` used to run each
+                         stage. By default, a thread pool of ``limit``
+                         threads.
+        """
+        self.limit = limit or os.cpu_count() or 1
+        self.executor = executor or ThreadPoolExecutor(max_workers=self.limit)
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    @property
+    def semaphore(self):
+        """Semaphore limiting the builds of the running event loop.
+        Semaphores can't be shared by different loops, so every loop using
+        this builder (e.g. every ``asyncio.run``) gets its own one."""
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.limit)
+        return self._semaphores[loop]
+
+    async def run(self, func, *args):
+        """Run ``func(*args)`` in the executor and return its result."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def build(self, images, options=None, name='sprite'):
+        """Asynchronous version of :func:`glue.api.build`. File-like
+        sources are read in the executor too.
+
+        :param images: Dictionary or list of ``(filename, source)`` tuples.
+        :param options: :class:`~glue.api.Options`.
+        :param name: Name of the sprite.
+        """
+        options = options or Options()
+        options.validate()
+        if isinstance(images, dict):
+            images = list(images.items())
+
+        async with self.semaphore:
+            sources = []
+            for filename, source in images:
+                if hasattr(source, 'read'):
+                    source = await self.run(source.read)
+                sources.append((filename, source))
+            return await self._build(sources, options, name)
+
+    async def build_directory(self, path, options=None, name=None):
+        """Build the images inside the directory ``path`` in memory. Files
+        are found and read in the executor using the ``include``,
+        ``exclude`` and ``ignore_file`` settings. Configuration files are
+        ignored.
+
+        :param path: Sprite directory.
+        :param options: :class:`~glue.api.Options`.
+        :param name: Name of the sprite. By default, the directory name.
+        """
+        options = options or Options()
+        options.validate()
+
+        async with self.semaphore:
+            discovery = Discovery(path, options.include, options.exclude,
+                                  options.ignore_file, options.follow_links)
+            paths = await self.run(discovery.find_images, path, Sprite.valid_extensions, options.recursive)
+            sources = []
+            for image_path in paths:
+                sources.append((os.path.basename(image_path), await self.run(read_file, image_path)))
+            return await self._build(sources, options, name or os.path.basename(os.path.normpath(path)))
+
+    async def _build(self, sources, options, name):
+        # Decode every image and pack them
+        sprite = await self.run(MemorySprite, name, sources, options.get_config())
+        sprite.validate()
+
+        # Render every output in its own stage
+        files = OrderedDict()
+        for format_name in sprite.config['enabled_formats']:
+            format = formats[format_name](sprite=sprite)
+            format.validate()
+            outputs = format.outputs()
+            while True:
+                output = await self.run(next, outputs, None)
+                if output is None:
+                    break
+                files[get_output_name(output[0])] = output[1]
+        return Result(sprite, files)
+
+    def close(self):
+        """Shut down the executor."""
+        self.executor.shutdown(wait=False)
+
+
+_default_builder = None
+
+
+def get_default_builder():
+    """Return the builder shared by :func:`build` and :func:`build_directory`."""
+    global _default_builder
+    if _default_builder is None:
+        _default_builder = AsyncBuilder()
+    return _default_builder
+
+
+async def build(images, options=None, name='sprite'):
+    """Build a sprite in memory using the default :class:`AsyncBuilder`."""
+    return await get_default_builder().build(images, options, name)
+
+
+async def build_directory(path, options=None, name=None):
+    """Build the images of ``path`` using the default :class:`AsyncBuilder`."""
+    return await get_default_builder().build_directory(path, options, name)
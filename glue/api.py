@@ -0,0 +1,276 @@
+import os
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+
+from PIL import Image as PILImage
+
+from glue.bin import get_parser
+from glue.core import Image, Sprite
+from glue.formats import formats, ImageFormat
+from glue.helpers import cached_property
+
+# Outputs are rendered as if they were inside this directory, so their
+# paths (and the paths between them) are relative to it.
+ROOT = os.path.abspath(os.sep)
+
+_settings = {}
+
+
+def get_settings():
+    """Return a dictionary with the argparse action of every setting
+    available in :class:`Options`."""
+    if not _settings:
+        parser, deprecated_arguments = get_parser()
+        for action in parser._actions:
+            if action.dest in deprecated_arguments or action.dest in Options.excluded:
+                continue
+            if action.dest.startswith(('watch', 'serve')):
+                continue
+            # As argparse does, the first option using a dest sets its default
+            _settings.setdefault(action.dest, action)
+    return _settings
+
+
+def get_output_name(path):
+    """Return the name of an output inside :attr:`Result.files`."""
+    return os.path.relpath(path, ROOT).replace(os.sep, '/')
+
+
+class OptionsParser(object):
+    """Parser used to apply the constraints of each format to
+    :class:`Options`. Errors are raised as ``ValueError``."""
+
+    def error(self, message):
+        raise ValueError(message)
+
+
+class Options(object):
+    """Settings of a sprite built using :func:`build`.
+
+    Every setting uses the ``dest`` of its command-line option (e.g.
+    ``algorithm``, ``padding``, ``css_separator`` or ``json_compact``) and
+    its same default value. Values are converted to the type of the
+    command-line option and validated against its choices, so
+    ``Options(ratios='2,1', padding=4)`` works as ``--ratios=2,1 --padding=4``.
+
+    Formats are enabled as in the command line using their ``<format>_dir``
+    setting (e.g. ``json_dir=True``). A directory can be used instead of
+    ``True`` to change the paths generated between outputs.
+    """
+
+    # Settings that only make sense in the command line
+    excluded = ('help', 'version', 'source', 'output', 'quiet', 'project')
+
+    def __init__(self, **kwargs):
+        settings = get_settings()
+        for dest, action in settings.items():
+            setattr(self, dest, self._convert(action, action.default))
+
+        # Nothing is read from or written to disk by default
+        self.project = False
+        self.cache_dir = None
+
+        for dest, value in kwargs.items():
+            if dest not in settings:
+                raise TypeError("Unknown option '{0}'.".format(dest))
+            setattr(self, dest, self._convert(settings[dest], value))
+
+    def _convert(self, action, value):
+        if action.nargs == 0:
+            return value if isinstance(value, str) else bool(value)
+        if value is None or isinstance(value, bool) or action.type is None:
+            return value
+        value = action.type(value)
+        if action.choices and value not in action.choices:
+            raise ValueError("Invalid value for '{0}': {1!r}.".format(action.dest, value))
+        return value
+
+    def enabled_formats(self):
+        """Return the name of every enabled format."""
+        enabled = [f for f in formats if getattr(self, '{0}_dir'.format(f), False)]
+
+        # As in the command line, css is enabled if no other format is
+        if set(enabled) in (set(['img']), set(['img', 'html'])) and self.generate_css:
+            enabled.append('css')
+        if not self.generate_image and 'img' in enabled:
+            enabled.remove('img')
+        return enabled
+
+    def validate(self):
+        """Raise ``ValueError`` if these settings can't be used together."""
+        if int(self.jobs) < 1:
+            raise ValueError("jobs must be greater than 0.")
+        parser = OptionsParser()
+        for format in self.enabled_formats():
+            formats[format].apply_parser_contraints(parser, self)
+
+    def get_config(self):
+        """Return the sprite configuration for these settings."""
+        config = dict((dest, getattr(self, dest)) for dest in get_settings())
+        config.update(project=self.project, cache_dir=self.cache_dir,
+                      enabled_formats=self.enabled_formats())
+        for format in formats:
+            key = '{0}_dir'.format(format)
+            value = config.get(key)
+            config[key] = os.path.join(ROOT, value) if isinstance(value, str) else ROOT
+        return config
+
+
+class MemoryImage(Image):
+    """Image using data provided in memory instead of a file."""
+
+    verbose = False
+
+    def __init__(self, filename, source, config):
+        """Image constructor.
+
+        :param filename: Name of the image (e.g. ``icon.png``).
+        :param source: Data of the image as bytes, a binary file-like
+                       object or a Pil image.
+        :param config: Sprite configuration.
+        """
+        self.source = source
+        super(MemoryImage, self).__init__(path=filename, config=config)
+
+    def _get_config_from_file(self, filename, section):
+        return {}
+
+    def _restore(self):
+        return False
+
+    def remember(self):
+        pass
+
+    def _load(self):
+        source = self.source
+        if isinstance(source, PILImage.Image):
+            # Pil images are used directly, so their pixels identify them
+            self._image_data = b''.join([source.mode.encode('ascii'),
+                                         repr(source.size).encode('ascii'),
+                                         source.tobytes()])
+        elif hasattr(source, 'read'):
+            self._image_data = source.read()
+        elif isinstance(source, (bytes, bytearray)):
+            self._image_data = bytes(source)
+        else:
+            raise TypeError("Image '{0}' must be bytes, a file-like object "
+                            "or a Pil image.".format(self.filename))
+        self._variants_data = {}
+
+    def _decode(self, data):
+        if isinstance(self.source, PILImage.Image):
+            return self._convert(self.source)
+        return super(MemoryImage, self)._decode(data)
+
+
+class MemorySprite(Sprite):
+    """Sprite using images provided in memory instead of a directory."""
+
+    verbose = False
+
+    def __init__(self, name, images, config):
+        """Sprite constructor.
+
+        :param name: Name of the sprite.
+        :param images: List of ``(filename, source)`` tuples.
+        :param config: Sprite configuration.
+        """
+        self.sources = images
+        super(MemorySprite, self).__init__(path=name, config=config, name=name)
+
+    def _get_config_from_file(self, filename, section):
+        return {}
+
+    def _locate_images(self):
+        return self._sort_images([MemoryImage(filename, source, self.config)
+                                  for filename, source in self.sources])
+
+
+class Result(object):
+    """Sprite built in memory by :func:`build`."""
+
+    def __init__(self, sprite, files):
+        """Result constructor.
+
+        :param sprite: :class:`MemorySprite`.
+        :param files: Dictionary with the content of every output using
+                      its path as key.
+        """
+        self.sprite = sprite
+        self.files = files
+
+    @property
+    def name(self):
+        return self.sprite.name
+
+    @property
+    def hash(self):
+        return self.sprite.hash
+
+    @property
+    def ratios(self):
+        return self.sprite.ratios
+
+    @cached_property
+    def image_format(self):
+        return ImageFormat(sprite=self.sprite)
+
+    def layout(self, ratio=1.0):
+        """Return the position and size of every image inside the canvas
+        of ``ratio`` as a list of dictionaries.
+
+        :param ratio: Ratio.
+        """
+        frames = self.sprite.frames
+        columns = frames.scaled(ratio)
+        return [OrderedDict([('filename', filename),
+                             ('x', columns['abs_x'][i]),
+                             ('y', columns['abs_y'][i]),
+                             ('width', columns['width'][i]),
+                             ('height', columns['height'][i])])
+                for i, filename in enumerate(frames.filenames)]
+
+    def canvas(self, ratio=1.0):
+        """Return the canvas of ``ratio`` as a Pil image.
+
+        :param ratio: Ratio.
+        """
+        return self.image_format.canvas(ratio)[0]
+
+    def png(self, ratio=1.0):
+        """Return the canvas of ``ratio`` encoded as PNG.
+
+        :param ratio: Ratio.
+        """
+        return self.image_format.encode(ratio)
+
+
+def build(images, options=None, name='sprite'):
+    """Build a sprite in memory and return a :class:`Result` with its
+    layout, canvases and every enabled output. Nothing is read from or
+    written to disk and nothing is printed.
+
+    :param images: Dictionary or list of ``(filename, source)`` tuples.
+                   Every source can be bytes, a binary file-like object or
+                   a Pil image.
+    :param options: :class:`Options`.
+    :param name: Name of the sprite.
+    """
+    options = options or Options()
+    options.validate()
+    if isinstance(images, dict):
+        images = list(images.items())
+
+    sprite = MemorySprite(name, images, options.get_config())
+    sprite.validate()
+
+    files = OrderedDict()
+    for format_name in sprite.config['enabled_formats']:
+        format = formats[format_name](sprite=sprite)
+        format.validate()
+        for path, content in format.outputs():
+            files[get_output_name(path)] = content
+    return Result(sprite, files)
@@ -2,19 +2,21 @@
 import os
 import sys
 import argparse
+import threading
 
 from PIL import Image as PImage
 
 from glue.formats import formats
-from glue.helpers import redirect_stdout
+from glue.helpers import redirect_stdout, default_cache_dir
+from glue.watchers import InotifyWatcher, watcher_backends
 from glue import exceptions
 from glue import managers
 from glue import __version__
 
 
-def main(argv=None):
-
-    argv = (argv or sys.argv)[1:]
+def get_parser():
+    """Return the argument parser of glue and a dictionary with the
+    ``dest`` and name of every deprecated argument."""
 
     parser = argparse.ArgumentParser(usage=("%(prog)s [source | --source | -s] [output | --output | -o]"))
 
@@ -49,6 +51,39 @@ def main(argv=None):
                         default=os.environ.get('GLUE_FOLLOW_LINKS', False),
                         help="Follow symbolic links.")
 
+    parser.add_argument("--include",
+                        dest="include",
+                        type=str,
+                        default=os.environ.get('GLUE_INCLUDE', None),
+                        metavar='PATTERNS',
+                        help=("Comma separated glob patterns. Only the images "
+                              "matching one of them are used."))
+
+    parser.add_argument("--exclude",
+                        dest="exclude",
+                        type=str,
+                        default=os.environ.get('GLUE_EXCLUDE', None),
+                        metavar='PATTERNS',
+                        help=("Comma separated glob patterns of files and "
+                              "directories to ignore. Excluded directories "
+                              "are never scanned."))
+
+    parser.add_argument("--ignore-file",
+                        dest="ignore_file",
+                        type=str,
+                        default=os.environ.get('GLUE_IGNORE_FILE', '.glueignore'),
+                        metavar='NAME',
+                        help=("Name of the files listing patterns to ignore "
+                              "inside their directory. Use an empty value to "
+                              "disable them (default: .glueignore)"))
+
+    parser.add_argument("--discovery-stats",
+                        dest="discovery_stats",
+                        action='store_true',
+                        default=os.environ.get('GLUE_DISCOVERY_STATS', False),
+                        help=("Print how many directories were scanned to "
+                              "find the images and how long it took."))
+
     parser.add_argument("-f", "--force",
                         dest="force",
                         action='store_true',
@@ -64,12 +99,74 @@ def main(argv=None):
                         help=("Watch the source folder for changes and rebuild "
                               "when new files appear, disappear or change."))
 
+    parser.add_argument("--watch-backend",
+                        dest="watch_backend",
+                        type=str,
+                        default=os.environ.get('GLUE_WATCH_BACKEND', 'auto'),
+                        choices=watcher_backends,
+                        help=("How --watch detects changes: inotify, poll or "
+                              "auto to use inotify if available (default: auto)"))
+
+    parser.add_argument("--watch-interval",
+                        dest="watch_interval",
+                        type=float,
+                        default=os.environ.get('GLUE_WATCH_INTERVAL', 0.2),
+                        metavar='SECONDS',
+                        help=("Seconds between two scans of the source folder "
+                              "while using --watch-backend=poll (default: 0.2)"))
+
+    parser.add_argument("--watch-debounce",
+                        dest="watch_debounce",
+                        type=float,
+                        default=os.environ.get('GLUE_WATCH_DEBOUNCE', 0.1),
+                        metavar='SECONDS',
+                        help=("Seconds without changes --watch waits before "
+                              "building (default: 0.1)"))
+
+    parser.add_argument("--watch-cache-size",
+                        dest="watch_cache_size",
+                        type=int,
+                        default=os.environ.get('GLUE_WATCH_CACHE_SIZE', 256),
+                        metavar='MB',
+                        help=("Memory used by --watch to keep decoded images "
+                              "between builds, 0 to disable it (default: 256)"))
+
+    parser.add_argument("--serve-host",
+                        dest="serve_host",
+                        type=str,
+                        default=os.environ.get('GLUE_SERVE_HOST', '127.0.0.1'),
+                        metavar='HOST',
+                        help=("Address glue serve listens on "
+                              "(default: 127.0.0.1)"))
+
+    parser.add_argument("--serve-port",
+                        dest="serve_port",
+                        type=int,
+                        default=os.environ.get('GLUE_SERVE_PORT', 8000),
+                        metavar='PORT',
+                        help="Port glue serve listens on (default: 8000)")
+
     parser.add_argument("--project",
                         dest="project",
                         action="store_true",
                         default=os.environ.get('GLUE_PROJECT', False),
                         help="Generate sprites for multiple folders")
 
+    parser.add_argument("-j", "--jobs",
+                        dest="jobs",
+                        type=int,
+                        default=os.environ.get('GLUE_JOBS', 1),
+                        help=("Number of threads used to compose and encode "
+                              "sprite images (default: 1)"))
+
+    parser.add_argument("--cache-dir",
+                        dest="cache_dir",
+                        type=str,
+                        default=os.environ.get('GLUE_CACHE_DIR', default_cache_dir()),
+                        metavar='DIR',
+                        help=("Directory used to cache data between runs. Use "
+                              "an empty value to disable it (default: {0})".format(default_cache_dir())))
+
     parser.add_argument("-v", "--version",
                         action="version",
                         version='%(prog)s ' + __version__,
@@ -126,6 +223,25 @@ def main(argv=None):
                             action='store_true')
     add_deprecated_argument("--imagemagickpath", dest="imagemagickpath")
 
+    return parser, deprecated_arguments
+
+
+def main(argv=None):
+
+    argv = (argv or sys.argv)[1:]
+
+    # glue daemon [options]
+    if argv[:1] == ['daemon']:
+        from glue.daemon import main as daemon_main
+        return daemon_main(argv[1:])
+
+    # glue serve [source] [options]
+    serve = argv[:1] == ['serve']
+    if serve:
+        argv = argv[1:]
+
+    parser, deprecated_arguments = get_parser()
+
     # Parse input
     options, args = parser.parse_known_args(argv)
 
@@ -166,11 +282,33 @@ def main(argv=None):
         parser.error(("You must provide the folder containing the sprites "
                       "using the first positional argument or --source."))
 
+    if options.jobs < 1:
+        parser.error("--jobs must be greater than 0.")
+
+    if options.watch_interval <= 0:
+        parser.error("--watch-interval must be greater than 0.")
+
+    if options.watch_debounce < 0:
+        parser.error("--watch-debounce can't be negative.")
+
+    # Signal handlers can only be installed by the main thread
+    if (options.watch or serve) and threading.current_thread() is not threading.main_thread():
+        parser.error("--watch and glue serve can't be used by builds running in other threads (e.g. glue daemon).")
+
+    if options.watch_backend == 'inotify' and not InotifyWatcher.available():
+        parser.error("--watch-backend=inotify is only available on Linux.")
+
     # Make absolute both source and output if present
     if not os.path.isdir(options.source):
         parser.error("Directory not found: '{0}'".format(options.source))
 
     options.source = os.path.abspath(options.source)
+
+    # glue serve doesn't write anything, so every output is served as if
+    # it was inside the source directory unless they are set.
+    if serve and not options.output:
+        options.output = options.source
+
     if options.output:
         options.output = os.path.abspath(options.output)
 
@@ -222,7 +360,12 @@ def main(argv=None):
         manager_cls = managers.SimpleManager
 
     # Generate manager or defer the creation to a WatchManager
-    if options.watch:
+    if serve:
+        try:
+            manager = managers.ServeManager(manager_cls, vars(options))
+        except (IOError, OSError) as e:
+            parser.error("Can't listen on {0}:{1}: {2}".format(options.serve_host, options.serve_port, e.strerror))
+    elif options.watch:
         manager = managers.WatchManager(manager_cls, vars(options))
     else:
         manager = manager_cls(**vars(options))
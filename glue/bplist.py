@@ -0,0 +1,95 @@
+import os
+import struct
+
+
+BPLIST_HEADER = b'bplist00'
+BPLIST_TRAILER = struct.Struct('>6xBBQQQ')
+
+
+class BinaryPlistReader(object):
+    """Read single objects of a binary plist file without loading it.
+
+    Every object is located using the offset table, so reading a value
+    only requires a few small reads no matter how big the file is.
+    Only dictionaries, strings and integers are supported.
+    """
+
+    def __init__(self, fileobj):
+        """Reader constructor.
+
+        :param fileobj: Binary file-like object supporting ``seek``.
+        """
+        self.fileobj = fileobj
+        fileobj.seek(0)
+        if fileobj.read(len(BPLIST_HEADER)) != BPLIST_HEADER:
+            raise ValueError("Not a binary plist file.")
+        fileobj.seek(-BPLIST_TRAILER.size, os.SEEK_END)
+        (self.offset_size, self.ref_size, self.num_objects,
+         self.top_object, self.offset_table) = BPLIST_TRAILER.unpack(self._read(BPLIST_TRAILER.size))
+
+    def lookup(self, *keys):
+        """Return the reference of the object found following ``keys``
+        from the top-level dictionary.
+
+        :param keys: Keys of each nested dictionary.
+        """
+        ref = self.top_object
+        for key in keys:
+            refs = self.read_dict(ref)
+            if key not in refs:
+                raise ValueError("Key '{0}' not found.".format(key))
+            ref = refs[key]
+        return ref
+
+    def read_dict(self, ref):
+        """Return a dictionary with the reference of every value of the
+        dictionary ``ref``. Values are not read.
+
+        :param ref: Object reference.
+        """
+        kind, info = self._seek_object(ref)
+        if kind != 0xD:
+            raise ValueError("Object {0} is not a dictionary.".format(ref))
+        count = self._read_count(info)
+        refs = [self._read_uint(self.ref_size) for i in range(count * 2)]
+        return dict((self.read_string(key), value) for key, value in zip(refs[:count], refs[count:]))
+
+    def read_string(self, ref):
+        """Return the string ``ref``.
+
+        :param ref: Object reference.
+        """
+        kind, info = self._seek_object(ref)
+        if kind == 0x5:
+            return self._read(self._read_count(info)).decode('ascii')
+        if kind == 0x6:
+            return self._read(self._read_count(info) * 2).decode('utf-16be')
+        raise ValueError("Object {0} is not a string.".format(ref))
+
+    def _seek_object(self, ref):
+        if ref >= self.num_objects:
+            raise ValueError("Invalid object reference {0}.".format(ref))
+        self.fileobj.seek(self.offset_table + ref * self.offset_size)
+        self.fileobj.seek(self._read_uint(self.offset_size))
+        marker = bytearray(self._read(1))[0]
+        return marker >> 4, marker & 0xF
+
+    def _read_count(self, info):
+        if info != 0xF:
+            return info
+        marker = bytearray(self._read(1))[0]
+        if marker >> 4 != 0x1:
+            raise ValueError("Invalid object length.")
+        return self._read_uint(1 << (marker & 0xF))
+
+    def _read_uint(self, size):
+        value = 0
+        for byte in bytearray(self._read(size)):
+            value = value << 8 | byte
+        return value
+
+    def _read(self, size):
+        data = self.fileobj.read(size)
+        if len(data) != size:
+            raise ValueError("Unexpected end of file.")
+        return data
@@ -0,0 +1,77 @@
+import threading
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+
+
+class MemoryCache(object):
+    """LRU cache bounded by memory.
+
+    Entries are indexed by key and store a ``stamp`` used to discard
+    outdated versions, so only the latest version of every key is kept. It
+    can be shared by several threads.
+    """
+
+    def __init__(self, max_size):
+        """Cache constructor.
+
+        :param max_size: Maximum size of every entry together in bytes.
+        """
+        self.max_size = max_size
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, stamp):
+        """Return the value stored for ``key`` or ``None`` if there is
+        no entry for it or it was stored using another ``stamp``.
+
+        :param key: Key of the entry.
+        :param stamp: Version of the entry.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != stamp:
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, stamp, value, size):
+        """Store ``value`` replacing any other version of ``key`` and
+        discard the least recently used entries if required.
+
+        :param key: Key of the entry.
+        :param stamp: Version of the entry.
+        :param value: Value to store.
+        :param size: Approximate size of ``value`` in bytes.
+        """
+        with self.lock:
+            self.discard(key)
+            if size > self.max_size:
+                return
+            self.entries[key] = (stamp, value, size)
+            self.size += size
+            while self.size > self.max_size:
+                self.size -= self.entries.popitem(last=False)[1][2]
+
+    def discard(self, key):
+        """Remove the entry of ``key`` if any."""
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.size -= entry[2]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+class ImageCache(MemoryCache):
+    """Cache of decoded source images indexed by path. The stamp of every
+    entry is the mtime and size of the files of the image."""
@@ -6,12 +6,20 @@ import hashlib
 import io
 import configparser
 
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+
 from PIL import Image as PILImage
 
 from glue.algorithms import algorithms
+from glue.discovery import Discovery
+from glue.geometry import FrameStore
 from glue.helpers import cached_property, round_up
 from glue.formats import ImageFormat
-from glue.exceptions import SourceImagesNotFoundError, PILUnavailableError
+from glue.exceptions import (SourceImagesNotFoundError, PILUnavailableError,
+                             ValidationError)
 
 
 class ConfigurableFromFile(object):
@@ -34,56 +42,184 @@ class ConfigurableFromFile(object):
 
 class Image(ConfigurableFromFile):
 
-    def __init__(self, path, config):
+    # Optional glue.cache.ImageCache used to reuse decoded images between
+    # builds of long-running processes like --watch.
+    cache = None
+
+    # Print a line every time an image is added to a sprite
+    verbose = True
+
+    def __init__(self, path, config, filename=None, variants=None):
         self.path = path
-        self.filename = os.path.basename(path)
+        self.filename = filename or os.path.basename(path)
         self.dirname = self.config_path = os.path.dirname(path)
 
         self.config = copy.deepcopy(config)
         self.config.update(self._get_config_from_file('sprite.conf', self.filename))
 
-        self.x = self.y = None
+        self._x = self._y = None
+        self.frames = self.index = None
         self.original_width = self.original_height = 0
+        self._scaled = {}
+        self._variants = variants or {}
 
+        if not self._restore():
+            self._load()
+
+        if self.verbose:
+            print(("\t{0} added to sprite".format(self.filename)))
+
+    def _load(self):
+        """Read the data of this image and its variants."""
         with open(self.path, "rb") as img:
             self._image_data = img.read()
 
-        print(("\t{0} added to sprite".format(self.filename)))
+        # Native variants of this image for other ratios (name@<ratio>x.png)
+        self._variants_data = {}
+        for ratio, variant_path in self._variants.items():
+            if variant_path == self.path:
+                self._variants_data[ratio] = self._image_data
+            else:
+                with open(variant_path, "rb") as img:
+                    self._variants_data[ratio] = img.read()
 
     @cached_property
-    def image(self):
-        """Return a Pil representation of this image """
+    def stamp(self):
+        """Return the version of this image for :attr:`cache`: the mtime
+        and size of every file and the settings used to decode them."""
+        files = []
+        for ratio, path in sorted(dict(self._variants, source=self.path).items(), key=lambda v: str(v[0])):
+            st = os.stat(path)
+            files.append((ratio, path, st.st_mtime_ns, st.st_size))
+        return tuple(files), bool(self.config['crop']), tuple(self.config['ratios'])
+
+    def _restore(self):
+        """Load the data and decoded images of this image from
+        :attr:`cache` if they are available. Return ``True`` on success."""
+        if self.cache is None:
+            return False
+        try:
+            entry = self.cache.get(self.path, self.stamp)
+        except OSError:
+            return False
+        if entry is None:
+            return False
+        self._image_data, self._variants_data, image, original_size, scaled = entry
+        self.__dict__['image'] = image
+        self.original_width, self.original_height = original_size
+        self._scaled = dict(scaled)
+        return True
+
+    def remember(self):
+        """Store the data and decoded images of this image in :attr:`cache`
+        so new instances of this image don't need to read or decode it
+        again while it doesn't change."""
+        if self.cache is None or 'image' not in self.__dict__:
+            return
+        image = self.__dict__['image']
+        variants = [d for d in self._variants_data.values() if d is not self._image_data]
+        size = (len(self._image_data) + sum(len(d) for d in variants) +
+                sum(i.size[0] * i.size[1] * 4 for i in [image] + list(self._scaled.values())))
+        try:
+            self.cache.put(self.path, self.stamp,
+                           (self._image_data, self._variants_data, image,
+                            (self.original_width, self.original_height), dict(self._scaled)),
+                           size)
+        except OSError:
+            self.cache.discard(self.path)
+
+    def _decode(self, data):
+        """Return a RGBA Pil representation of this image data and its
+        original size."""
 
         if sys.version < '3':
-            imageio = io.StringIO(self._image_data)
+            imageio = io.StringIO(data)
         else:
-            imageio = io.BytesIO(self._image_data)
+            imageio = io.BytesIO(data)
 
         try:
-            source_image = PILImage.open(imageio)
-            img = PILImage.new('RGBA', source_image.size, (0, 0, 0, 0))
-
-            if source_image.mode == 'L':
-                alpha = source_image.split()[0]
-                transparency = source_image.info.get('transparency')
-                mask = PILImage.eval(alpha, lambda a: 0 if a == transparency else 255)
-                img.paste(source_image, (0, 0), mask=mask)
-            else:
-                img.paste(source_image, (0, 0))
+            return self._convert(PILImage.open(imageio))
         except IOError as e:
             raise PILUnavailableError(e.args[0].split()[1])
         finally:
             imageio.close()
 
-        self.original_width, self.original_height = img.size
+    def _convert(self, source_image):
+        """Return a RGBA copy of a Pil image and its original size."""
+        img = PILImage.new('RGBA', source_image.size, (0, 0, 0, 0))
+
+        if source_image.mode == 'L':
+            alpha = source_image.split()[0]
+            transparency = source_image.info.get('transparency')
+            mask = PILImage.eval(alpha, lambda a: 0 if a == transparency else 255)
+            img.paste(source_image, (0, 0), mask=mask)
+        else:
+            img.paste(source_image, (0, 0))
+
+        original_size = img.size
 
         # Crop the image searching for the smallest possible bounding box
         # without losing any non-transparent pixel.
         # This crop is only used if the crop flag is set in the config.
         if self.config['crop']:
             img = img.crop(img.split()[-1].getbbox())
+        return img, original_size
+
+    @cached_property
+    def image(self):
+        """Return a Pil representation of this image """
+        img, (self.original_width, self.original_height) = self._decode(self._image_data)
         return img
 
+    def scaled_size(self, ratio):
+        """Return the size of this image scaled down from the max ratio to
+        ``ratio`` without scaling it.
+
+        :param ratio: Target ratio.
+        """
+        max_ratio = max(self.config['ratios'])
+        if ratio == max_ratio:
+            return self.image.size
+        return (max(1, round_up(self.width / max_ratio * ratio)),
+                max(1, round_up(self.height / max_ratio * ratio)))
+
+    def scaled(self, ratio, cache=True):
+        """Return a Pil representation of this image scaled down from the
+        max ratio to ``ratio``.
+
+        If a native variant of this image exists for this ratio it will be
+        used instead of scaling the image. Integer factors use Pillow's fast
+        ``reduce`` when available. Every
+        scaled version is cached so other formats and later builds using
+        this same image can reuse it.
+
+        :param ratio: Target ratio.
+        :param cache: Keep the scaled version of this image. Already cached
+                      versions are used anyway.
+        """
+        max_ratio = max(self.config['ratios'])
+        if ratio == max_ratio:
+            return self.image
+
+        if ratio not in self._scaled:
+            size = self.scaled_size(ratio)
+            factor = max_ratio / ratio
+            if ratio in self._variants_data:
+                # Use the native variant designed for this ratio
+                img = self._decode(self._variants_data[ratio])[0]
+                if img.size != size:
+                    img = img.resize(size, PILImage.ANTIALIAS)
+            elif factor == int(factor) and hasattr(self.image, 'reduce'):
+                img = self.image.reduce(int(factor))
+                if img.size != size:
+                    img = img.resize(size, PILImage.ANTIALIAS)
+            else:
+                img = self.image.resize(size, PILImage.ANTIALIAS)
+            if not cache:
+                return img
+            self._scaled[ratio] = img
+        return self._scaled[ratio]
+
     @property
     def width(self):
         """Return Image width"""
@@ -95,11 +231,50 @@ class Image(ConfigurableFromFile):
         return self.image.size[1]
 
     @property
+    def x(self):
+        """Return the x position of this image inside the canvas."""
+        if self.frames is None:
+            return self._x
+        return self.frames.x[self.index]
+
+    @x.setter
+    def x(self, value):
+        if self.frames is None:
+            self._x = value
+        else:
+            self.frames.x[self.index] = value
+            self.frames.invalidate()
+
+    @property
+    def y(self):
+        """Return the y position of this image inside the canvas."""
+        if self.frames is None:
+            return self._y
+        return self.frames.y[self.index]
+
+    @y.setter
+    def y(self, value):
+        if self.frames is None:
+            self._y = value
+        else:
+            self.frames.y[self.index] = value
+            self.frames.invalidate()
+
+    def attach(self, frames, index):
+        """Store the geometry of this image inside a
+        :class:`~glue.geometry.FrameStore`.
+
+        :param frames: :class:`~glue.geometry.FrameStore`.
+        :param index: Index of this image inside the store.
+        """
+        self.frames, self.index = frames, index
+
+    @cached_property
     def padding(self):
         """Return a 4-elements list with the desired padding."""
         return self._generate_spacing_info(self.config['padding'])
 
-    @property
+    @cached_property
     def margin(self):
         """Return a 4-elements list with the desired marging."""
         return self._generate_spacing_info(self.config['margin'])
@@ -168,13 +343,27 @@ class Sprite(ConfigurableFromFile):
     config_filename = 'sprite.conf'
     config_section = 'sprite'
     valid_extensions = ['png', 'jpg', 'jpeg', 'gif']
+    variant_re = re.compile(r'^(?P<name>.+)@(?P<ratio>\d+(\.\d+)?)x$')
+
+    # Settings that never change the output of a sprite
+    unhashed_settings = ('cache_dir', 'jobs', 'strip_height', 'watch_backend', 'watch_interval',
+                         'watch_cache_size', 'watch_debounce', 'serve_host', 'serve_port',
+                         'discovery_stats')
 
-    def __init__(self, path, config, name=None):
+    # Print the name of the sprite while processing it
+    verbose = True
+
+    def __init__(self, path, config, name=None, discovery=None):
         self.path = self.config_path = path
         self.config = copy.deepcopy(config)
         self.config.update(self._get_config_from_file('sprite.conf', 'sprite'))
         self.name = name or self.config.get('name', os.path.basename(path))
 
+        # The sprite configuration file can change how images are found
+        if discovery is None or any(self.config.get(k) != config.get(k) for k in Discovery.settings):
+            discovery = Discovery.from_config(self.config.get('source') or path, self.config)
+        self.discovery = discovery
+
         # Setup ratios
         ratios = self.config['ratios'].split(',')
         ratios = set([float(r.strip()) for r in ratios if r.strip()])
@@ -187,8 +376,12 @@ class Sprite(ConfigurableFromFile):
         self.max_ratio = max(self.ratios)
         self.config['ratios'] = self.ratios
 
+        # Data shared by every format of this sprite (e.g. render contexts)
+        self.cache = {}
+
         # Discover images inside this sprite
         self.images = self._locate_images()
+        self.frames = FrameStore(self.images, self.ratios)
 
         img_format = ImageFormat(sprite=self)
         for ratio in ratios:
@@ -196,7 +389,8 @@ class Sprite(ConfigurableFromFile):
             if ratio_output_key not in self.config:
                 self.config[ratio_output_key] = img_format.output_path(ratio)
 
-        print(("Processing '{0}':".format(self.name)))
+        if self.verbose:
+            print(("Processing '{0}':".format(self.name)))
 
         # Generate sprite map
         self.process()
@@ -219,8 +413,13 @@ class Sprite(ConfigurableFromFile):
         for image in self.images:
             hash_list.append(os.path.relpath(image.path))
             hash_list.append(image._image_data)
+            for ratio in sorted(image._variants_data):
+                hash_list.append(ratio)
+                hash_list.append(image._variants_data[ratio])
 
         for key, value in self.config.items():
+            if key in self.unhashed_settings:
+                continue
             hash_list.append(key)
             hash_list.append(value)
 
@@ -248,29 +447,76 @@ class Sprite(ConfigurableFromFile):
         """Return all valid images within a folder.
 
         All files with a extension not included in
-        (png, jpg, jpeg and gif) or beginning with '.' will be ignored.
+        (png, jpg, jpeg and gif) or beginning with '.' will be ignored, and
+        so will every file or directory excluded by :attr:`discovery`.
 
         If the folder doesn't contain any valid image it will raise
         :class:`~SourceImagesNotFoundError`
 
+        If ``native_ratios`` is enabled, files named ``name@<ratio>x`` will
+        be grouped with the rest of the variants of ``name``.
+
         The list of images will be ordered using the desired ordering
         algorithm. The default is 'maxside'.
         """
-        extensions = '|'.join(self.valid_extensions)
-        extension_re = re.compile('.+\.(%s)$' % extensions, re.IGNORECASE)
-        files = sorted(os.listdir(self.path))
-
-        images = []
-        for root, dirs, files in os.walk(self.path, followlinks=self.config['follow_links']):
-            for filename in sorted(files):
-                if not filename.startswith('.') and extension_re.match(filename):
-                    images.append(Image(path=os.path.join(root, filename), config=self.config))
-            if not self.config['recursive']:
-                break
+        paths = self.discovery.find_images(self.path, self.valid_extensions, self.config['recursive'])
+
+        if self.config['native_ratios']:
+            images = [Image(path=variants[self.max_ratio], config=self.config,
+                            filename=filename, variants=variants)
+                      for filename, variants in self._group_variants(paths)]
+        else:
+            images = [Image(path=path, config=self.config) for path in paths]
 
+        return self._sort_images(images)
+
+    def _sort_images(self, images):
+        """Return ``images`` sorted using the ordering algorithm or raise
+        :class:`~SourceImagesNotFoundError` if there is no image."""
         if not images:
             raise SourceImagesNotFoundError(self.path)
 
-        images = sorted(images, reverse=self.config['algorithm_ordering'][0] != '-')
+        return sorted(images, reverse=self.config['algorithm_ordering'][0] != '-')
+
+    def _group_variants(self, paths):
+        """Group ``paths`` by base name and return a list of
+        ``(filename, variants)`` tuples where ``variants`` is a dictionary
+        of ``{ratio: path}``.
+
+        Files without a ``@<ratio>x`` suffix are considered ``1x`` variants
+        unless they are the only file of their group. In that case they are
+        considered the biggest version as glue usually does.
 
-        return images
+        If any group doesn't contain a variant for the biggest ratio it will
+        raise :class:`~ValidationError`.
+        """
+        groups = OrderedDict()
+        for path in paths:
+            root, filename = os.path.split(path)
+            name, extension = os.path.splitext(filename)
+            match = self.variant_re.match(name)
+            if match:
+                name, ratio = match.group('name'), float(match.group('ratio'))
+            else:
+                ratio = None
+            group = groups.setdefault((root, name), {'extension': extension, 'files': []})
+            group['files'].append((ratio, path))
+            if ratio is None:
+                group['extension'] = extension
+
+        result, missing = [], []
+        for (root, name), group in groups.items():
+            files = group['files']
+            if len(files) == 1 and files[0][0] is None:
+                variants = {self.max_ratio: files[0][1]}
+            else:
+                variants = dict((1.0 if r is None else r, p) for r, p in files if (r or 1.0) in self.ratios)
+            if self.max_ratio not in variants:
+                missing.append(os.path.join(root, name))
+                continue
+            result.append(('{0}{1}'.format(name, group['extension']), variants))
+
+        if missing:
+            missing = '\n'.join(['\t{0}@{1:g}x'.format(os.path.relpath(m), self.max_ratio) for m in missing])
+            raise ValidationError("Error: Some images don't have a variant for the biggest ratio:\n{0}".format(missing))
+        return result
@@ -0,0 +1,376 @@
+import os
+import sys
+import json
+import hmac
+import errno
+import socket
+import binascii
+import ipaddress
+import signal
+import argparse
+import tempfile
+import threading
+import socketserver
+from io import StringIO
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from glue.cache import ImageCache
+from glue.core import Image
+from glue.helpers import ThreadLocalStream, redirect_stdout, redirect_stderr, default_cache_dir
+from glue.bin import main as glue_main
+
+
+def default_socket_path():
+    """Return the default path of the daemon Unix socket."""
+    return os.path.join(tempfile.gettempdir(), 'glue-{0}.sock'.format(os.getuid()))
+
+
+def default_token_path():
+    """Return the default path of the file with the token HTTP requests
+    must send."""
+    return os.path.join(os.environ.get('GLUE_CACHE_DIR') or default_cache_dir(), 'daemon-token')
+
+
+def read_token(path):
+    """Return the token stored in ``path``, creating the file with a new
+    random token only readable by the current user if it doesn't exist.
+
+    :param path: Path of the token file.
+    """
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname, 0o700)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+        with open(path) as f:
+            token = f.read().strip()
+        if not token:
+            raise ValueError("The token file {0} is empty.".format(path))
+        return token
+
+    token = binascii.hexlify(os.urandom(32)).decode('ascii')
+    with os.fdopen(fd, 'w') as f:
+        f.write(token + '\n')
+    return token
+
+
+def is_loopback(host):
+    """Return ``True`` if ``host`` is only reachable from this machine."""
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def parse_request(data):
+    """Return the list of arguments of a JSON build request like
+    ``{"argv": ["source", "output", "--project"]}``.
+
+    :param data: Request body as bytes.
+    """
+    try:
+        argv = json.loads(data.decode('utf-8'))['argv']
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Invalid request.")
+    if not isinstance(argv, list) or not all(isinstance(arg, str) for arg in argv):
+        raise ValueError("Invalid request: argv must be a list of strings.")
+    return argv
+
+
+def request(argv, path=None):
+    """Ask the daemon listening on ``path`` to run glue using ``argv`` and
+    return its response: a dictionary with the exit ``code`` and the
+    ``stdout`` and ``stderr`` of the build.
+
+    :param argv: List of arguments, as used in the command line.
+    :param path: Path of the daemon Unix socket.
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path or default_socket_path())
+        client.sendall(json.dumps({'argv': argv}).encode('utf-8') + b'\n')
+        f = client.makefile('rb')
+        try:
+            return json.loads(f.readline().decode('utf-8'))
+        finally:
+            f.close()
+    finally:
+        client.close()
+
+
+class UnixBuildHandler(socketserver.StreamRequestHandler):
+    """Read one JSON request per line and write one JSON response per line."""
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                response = self.server.builder.build(parse_request(line))
+            except ValueError as e:
+                response = {'error': e.args[0]}
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class HTTPBuildHandler(BaseHTTPRequestHandler):
+    """Run the JSON request sent as the body of every ``POST``.
+
+    Every request must send the token of the server in the
+    ``X-Glue-Token`` header, as any local user can connect to a TCP port.
+    Browsers can send ``POST`` requests to any address, so requests must
+    also use the ``application/json`` content type (which browsers can't
+    send to another origin without a preflight request the daemon never
+    accepts) and requests sent by web pages (with an ``Origin`` header)
+    are rejected.
+    """
+
+    def do_POST(self):
+        token = self.headers.get('X-Glue-Token') or ''
+        if not hmac.compare_digest(token.encode('utf-8'), self.server.token.encode('utf-8')):
+            return self.send_json(401, {'error': "Invalid or missing X-Glue-Token header."})
+
+        content_type = (self.headers.get('Content-Type') or '').split(';')[0].strip().lower()
+        if self.headers.get('Origin') is not None:
+            return self.send_json(403, {'error': "Requests from web pages are not allowed."})
+        if content_type != 'application/json':
+            return self.send_json(415, {'error': "The content type must be application/json."})
+
+        data = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        try:
+            status, response = 200, self.server.builder.build(parse_request(data))
+        except ValueError as e:
+            status, response = 400, {'error': e.args[0]}
+        self.send_json(status, response)
+
+    def send_json(self, status, response):
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UnixBuildServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    daemon_threads = True
+
+    def __init__(self, path, builder):
+        self.builder = builder
+        self.remove_stale_socket(path)
+
+        # Only the current user can connect to the socket
+        umask = os.umask(0o077)
+        try:
+            socketserver.UnixStreamServer.__init__(self, path, UnixBuildHandler)
+        finally:
+            os.umask(umask)
+
+    @staticmethod
+    def remove_stale_socket(path):
+        """Remove ``path`` if it is the socket of a daemon that is no
+        longer running."""
+        if not os.path.exists(path):
+            return
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            client.connect(path)
+        except socket.error:
+            os.unlink(path)
+            return
+        finally:
+            client.close()
+        raise socket.error(errno.EADDRINUSE, "Another daemon is listening on {0}.".format(path))
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+
+class HTTPBuildServer(socketserver.ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, builder, token):
+        self.builder = builder
+        self.token = token
+        HTTPServer.__init__(self, address, HTTPBuildHandler)
+
+
+class BuildDaemon(object):
+    """Run the builds requested by other processes, so they don't pay the
+    start-up cost of glue on every build.
+
+    Every request runs in its own thread using the same arguments
+    :func:`glue.bin.main` accepts. Decoded images and compiled templates
+    are kept in memory and shared by every build.
+    """
+
+    def __init__(self, cache_size=256):
+        """Daemon constructor.
+
+        :param cache_size: Memory in MB used to keep decoded images, ``0``
+                           to disable it.
+        """
+        self.servers = []
+        cache_size = cache_size * 1024 * 1024
+        self.image_cache = ImageCache(cache_size) if cache_size > 0 else None
+
+    def listen_unix(self, path):
+        """Listen for requests on the Unix socket ``path``."""
+        server = UnixBuildServer(path, self)
+        self.servers.append(server)
+        return server
+
+    def listen_http(self, host, port, token):
+        """Listen for HTTP requests on ``host:port``. Only requests sending
+        ``token`` in the ``X-Glue-Token`` header are accepted.
+
+        Anyone able to connect and knowing the token can write any file
+        the daemon user can write and run any template, so the token must
+        be kept secret.
+        """
+        if not token:
+            raise ValueError("HTTP requests require a token.")
+        server = HTTPBuildServer((host, port), self, token)
+        self.servers.append(server)
+        return server
+
+    def build(self, argv):
+        """Run glue using ``argv`` and return a dictionary with the exit
+        ``code`` and the ``stdout`` and ``stderr`` of the build.
+
+        :param argv: List of arguments, as used in the command line.
+        """
+        stdout, stderr = StringIO(), StringIO()
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            try:
+                code = glue_main(['glue'] + argv)
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else int(e.code is not None)
+        return {'code': code, 'stdout': stdout.getvalue(), 'stderr': stderr.getvalue()}
+
+    def serve_forever(self):
+        """Handle requests until :meth:`shutdown` is called or the process
+        is interrupted."""
+        streams = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = ThreadLocalStream(sys.stdout), ThreadLocalStream(sys.stderr)
+        Image.cache = self.image_cache
+
+        threads = [threading.Thread(target=server.serve_forever) for server in self.servers]
+        try:
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(0.5)
+        finally:
+            self.shutdown()
+            self.close()
+            Image.cache = None
+            sys.stdout, sys.stderr = streams
+
+    def shutdown(self):
+        """Stop :meth:`serve_forever`. It must be called from another
+        thread."""
+        for server in self.servers:
+            server.shutdown()
+
+    def close(self):
+        """Close every server."""
+        while self.servers:
+            self.servers.pop().server_close()
+
+
+def main(argv):
+
+    parser = argparse.ArgumentParser(prog="glue daemon",
+                                     description="Keep glue running and build sprites on demand.")
+
+    parser.add_argument("--socket",
+                        dest="socket",
+                        type=str,
+                        default=os.environ.get('GLUE_DAEMON_SOCKET', None),
+                        metavar='PATH',
+                        help=("Unix socket to listen on "
+                              "(default: {0})".format(default_socket_path())))
+
+    parser.add_argument("--http",
+                        dest="http",
+                        type=str,
+                        default=os.environ.get('GLUE_DAEMON_HTTP', None),
+                        metavar='[HOST:]PORT',
+                        help=("Listen for HTTP requests on this address. The "
+                              "Unix socket is only used if --socket is set."))
+
+    parser.add_argument("--token-file",
+                        dest="token_file",
+                        type=str,
+                        default=os.environ.get('GLUE_DAEMON_TOKEN_FILE', None),
+                        metavar='PATH',
+                        help=("File with the token HTTP requests must send, "
+                              "created if it doesn't exist "
+                              "(default: {0})".format(default_token_path())))
+
+    parser.add_argument("--cache-size",
+                        dest="cache_size",
+                        type=int,
+                        default=os.environ.get('GLUE_DAEMON_CACHE_SIZE', 256),
+                        metavar='MB',
+                        help=("Memory used to keep decoded images between "
+                              "builds, 0 to disable it (default: 256)"))
+
+    options = parser.parse_args(argv)
+
+    http_address = None
+    if options.http:
+        host, _, port = options.http.rpartition(':')
+        if not port.isdigit():
+            parser.error("--http must be a port or a HOST:PORT address.")
+        http_address = (host or '127.0.0.1', int(port))
+    elif not options.socket:
+        options.socket = default_socket_path()
+
+    daemon = BuildDaemon(options.cache_size)
+    try:
+        if options.socket:
+            daemon.listen_unix(options.socket)
+            print("Listening on {0}".format(options.socket))
+        if http_address:
+            token_file = options.token_file or default_token_path()
+            try:
+                token = read_token(token_file)
+            except ValueError as e:
+                parser.error(e.args[0])
+            if not is_loopback(http_address[0]):
+                sys.stderr.write("WARNING: {0} can be reached from other machines. Anyone with the token can "
+                                 "write any file you can write and run any template. The token is sent "
+                                 "unencrypted.\n".format(http_address[0]))
+            server = daemon.listen_http(http_address[0], http_address[1], token)
+            print("Listening on http://{0}:{1}/ (token in {2})".format(server.server_address[0],
+                                                                       server.server_address[1], token_file))
+    except (socket.error, OSError) as e:
+        daemon.close()
+        sys.stderr.write("Error: {0}\n".format(e.strerror or e))
+        return 1
+
+    # Stop gracefully on SIGTERM as on Ctrl+C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
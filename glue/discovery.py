@@ -0,0 +1,221 @@
+import os
+import time
+import fnmatch
+
+from glue.helpers import split_list
+
+
+class Discovery(object):
+    """Find sprite directories and images using ``os.scandir``, so the
+    type of every entry comes from the directory listing itself.
+
+    Hidden files are always ignored, and so are hidden directories of a
+    project, but images inside hidden subdirectories of a sprite are found
+    unless they are excluded (e.g. using the ``.*/`` pattern). Files and
+    directories matching an ``exclude`` pattern or a pattern of an ignore
+    file are ignored too, and excluded directories are never scanned. If
+    there are ``include`` patterns, only the images matching one of them
+    are used.
+
+    Patterns are shell-style globs. Patterns including a ``/`` are matched
+    against the path relative to ``root`` (or to the directory of their
+    ignore file) and the rest against the name of each entry. Patterns
+    ending with ``/`` only match directories.
+
+    The time spent scanning and the number of directories and entries
+    scanned are kept in :attr:`seconds`, :attr:`directories` and
+    :attr:`entries`.
+    """
+
+    # Settings used by :meth:`from_config`
+    settings = ('include', 'exclude', 'ignore_file', 'follow_links')
+
+    def __init__(self, root, include=None, exclude=None, ignore_filename='.glueignore', follow_links=False):
+        """Discovery constructor.
+
+        :param root: Source directory. Patterns are relative to it.
+        :param include: List or comma separated string of patterns.
+        :param exclude: List or comma separated string of patterns.
+        :param ignore_filename: Name of the files including one exclude
+                                pattern per line for their directory.
+        :param follow_links: Search inside symlinked directories.
+        """
+        self.root = os.path.abspath(root)
+        self.include = split_list(include) if isinstance(include, str) else list(include or [])
+        self.exclude = split_list(exclude) if isinstance(exclude, str) else list(exclude or [])
+        self.ignore_filename = ignore_filename
+        self.follow_links = follow_links
+        self.seconds = 0.0
+        self.directories = self.entries = 0
+        self._ignore_files = {}
+
+    @classmethod
+    def from_config(cls, root, config):
+        """Return a discovery using the settings of a sprite or project.
+
+        :param root: Source directory.
+        :param config: Configuration dictionary.
+        """
+        return cls(root, include=config.get('include'), exclude=config.get('exclude'),
+                   ignore_filename=config.get('ignore_file', '.glueignore'),
+                   follow_links=config.get('follow_links', False))
+
+    def reset(self):
+        """Forget the ignore files read so far, so they are read again."""
+        self._ignore_files = {}
+
+    def find_images(self, path, extensions, recursive=False):
+        """Return the path of every image inside ``path``, sorted by name
+        inside each directory.
+
+        :param path: Sprite directory.
+        :param extensions: List of valid extensions without the dot.
+        :param recursive: Search images inside subdirectories too.
+        """
+        start = time.time()
+        extensions = tuple('.{0}'.format(e.lower()) for e in extensions)
+        paths, pending = [], [(path, self._parent_rules(path))]
+        try:
+            while pending:
+                directory, rules = pending.pop()
+                # Only errors of the sprite directory itself are raised
+                entries = self._scandir(directory, errors=directory == path)
+                rules = self._rules(directory, rules, entries)
+                subdirectories = []
+                for entry in entries:
+                    is_dir = self._is_dir(entry)
+                    if self._excluded(entry.name, entry.path, is_dir, rules):
+                        continue
+                    if is_dir:
+                        if recursive and (self.follow_links or not entry.is_symlink()):
+                            subdirectories.append((entry.path, rules))
+                    elif entry.name.lower().endswith(extensions) and self._included(entry.name, entry.path):
+                        paths.append(entry.path)
+                pending.extend(reversed(subdirectories))
+        finally:
+            self.seconds += time.time() - start
+        return paths
+
+    def find_directories(self, path):
+        """Return the path of every directory inside ``path`` sorted by
+        name.
+
+        :param path: Project directory.
+        """
+        start = time.time()
+        try:
+            entries = self._scandir(path, errors=True)
+            rules = self._rules(path, self._parent_rules(path), entries)
+            return [entry.path for entry in entries
+                    if self._is_dir(entry) and not entry.name.startswith('.') and
+                    not self._excluded(entry.name, entry.path, True, rules)]
+        finally:
+            self.seconds += time.time() - start
+
+    def is_excluded(self, path, is_dir=False):
+        """Return ``True`` if ``path`` is a hidden file or if it or any
+        directory containing it inside :attr:`root` is excluded or ignored.
+
+        :param path: Path of a file or directory.
+        :param is_dir: ``path`` is a directory.
+        """
+        relpath = os.path.relpath(os.path.abspath(path), self.root)
+        if relpath == os.curdir or relpath.startswith(os.pardir):
+            return False
+
+        parts = relpath.split(os.sep)
+        directory, rules = self.root, [(self.root, self.exclude)]
+        for index, name in enumerate(parts):
+            rules = self._rules(directory, rules)
+            directory = os.path.join(directory, name)
+            if self._excluded(name, directory, is_dir or index < len(parts) - 1, rules):
+                return True
+        return False
+
+    def _scandir(self, directory, errors=False):
+        try:
+            entries = sorted(os.scandir(directory), key=lambda e: e.name)
+        except OSError:
+            if errors:
+                raise
+            return []
+        self.directories += 1
+        self.entries += len(entries)
+        return entries
+
+    def _is_dir(self, entry):
+        try:
+            return entry.is_dir()
+        except OSError:
+            return False
+
+    def _parent_rules(self, path):
+        """Return the rules of every directory between :attr:`root` and the
+        parent of ``path``."""
+        rules = [(self.root, self.exclude)]
+        relpath = os.path.relpath(os.path.abspath(path), self.root)
+        if relpath == os.curdir or relpath.startswith(os.pardir):
+            return rules
+
+        directory = self.root
+        for name in relpath.split(os.sep):
+            rules = self._rules(directory, rules)
+            directory = os.path.join(directory, name)
+        return rules
+
+    def _rules(self, directory, rules, entries=None):
+        """Return ``rules`` plus the patterns of the ignore file of
+        ``directory`` if any.
+
+        :param entries: Entries of ``directory`` if they were already
+                        scanned, so it is only opened if it exists.
+        """
+        if not self.ignore_filename:
+            return rules
+        if entries is not None and directory not in self._ignore_files:
+            if not any(entry.name == self.ignore_filename for entry in entries):
+                self._ignore_files[directory] = []
+        patterns = self._read_ignore_file(directory)
+        return rules + [(os.path.abspath(directory), patterns)] if patterns else rules
+
+    def _read_ignore_file(self, directory):
+        if directory not in self._ignore_files:
+            try:
+                with open(os.path.join(directory, self.ignore_filename)) as f:
+                    lines = [line.strip() for line in f]
+            except (IOError, OSError):
+                lines = []
+            self._ignore_files[directory] = [l for l in lines if l and not l.startswith('#')]
+        return self._ignore_files[directory]
+
+    def _excluded(self, name, path, is_dir, rules):
+        if name.startswith('.') and not is_dir:
+            return True
+        return any(self._match(patterns, name, path, base, is_dir) for base, patterns in rules)
+
+    def _included(self, name, path):
+        return not self.include or self._match(self.include, name, path, self.root, False)
+
+    @staticmethod
+    def _match(patterns, name, path, base, is_dir):
+        # The relative path is only computed if any pattern needs it
+        relpath = None
+        for pattern in patterns:
+            if pattern.endswith('/'):
+                if not is_dir:
+                    continue
+                pattern = pattern.rstrip('/')
+            if '/' not in pattern:
+                if fnmatch.fnmatchcase(name, pattern):
+                    return True
+                continue
+            if relpath is None:
+                relpath = os.path.relpath(os.path.abspath(path), base).replace(os.sep, '/')
+            if fnmatch.fnmatchcase(relpath, pattern.lstrip('/')):
+                return True
+        return False
+
+    def summary(self):
+        """Return a line describing the work done so far."""
+        return "Discovery scanned {0} directories and {1} entries in {2:.1f}ms".format(
+            self.directories, self.entries, self.seconds * 1000)
@@ -21,3 +21,12 @@ class SourceImagesNotFoundError(GlueError):
 class NoSpritesFoldersFoundError(GlueError):
     """Raised if no sprites folders could be found."""
     error_code = 5
+
+
+class BuildCancelled(Exception):
+    """Raised while building if the sources changed again, so the build
+    can start over using the latest state."""
+
+    def __init__(self, changes):
+        super(BuildCancelled, self).__init__("Build cancelled.")
+        self.changes = changes
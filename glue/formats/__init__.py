@@ -6,6 +6,7 @@ from .jsonformat import JSONFormat
 from .caat import CAATFormat
 from .less import LessFormat
 from .scss import ScssFormat
+from .atlas import AtlasFormat
 
 
 formats = {'css': CssFormat,
@@ -15,4 +16,5 @@ formats = {'css': CssFormat,
            'json': JSONFormat,
            'caat': CAATFormat,
            'less': LessFormat,
-           'scss': ScssFormat}
+           'scss': ScssFormat,
+           'atlas': AtlasFormat}
@@ -0,0 +1,135 @@
+import os
+import struct
+
+from glue.helpers import round_up, read_head, AtomicFile
+from glue import __version__
+from .base import BaseFormat
+
+
+def pack_strings(values):
+    """Return a string table with every value encoded as a NUL-terminated
+    UTF-8 string and the ``(offset, length)`` of each value inside it.
+
+    :param values: List of strings.
+    """
+    table, refs, offset = [], [], 0
+    for value in values:
+        data = value.encode('utf-8')
+        table.append(data + b'\x00')
+        refs.append((offset, len(data)))
+        offset += len(data) + 1
+    return b''.join(table), refs
+
+
+class AtlasFormat(BaseFormat):
+    """Compact binary atlas that game runtimes can memory-map and use
+    without any parsing. All integers are little-endian.
+
+    The file starts with a fixed-size header::
+
+        magic            8s  b'GLUEATLS'
+        format_version   H
+        header_size      H
+        frame_count      I
+        width, height    I   Texture size
+        ratio            f
+        frames_offset    I   Offset of the frame table
+        frame_size       I   Size of each frame record
+        strings_offset   I   Offset of the string table
+        strings_size     I
+        version          II  (offset, length) inside the string table
+        hash             II
+        name             II
+        texture          II
+
+    The string table stores every string as NUL-terminated UTF-8 and the
+    frame table contains one fixed-width record per image, sorted by name
+    so frames can be found using a binary search::
+
+        name             II  (offset, length) inside the string table
+        x, y             I   Position inside the texture
+        width, height    I
+        source_width     I   Size of the image before being cropped
+        source_height    I
+    """
+
+    extension = 'atlas'
+    build_per_ratio = True
+
+    magic = b'GLUEATLS'
+    format_version = 1
+    header_struct = struct.Struct('<8sHHIIIfIIII8I4x')
+    frame_struct = struct.Struct('<8I')
+
+    @classmethod
+    def populate_argument_parser(cls, parser):
+        group = parser.add_argument_group("Atlas format options")
+
+        group.add_argument("--atlas",
+                           dest="atlas_dir",
+                           nargs='?',
+                           const=True,
+                           default=os.environ.get('GLUE_ATLAS', False),
+                           metavar='DIR',
+                           help="Generate binary atlas files and optionally where")
+
+    def render(self, ratio):
+        frames = self.sprite.frames
+        columns = frames.scaled(ratio)
+        scale = ratio / self.sprite.max_ratio
+
+        texture = os.path.basename(self.sprite.sprite_path(ratio=ratio))
+        order = sorted(range(len(frames)), key=lambda i: frames.filenames[i].encode('utf-8'))
+        strings, refs = pack_strings([__version__, self.sprite.hash, self.sprite.name, texture] +
+                                     [frames.filenames[i] for i in order])
+
+        # The string table goes first so the fingerprint is always found
+        # at the beginning of the file. Frames are aligned to 8 bytes.
+        strings_offset = self.header_struct.size
+        frames_offset = strings_offset + len(strings) + (-len(strings) % 8)
+
+        header = self.header_struct.pack(self.magic,
+                                         self.format_version,
+                                         self.header_struct.size,
+                                         len(frames),
+                                         round_up(self.sprite.canvas_size[0] * scale),
+                                         round_up(self.sprite.canvas_size[1] * scale),
+                                         ratio,
+                                         frames_offset,
+                                         self.frame_struct.size,
+                                         strings_offset,
+                                         len(strings),
+                                         *[n for ref in refs[:4] for n in ref])
+
+        table = [self.frame_struct.pack(name_offset, name_length,
+                                        columns['abs_x'][i],
+                                        columns['abs_y'][i],
+                                        columns['width'][i],
+                                        columns['height'][i],
+                                        round_up(frames.original_width[i] * scale),
+                                        round_up(frames.original_height[i] * scale))
+                 for i, (name_offset, name_length) in zip(order, refs[4:])]
+
+        return b''.join([header, strings, b'\x00' * (frames_offset - strings_offset - len(strings))] + table)
+
+    def save(self, ratio):
+        # Create the destination directory if required
+        if not os.path.exists(self.output_dir(ratio=ratio)):
+            os.makedirs(self.output_dir(ratio=ratio))
+
+        with AtomicFile(self.output_path(ratio=ratio)) as f:
+            f.write(self.render(ratio))
+
+    def to_bytes(self, ratio):
+        return self.render(ratio)
+
+    def read_fingerprint(self, path):
+        data = read_head(path, self.fingerprint_size)
+        if len(data) < self.header_struct.size or not data.startswith(self.magic):
+            raise ValueError("Not a glue atlas file.")
+        header = self.header_struct.unpack(data[:self.header_struct.size])
+        strings_offset = header[9]
+        version_offset, version_length, hash_offset, hash_length = header[11:15]
+        version = data[strings_offset + version_offset:strings_offset + version_offset + version_length]
+        hash = data[strings_offset + hash_offset:strings_offset + hash_offset + hash_length]
+        return version.decode('utf-8'), hash.decode('utf-8')
@@ -1,13 +1,20 @@
+import re
 import os
 import sys
+import copy
 import json
-import codecs
+import hashlib
 import plistlib
 import textwrap
+import types
+import contextlib
+import zlib
 
-from jinja2 import Template
+from jinja2 import Environment, BaseLoader, FileSystemBytecodeCache, TemplateNotFound
 
-from glue.helpers import round_up, nearest_fration
+from glue.bplist import BinaryPlistReader
+from glue.helpers import (round_up, nearest_fration, AtomicFile, get_cache_dir,
+                          read_tail)
 from glue import __version__
 
 
@@ -15,6 +22,7 @@ class BaseFormat(object):
 
     extension = None
     build_per_ratio = False
+    fingerprint_size = 4096
 
     def __init__(self, sprite):
         self.sprite = sprite
@@ -45,8 +53,56 @@ class BaseFormat(object):
     def save(self, *args, **kwargs):
         raise NotImplementedError
 
+    def to_bytes(self, *args, **kwargs):
+        """Return the content of the output :meth:`save` would write,
+        without writing anything."""
+        raise NotImplementedError
+
+    def outputs(self):
+        """Yield a ``(path, content)`` tuple for every output of this
+        format. Outputs are rendered in memory and never written."""
+        if self.build_per_ratio:
+            for ratio in self.sprite.config['ratios']:
+                yield self.output_path(ratio), self.to_bytes(ratio)
+        else:
+            yield self.output_path(), self.to_bytes()
+
+    def output_paths(self):
+        """Return the path of every output of this format."""
+        if self.build_per_ratio:
+            return [self.output_path(ratio) for ratio in self.sprite.config['ratios']]
+        return [self.output_path()]
+
+    def get_precompressors(self):
+        """Return the list of ``(extension, compressor)`` tuples used to
+        write precompressed copies of every output next to it."""
+        return []
+
     def needs_rebuild(self):
-        return True
+        """Return ``True`` if any output of this format is missing or was
+        generated by another version of glue or using other sources or
+        settings.
+
+        Only a few bytes of each output are read using
+        :meth:`read_fingerprint`, so existing outputs are never parsed.
+        """
+        fingerprint = (__version__, self.sprite.hash)
+        for path in self.output_paths():
+            try:
+                if self.read_fingerprint(path) != fingerprint:
+                    return True
+            except (IOError, OSError, ValueError):
+                return True
+        return False
+
+    def read_fingerprint(self, path):
+        """Return the ``(version, hash)`` tuple stored inside the output
+        ``path`` reading at most ``fingerprint_size`` bytes, or ``None``
+        if it isn't available.
+
+        :param path: Output path.
+        """
+        return None
 
     def validate(self):
         pass
@@ -73,6 +129,18 @@ class BaseFormat(object):
 class BaseTextFormat(BaseFormat):
 
     def get_context(self, *args, **kwargs):
+        """Return the context required to render this format.
+
+        The context doesn't depend on the format, so it is generated only
+        once for every format and ratio using the same output directory.
+        Every call returns its own deep copy, so formats can modify it.
+        """
+        key = ('context', self.output_dir())
+        if key not in self.sprite.cache:
+            self.sprite.cache[key] = self._generate_context()
+        return copy.deepcopy(self.sprite.cache[key])
+
+    def _generate_context(self):
         sprite_path = os.path.relpath(self.sprite.sprite_path(), self.output_dir())
         sprite_path = self.fix_windows_path(sprite_path)
         context = {'version': __version__,
@@ -82,39 +150,9 @@ class BaseTextFormat(BaseFormat):
                    'sprite_filename': os.path.basename(sprite_path),
                    'width': round_up(self.sprite.canvas_size[0] / self.sprite.max_ratio),
                    'height': round_up(self.sprite.canvas_size[1] / self.sprite.max_ratio),
-                   'images': [],
+                   'images': self._image_contexts(),
                    'ratios': {}}
 
-        for i, img in enumerate(self.sprite.images):
-            base_x = img.x * -1 - img.margin[3] * self.sprite.max_ratio
-            base_y = img.y * -1 - img.margin[0] * self.sprite.max_ratio
-            base_abs_x = img.x + img.margin[3] * self.sprite.max_ratio
-            base_abs_y = img.y + img.margin[0] * self.sprite.max_ratio
-
-            image = dict(filename=img.filename,
-                         last=i == len(self.sprite.images) - 1,
-                         x=round_up(base_x / self.sprite.max_ratio),
-                         y=round_up(base_y / self.sprite.max_ratio),
-                         abs_x=round_up(base_abs_x / self.sprite.max_ratio),
-                         abs_y=round_up(base_abs_y / self.sprite.max_ratio),
-                         height=round_up((img.height / self.sprite.max_ratio) + img.padding[0] + img.padding[2]),
-                         width=round_up((img.width / self.sprite.max_ratio) + img.padding[1] + img.padding[3]),
-                         original_width=img.original_width,
-                         original_height=img.original_height,
-                         ratios={})
-
-            for r in self.sprite.ratios:
-                image['ratios'][r] = dict(filename=img.filename,
-                                          last=i == len(self.sprite.images) - 1,
-                                          x=round_up(base_x / self.sprite.max_ratio * r),
-                                          y=round_up(base_y / self.sprite.max_ratio * r),
-                                          abs_x=round_up(base_abs_x / self.sprite.max_ratio * r),
-                                          abs_y=round_up(base_abs_y / self.sprite.max_ratio * r),
-                                          height=round_up((img.height + img.padding[0] + img.padding[2]) / self.sprite.max_ratio * r),
-                                          width=round_up((img.width + img.padding[1] + img.padding[3]) / self.sprite.max_ratio * r))
-
-            context['images'].append(image)
-
         # Ratios
         for r in self.sprite.ratios:
             ratio_sprite_path = os.path.relpath(self.sprite.sprite_path(ratio=r), self.output_dir())
@@ -128,71 +166,364 @@ class BaseTextFormat(BaseFormat):
 
         return context
 
+    def _image_contexts(self):
+        """Return the geometry of every image of this sprite. As it doesn't
+        depend on the output directory, it is only computed once per sprite."""
+        if 'images' in self.sprite.cache:
+            return self.sprite.cache['images']
+
+        frames = self.sprite.frames
+        base = frames.scaled(1.0)
+        sizes = frames.css_sizes()
+        scaled = dict((r, frames.scaled(r)) for r in self.sprite.ratios)
+        last = len(frames) - 1
+
+        images = []
+        for i, filename in enumerate(frames.filenames):
+            image = dict(filename=filename,
+                         last=i == last,
+                         x=base['x'][i],
+                         y=base['y'][i],
+                         abs_x=base['abs_x'][i],
+                         abs_y=base['abs_y'][i],
+                         height=sizes['height'][i],
+                         width=sizes['width'][i],
+                         original_width=frames.original_width[i],
+                         original_height=frames.original_height[i],
+                         ratios={})
+
+            for r, columns in scaled.items():
+                image['ratios'][r] = dict(filename=filename,
+                                          last=i == last,
+                                          x=columns['x'][i],
+                                          y=columns['y'][i],
+                                          abs_x=columns['abs_x'][i],
+                                          abs_y=columns['abs_y'][i],
+                                          height=columns['height'][i],
+                                          width=columns['width'][i])
+
+            images.append(image)
+
+        self.sprite.cache['images'] = images
+        return images
+
+    chunk_size = 1 << 16
+
     def render(self, *args, **kwargs):
         raise NotImplementedError
 
+    def generate(self, *args, **kwargs):
+        """Yield the rendered output of this format in chunks. Formats able
+        to render their output incrementally should override it."""
+        yield self.render(*args, **kwargs)
+
+    def to_bytes(self, *args, **kwargs):
+        return ''.join(self.generate(*args, **kwargs)).encode('utf-8')
+
+    def needs_rebuild(self):
+        for path in self.output_paths():
+            for extension, compressor in self.get_precompressors():
+                if not os.path.exists('{0}.{1}'.format(path, extension)):
+                    return True
+            if stale_precompressed_paths(path, self.get_precompressors()):
+                return True
+        return super(BaseTextFormat, self).needs_rebuild()
+
     def save(self, *args, **kwargs):
         # Create the destination directory if required
         if not os.path.exists(self.output_dir(*args, **kwargs)):
             os.makedirs(self.output_dir(*args, **kwargs))
 
-        with codecs.open(self.output_path(*args, **kwargs), 'w', 'utf-8') as f:
-            f.write(self.render(*args, **kwargs))
+        save_text(self.output_path(*args, **kwargs), self.generate(*args, **kwargs),
+                  self.get_precompressors(), self.chunk_size)
+
+
+def save_text(path, chunks, precompressors=(), chunk_size=1 << 16):
+    """Stream ``chunks`` of text to ``path`` encoded as UTF-8 joining small
+    chunks together. Precompressed copies of the file are written at the
+    same time using ``precompressors``, and precompressed copies of any
+    other encoding left by previous builds are removed.
+
+    :param path: Output path.
+    :param chunks: Iterable of strings.
+    :param precompressors: List of ``(extension, compressor)`` tuples.
+    :param chunk_size: Minimum size of each write.
+    """
+    with contextlib.ExitStack() as stack:
+        f = stack.enter_context(AtomicFile(path))
+        sidecars = [(stack.enter_context(AtomicFile('{0}.{1}'.format(path, extension))),) + compressor()
+                    for extension, compressor in precompressors]
+
+        def write(text):
+            data = text.encode('utf-8')
+            f.write(data)
+            for sidecar, compress, finish in sidecars:
+                sidecar.write(compress(data))
+
+        buffer, size = [], 0
+        for chunk in chunks:
+            buffer.append(chunk)
+            size += len(chunk)
+            if size >= chunk_size:
+                write(''.join(buffer))
+                buffer, size = [], 0
+        write(''.join(buffer))
+
+        for sidecar, compress, finish in sidecars:
+            sidecar.write(finish())
+
+    for stale_path in stale_precompressed_paths(path, precompressors):
+        os.remove(stale_path)
+
+
+def stale_precompressed_paths(path, used):
+    """Return the path of every existing precompressed copy of ``path``
+    using an encoding not included in ``used``.
+
+    :param path: Output path.
+    :param used: List of ``(extension, compressor)`` tuples in use.
+    """
+    used = set(extension for extension, compressor in used)
+    paths = ['{0}.{1}'.format(path, extension) for extension, compressor in precompressors.values()
+             if extension not in used]
+    return [p for p in paths if os.path.exists(p)]
+
+
+def _gzip_compressor():
+    # gzip streams written by zlib have no mtime, so they are reproducible
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress, compressor.flush
+
+
+def _brotli_compressor():
+    import brotli
+    compressor = brotli.Compressor(quality=11)
+    return compressor.process, compressor.finish
+
+
+# Each precompressor is a tuple with the extension of its files and a
+# function returning a new pair of (compress, finish) functions
+precompressors = {'gzip': ('gz', _gzip_compressor),
+                  'br': ('br', _brotli_compressor)}
+
+
+def find_fingerprint(data, version_re, hash_re):
+    """Return the ``(version, hash)`` tuple using the last match of both
+    regular expressions inside ``data`` or ``None`` if any is missing."""
+    versions, hashes = re.findall(version_re, data), re.findall(hash_re, data)
+    if versions and hashes:
+        return versions[-1], hashes[-1]
+    return None
+
+
+def _json_dumps():
+    return lambda obj: json.dumps(obj, separators=(',', ':'))
+
+
+def _simplejson_dumps():
+    import simplejson
+    return lambda obj: simplejson.dumps(obj, separators=(',', ':'))
+
+
+def _ujson_dumps():
+    import ujson
+    return ujson.dumps
+
+
+def _orjson_dumps():
+    import orjson
+    return lambda obj: orjson.dumps(obj).decode('utf-8')
+
+
+# Each backend returns a function encoding objects as compact JSON
+json_backends = {'json': _json_dumps,
+                 'simplejson': _simplejson_dumps,
+                 'ujson': _ujson_dumps,
+                 'orjson': _orjson_dumps}
+
+
+class LazyObject(object):
+    """JSON object encoded by :func:`iterencode_compact` whose items are
+    only generated while it is encoded."""
+
+    def __init__(self, items):
+        """:param items: Iterable of ``(key, value)`` tuples."""
+        self._items = items
+
+    def items(self):
+        return self._items
+
+
+def iterencode_compact(data, dumps):
+    """Yield ``data`` encoded as compact JSON in chunks. Every item of the
+    top-level containers (e.g. every frame) is encoded individually, so
+    big outputs are never encoded at once. Top-level containers can be
+    generators (arrays) or :class:`LazyObject` instances (objects), so
+    their items don't need to be in memory at once either.
+
+    :param data: Dictionary to encode.
+    :param dumps: Function encoding objects as compact JSON.
+    """
+    yield '{'
+    for i, (key, value) in enumerate(data.items()):
+        yield '{0}{1}:'.format(',' if i else '', dumps(key))
+        if isinstance(value, (list, types.GeneratorType)):
+            yield '['
+            for j, item in enumerate(value):
+                yield '{0}{1}'.format(',' if j else '', dumps(item))
+            yield ']'
+        elif isinstance(value, (dict, LazyObject)):
+            yield '{'
+            for j, (item_key, item) in enumerate(value.items()):
+                yield '{0}{1}:{2}'.format(',' if j else '', dumps(item_key), dumps(item))
+            yield '}'
+        else:
+            yield dumps(value)
+    yield '}'
 
 
 class BaseJSONFormat(BaseTextFormat):
 
     meta_key = 'meta'
 
-    def needs_rebuild(self):
-        for ratio in self.sprite.config['ratios']:
-            json_path = self.output_path(ratio)
-            if os.path.exists(json_path):
-                with codecs.open(json_path, 'r', 'utf-8') as f:
-                    try:
-                        data = json.loads(f.read())
-                        assert data[self.meta_key]['hash'] == self.sprite.hash
-                    except Exception:
-                        continue
-            return True
-        return False
+    def read_fingerprint(self, path):
+        # The meta object is always the last one of the file
+        return find_fingerprint(read_tail(path, self.fingerprint_size).decode('utf-8', 'replace'),
+                                r'"version":\s*"([^"]*)"', r'"hash":\s*"([^"]*)"')
 
     def render(self, *args, **kwargs):
-        return json.dumps(self.get_context(*args, **kwargs), indent=4)
+        return ''.join(self.generate(*args, **kwargs))
+
+    def generate(self, *args, **kwargs):
+        return json.JSONEncoder(indent=4).iterencode(self.get_context(*args, **kwargs))
 
 
 class BasePlistFormat(BaseTextFormat):
 
     meta_key = 'metadata'
 
+    @property
+    def binary(self):
+        """Flag to determine if this format generates binary plist files."""
+        return bool(self.sprite.config.get('{0}_binary'.format(self.format_label)))
+
     def render(self, *args, **kwargs):
         context = self.get_context(*args, **kwargs)
         if sys.version < '3':
             return plistlib.writePlistToString(context)
         return plistlib.writePlistToBytes(context).decode('unicode_escape')
 
-    def needs_rebuild(self):
-        for ratio in self.sprite.config['ratios']:
-            cocos2d_path = self.output_path(ratio)
-            if os.path.exists(cocos2d_path):
-                try:
-                    data = plistlib.readPlist(cocos2d_path)
-                    assert data[self.meta_key]['hash'] == self.sprite.hash
-                except Exception:
-                    continue
-            return True
-        return False
+    def save(self, *args, **kwargs):
+        if not self.binary:
+            return super(BasePlistFormat, self).save(*args, **kwargs)
+
+        # Create the destination directory if required
+        if not os.path.exists(self.output_dir(*args, **kwargs)):
+            os.makedirs(self.output_dir(*args, **kwargs))
+
+        with AtomicFile(self.output_path(*args, **kwargs)) as f:
+            f.write(self.to_bytes(*args, **kwargs))
+
+    def to_bytes(self, *args, **kwargs):
+        if not self.binary:
+            return super(BasePlistFormat, self).to_bytes(*args, **kwargs)
+        return plistlib.dumps(self.get_context(*args, **kwargs), fmt=plistlib.FMT_BINARY)
+
+    def read_fingerprint(self, path):
+        if self.binary:
+            # Only the metadata strings are read from binary plists
+            with open(path, 'rb') as f:
+                reader = BinaryPlistReader(f)
+                return (reader.read_string(reader.lookup(self.meta_key, 'version')),
+                        reader.read_string(reader.lookup(self.meta_key, 'hash')))
+
+        # Keys are sorted so the metadata is always the last dict of the file
+        return find_fingerprint(read_tail(path, self.fingerprint_size).decode('utf-8', 'replace'),
+                                r'<key>version</key>\s*<string>([^<]*)</string>',
+                                r'<key>hash</key>\s*<string>([^<]*)</string>')
+
+
+class TemplateLoader(BaseLoader):
+    """Jinja loader for both built-in templates and custom template files.
+
+    Built-in templates are registered using :meth:`add_source`, custom
+    templates are loaded using their absolute path as name. Every template
+    is dedented and stripped before being compiled.
+    """
+
+    builtin_prefix = 'glue:'
+
+    def __init__(self):
+        self.sources = {}
+
+    def add_source(self, source):
+        """Register a built-in template and return its name."""
+        name = '{0}{1}'.format(self.builtin_prefix, hashlib.sha1(source.encode('utf-8')).hexdigest())
+        self.sources.setdefault(name, textwrap.dedent(source).strip())
+        return name
+
+    def get_source(self, environment, name):
+        if name.startswith(self.builtin_prefix):
+            if name not in self.sources:
+                raise TemplateNotFound(name)
+            return self.sources[name], None, lambda: True
+
+        if not os.path.isfile(name):
+            raise TemplateNotFound(name)
+        def stat():
+            try:
+                st = os.stat(name)
+            except OSError:
+                return None
+            return st.st_mtime, st.st_size
+
+        current = stat()
+        with open(name) as f:
+            source = textwrap.dedent(f.read()).strip()
+        return source, name, lambda: stat() == current
+
+
+_environments = {}
+
+
+def get_environment(cache_dir=None):
+    """Return the Jinja environment used to render templates.
+
+    Compiled templates are memoized by the environment (custom templates
+    are recompiled only if their mtime changes) and, if ``cache_dir`` is
+    available, their bytecode is stored there so later runs skip the
+    compilation entirely.
+
+    :param cache_dir: glue cache directory.
+    """
+    if cache_dir not in _environments:
+        bytecode_dir = get_cache_dir(cache_dir, 'templates')
+        bytecode_cache = FileSystemBytecodeCache(bytecode_dir) if bytecode_dir else None
+        _environments[cache_dir] = Environment(loader=TemplateLoader(),
+                                               bytecode_cache=bytecode_cache,
+                                               auto_reload=True)
+    return _environments[cache_dir]
 
 
 class JinjaTextFormat(BaseTextFormat):
 
     template = ''
 
-    def render(self, *args, **kwargs):
-        context = self.get_context(*args, **kwargs)
-        template = self.template
+    def get_template(self):
+        environment = get_environment(self.sprite.config.get('cache_dir'))
         custom_template_config = '{0}_template'.format(self.format_label)
         if self.sprite.config.get(custom_template_config):
-            with open(self.sprite.config[custom_template_config]) as f:
-                template = f.read()
-        return Template(textwrap.dedent(template).strip()).render(**context)
+            return environment.get_template(os.path.abspath(self.sprite.config[custom_template_config]))
+        return environment.get_template(environment.loader.add_source(self.get_template_source()))
+
+    def get_template_source(self):
+        """Return the source of the built-in template of this format."""
+        return self.template
+
+    def render(self, *args, **kwargs):
+        context = self.get_context(*args, **kwargs)
+        return self.get_template().render(**context)
+
+    def generate(self, *args, **kwargs):
+        context = self.get_context(*args, **kwargs)
+        return self.get_template().generate(**context)
@@ -0,0 +1,202 @@
+import os
+import sys
+import json
+import hashlib
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+
+from glue.helpers import cached_property, read_head
+from glue import __version__
+from .base import save_text, stale_precompressed_paths
+from .css import CssFormat
+
+from ..exceptions import ValidationError
+
+
+class BundledCssFormat(CssFormat):
+    """Css format generating the context of one sprite relative to the
+    directory of the project bundle."""
+
+    def __init__(self, sprite, output_dir):
+        super(BundledCssFormat, self).__init__(sprite)
+        self._output_dir = output_dir
+
+    def output_dir(self, *args, **kwargs):
+        return self._output_dir
+
+
+class CssBundle(object):
+    """Single stylesheet with the css rules of every sprite of a project
+    and a JSON index describing them.
+
+    Sprites keep their own base rule, but frame rules with the same
+    declarations are merged and every ratio only has one media query for
+    the whole project.
+    """
+
+    def __init__(self, sprites, config):
+        """Bundle constructor.
+
+        :param sprites: List of :class:`~glue.core.Sprite`.
+        :param config: Project configuration.
+        """
+        self.sprites = sprites
+        self.config = config
+        self.formats = [BundledCssFormat(sprite, self.output_dir) for sprite in sprites]
+
+    @property
+    def name(self):
+        return self.config['css_bundle']
+
+    @property
+    def output_dir(self):
+        return self.config['css_dir']
+
+    def output_path(self, extension):
+        return os.path.join(self.output_dir, '{0}.{1}'.format(self.name, extension))
+
+    @cached_property
+    def hash(self):
+        """Return a hash of this bundle using the hash of every sprite."""
+        hash_list = [self.name] + [sprite.hash for sprite in self.sprites]
+        if sys.version < '3':
+            return hashlib.sha1(''.join(hash_list)).hexdigest()[:10]
+        return hashlib.sha1(''.join(hash_list).encode('utf-8')).hexdigest()[:10]
+
+    @property
+    def minify(self):
+        return bool(self.config.get('css_minify'))
+
+    def validate(self):
+        """Validate that no class name is used by more than one sprite."""
+        index = OrderedDict()
+        for format in self.formats:
+            format.validate()
+            for label, pseudo in format.css_names().values():
+                index.setdefault(':'.join((label, pseudo)), []).append(format.sprite.name)
+
+        dup = [(n, sprites) for n, sprites in index.items() if len(sprites) > 1]
+        if dup:
+            duptext = '\n'.join(['\t.{0} => {1}'.format(n, ', '.join(sprites)) for n, sprites in dup])
+            raise ValidationError("Error: Some sprites will have the same class name:\n{0}".format(duptext))
+
+    def output_paths(self):
+        """Return the path of every file of this bundle."""
+        css_path = self.output_path('css')
+        return [css_path, self.output_path('json')] + ['{0}.{1}'.format(css_path, extension) for extension, compressor
+                                                       in self.formats[0].get_precompressors()]
+
+    def needs_rebuild(self):
+        css_path = self.output_path('css')
+        if not all(os.path.exists(path) for path in self.output_paths()):
+            return True
+        if stale_precompressed_paths(css_path, self.formats[0].get_precompressors()):
+            return True
+        try:
+            first_line = read_head(css_path, CssFormat.fingerprint_size).decode('utf-8', 'replace').split('\n', 1)[0]
+        except (IOError, OSError):
+            return True
+        match = CssFormat.fingerprint_re.match(first_line)
+        return not match or (match.group('version'), match.group('hash')) != (__version__, self.hash)
+
+    def save(self):
+        # Create the destination directory if required
+        if not os.path.exists(self.output_dir):
+            os.makedirs(self.output_dir)
+
+        save_text(self.output_path('css'), self.generate(), self.formats[0].get_precompressors())
+        save_text(self.output_path('json'), [json.dumps(self.get_index(), indent=None if self.minify else 4)])
+
+    def outputs(self):
+        """Yield a ``(path, content)`` tuple for the stylesheet and the index
+        of this bundle without writing them."""
+        yield self.output_path('css'), ''.join(self.generate()).encode('utf-8')
+        yield self.output_path('json'), json.dumps(self.get_index(), indent=None if self.minify else 4).encode('utf-8')
+
+    def rule(self, selectors, declarations, indent=''):
+        """Return a css rule.
+
+        :param selectors: List of selectors.
+        :param declarations: List of ``(property, value)`` tuples.
+        :param indent: Indentation of the rule.
+        """
+        if self.minify:
+            return '{0}{{{1}}}'.format(','.join(selectors), ';'.join('{0}:{1}'.format(*d) for d in declarations))
+        return '{0}{1} {{\n{2}{0}}}\n'.format(indent,
+                                              ',\n{0}'.format(indent).join(selectors),
+                                              ''.join('{0}    {1}: {2};\n'.format(indent, *d) for d in declarations))
+
+    def media_query(self, ratio):
+        """Return the media query of a ratio context."""
+        features = [('-webkit-min-device-pixel-ratio', ratio['ratio']),
+                    ('min--moz-device-pixel-ratio', ratio['ratio']),
+                    ('-o-min-device-pixel-ratio', ratio['fraction']),
+                    ('min-device-pixel-ratio', ratio['ratio']),
+                    ('min-resolution', '{0}dppx'.format(ratio['ratio']))]
+        template = 'screen and ({0}:{1})' if self.minify else 'screen and ({0}: {1})'
+        return (',' if self.minify else ', ').join(template.format(*f) for f in features)
+
+    def generate(self):
+        """Yield the bundle stylesheet rule by rule."""
+        contexts = [format.get_context() for format in self.formats]
+        separator = '' if self.minify else '\n'
+
+        yield '/* glue: {0} hash: {1} */\n'.format(__version__, self.hash)
+
+        def selectors(context):
+            return ['.{0}{1}'.format(i['label'], i['pseudo']) for i in context['images']]
+
+        for context in contexts:
+            yield self.rule(selectors(context), [('background-image', "url('{0}')".format(context['sprite_path'])),
+                                                 ('background-repeat', 'no-repeat')]) + separator
+
+        # Merge frames with exactly the same declarations
+        frames = OrderedDict()
+        for context in contexts:
+            for image in context['images']:
+                declarations = (('background-position', '{0} {1}'.format(image['x'] and '{0}px'.format(image['x']),
+                                                                        image['y'] and '{0}px'.format(image['y']))),
+                                ('width', '{0}px'.format(image['width'])),
+                                ('height', '{0}px'.format(image['height'])))
+                frames.setdefault(declarations, []).append('.{0}{1}'.format(image['label'], image['pseudo']))
+
+        for declarations, frame_selectors in frames.items():
+            yield self.rule(frame_selectors, declarations) + separator
+
+        for r in sorted(set(r for context in contexts for r in context['ratios'])):
+            ratio_contexts = [c for c in contexts if r in c['ratios']]
+            yield '@media {0}{1}{{{2}'.format(self.media_query(ratio_contexts[0]['ratios'][r]),
+                                              '' if self.minify else ' ', separator)
+            for context in ratio_contexts:
+                size = '{0}px {1}px'.format(context['width'], context['height'])
+                yield self.rule(selectors(context), [('background-image', "url('{0}')".format(context['ratios'][r]['sprite_path'])),
+                                                     ('-webkit-background-size', size),
+                                                     ('-moz-background-size', size),
+                                                     ('background-size', size)], '' if self.minify else '    ')
+            yield '}}{0}'.format(separator)
+
+    def get_index(self):
+        """Return the JSON index of every sprite of the bundle."""
+        sprites = OrderedDict()
+        for format in self.formats:
+            context = format.get_context()
+            sprites[context['name']] = OrderedDict([
+                ('sprite_path', context['sprite_path']),
+                ('width', context['width']),
+                ('height', context['height']),
+                ('ratios', OrderedDict((str(r), context['ratios'][r]['sprite_path']) for r in sorted(context['ratios']))),
+                ('images', OrderedDict((i['filename'], OrderedDict([('class', i['label']),
+                                                                    ('pseudo', i['pseudo']),
+                                                                    ('x', i['x']),
+                                                                    ('y', i['y']),
+                                                                    ('width', i['width']),
+                                                                    ('height', i['height'])]))
+                                       for i in context['images']))])
+
+        return OrderedDict([('sprites', sprites),
+                            ('meta', {'version': __version__,
+                                      'hash': self.hash,
+                                      'css': os.path.basename(self.output_path('css'))})])
@@ -1,4 +1,5 @@
 import os
+import plistlib
 
 from .base import BasePlistFormat
 
@@ -20,6 +21,17 @@ class Cocos2dFormat(BasePlistFormat):
                            metavar='DIR',
                            help="Generate Cocos2d files and optionally where")
 
+        group.add_argument("--cocos2d-binary",
+                           dest="cocos2d_binary",
+                           action='store_true',
+                           default=os.environ.get('GLUE_COCOS2D_BINARY', False),
+                           help="Generate binary plist files instead of XML")
+
+    @classmethod
+    def apply_parser_contraints(cls, parser, options):
+        if options.cocos2d_binary and not hasattr(plistlib, 'FMT_BINARY'):
+            parser.error("--cocos2d-binary requires Python 3.4+.")
+
     def get_context(self, ratio, *args, **kwargs):
         context = super(Cocos2dFormat, self).get_context(ratio, *args, **kwargs)
         ratio_context = context['ratios'][ratio]
@@ -1,9 +1,12 @@
 import re
 import os
-import codecs
+import copy
+import base64
+import collections
 
-from glue import __version__
-from .base import JinjaTextFormat
+from glue.helpers import read_head, split_list
+from .base import JinjaTextFormat, precompressors
+from .img import ImageFormat
 
 from ..exceptions import ValidationError
 
@@ -12,6 +15,8 @@ class CssFormat(JinjaTextFormat):
 
     extension = 'css'
     camelcase_separator = 'camelcase'
+    invalid_characters_re = re.compile(r'[^\w\-_]')
+    fingerprint_re = re.compile(r'^/\* glue: (?P<version>\S+) hash: (?P<hash>\S+) \*/$')
     css_pseudo_classes = set(['link', 'visited', 'active', 'hover', 'focus',
                               'first-letter', 'first-line', 'first-child',
                               'before', 'after'])
@@ -40,6 +45,17 @@ class CssFormat(JinjaTextFormat):
         {% endfor %}
         """
 
+    # The selectors of every image are only listed once: the url of each
+    # ratio is set using a custom property, so browsers without custom
+    # properties use the first ratio as before.
+    minified_template = """
+        /* glue: {{ version }} hash: {{ hash }} */
+        :root{--{{ sprite_variable }}:url('{{ sprite_path }}')}
+        {%- for r, ratio in ratios.items() if ratio.sprite_path != sprite_path %}@media screen and (-webkit-min-device-pixel-ratio:{{ ratio.ratio }}),screen and (min--moz-device-pixel-ratio:{{ ratio.ratio }}),screen and (-o-min-device-pixel-ratio:{{ ratio.fraction }}),screen and (min-device-pixel-ratio:{{ ratio.ratio }}),screen and (min-resolution:{{ ratio.ratio }}dppx){:root{--{{ sprite_variable }}:url('{{ ratio.sprite_path }}')}}{% endfor %}
+        {%- for image in images %}.{{ image.label }}{{ image.pseudo }}{%- if not image.last %},{%- endif %}{%- endfor %}{background-image:url('{{ sprite_path }}');background-image:var(--{{ sprite_variable }});background-repeat:no-repeat;-webkit-background-size:{{ width }}px {{ height }}px;-moz-background-size:{{ width }}px {{ height }}px;background-size:{{ width }}px {{ height }}px}
+        {%- for image in images %}.{{ image.label }}{{ image.pseudo }}{background-position:{{ image.x ~ ('px' if image.x) }} {{ image.y ~ ('px' if image.y) }};width:{{ image.width }}px;height:{{ image.height }}px}{% endfor %}
+        """
+
     @classmethod
     def populate_argument_parser(cls, parser):
         group = parser.add_argument_group("CSS format options")
@@ -116,6 +132,40 @@ class CssFormat(JinjaTextFormat):
                            metavar='DIR',
                            help="Template to use to generate the CSS output.")
 
+        group.add_argument("--css-minify",
+                           dest="css_minify",
+                           action='store_true',
+                           default=os.environ.get('GLUE_CSS_MINIFY', False),
+                           help="Generate minified CSS, LESS and SCSS files")
+
+        group.add_argument("--css-precompress",
+                           dest="css_precompress",
+                           nargs='?',
+                           const='gzip',
+                           default=os.environ.get('GLUE_CSS_PRECOMPRESS', ''),
+                           metavar='ENCODINGS',
+                           help=("Write precompressed copies of every CSS, LESS "
+                                 "and SCSS file using these comma separated "
+                                 "encodings: gzip, br (default: gzip)"))
+
+        group.add_argument("--css-inline",
+                           dest="css_inline",
+                           type=int,
+                           default=os.environ.get('GLUE_CSS_INLINE', 0),
+                           metavar='BYTES',
+                           help=("Embed sprite images up to this size in bytes "
+                                 "as data URIs instead of linking them"))
+
+        group.add_argument("--css-bundle",
+                           dest="css_bundle",
+                           nargs='?',
+                           const='sprites',
+                           default=os.environ.get('GLUE_CSS_BUNDLE', ''),
+                           metavar='NAME',
+                           help=("Generate a single CSS file and a JSON index "
+                                 "for every sprite of the project instead of "
+                                 "one CSS file per sprite (default: sprites)"))
+
         group.add_argument("--no-css",
                            dest="generate_css",
                            action="store_false",
@@ -128,24 +178,59 @@ class CssFormat(JinjaTextFormat):
         if sum(cachebusters) > 1:
             parser.error("You can't use --cachebuster, --cachebuster-filename or --cachebuster-filename-only-sprites at the same time.")
 
-    def needs_rebuild(self):
-        hash_line = '/* glue: %s hash: %s */\n' % (__version__, self.sprite.hash)
-        try:
-            with codecs.open(self.output_path(), 'r', 'utf-8') as existing_css:
-                first_line = existing_css.readline()
-                assert first_line == hash_line
-        except Exception:
-            return True
-        return False
+        if options.css_bundle and not options.project:
+            parser.error("You can't use --css-bundle without --project.")
+
+        if options.css_bundle and 'css' not in options.enabled_formats:
+            parser.error("You can't use --css-bundle without --css.")
+
+        for encoding in split_list(options.css_precompress):
+            if encoding not in precompressors:
+                parser.error("Unknown --css-precompress encoding '{0}'.".format(encoding))
+            try:
+                precompressors[encoding][1]()
+            except ImportError:
+                parser.error("--css-precompress={0} requires brotli to be installed.".format(encoding))
+
+    def read_fingerprint(self, path):
+        first_line = read_head(path, self.fingerprint_size).decode('utf-8', 'replace').split('\n', 1)[0]
+        match = self.fingerprint_re.match(first_line)
+        if match:
+            return match.group('version'), match.group('hash')
+        return None
 
     def validate(self):
-        class_names = [':'.join(self.generate_css_name(i.filename)) for i in self.sprite.images]
-        if len(set(class_names)) != len(self.sprite.images):
-            dup = [i for i in self.sprite.images if class_names.count(':'.join(self.generate_css_name(i.filename))) > 1]
-            duptext = '\n'.join(['\t{0} => .{1}'.format(os.path.relpath(d.path), ':'.join(self.generate_css_name(d.filename))) for d in dup])
+        # Every css based format shares the same class names
+        if self.sprite.cache.get('css_valid'):
+            return True
+
+        names = self.css_names()
+        class_names = [':'.join(names[i.filename]) for i in self.sprite.images]
+        counts = collections.Counter(class_names)
+        if len(counts) != len(self.sprite.images):
+            dup = [(i, n) for i, n in zip(self.sprite.images, class_names) if counts[n] > 1]
+            duptext = '\n'.join(['\t{0} => .{1}'.format(os.path.relpath(d.path), n) for d, n in dup])
             raise ValidationError("Error: Some images will have the same class name:\n{0}".format(duptext))
+        self.sprite.cache['css_valid'] = True
         return True
 
+    def css_names(self):
+        """Return a dictionary with the ``(label, pseudo)`` tuple of every
+        image filename. Names are generated only once per sprite and shared
+        by every css based format."""
+        if 'css_names' not in self.sprite.cache:
+            self.sprite.cache['css_names'] = dict((i.filename, self.generate_css_name(i.filename))
+                                                  for i in self.sprite.images)
+        return self.sprite.cache['css_names']
+
+    def get_template_source(self):
+        if self.sprite.config.get('css_minify') and self.minified_template:
+            return self.minified_template
+        return self.template
+
+    def get_precompressors(self):
+        return [precompressors[e] for e in split_list(self.sprite.config.get('css_precompress'))]
+
     def output_filename(self, *args, **kwargs):
         filename = super(CssFormat, self).output_filename(*args, **kwargs)
         if self.sprite.config['css_cachebuster_filename']:
@@ -153,12 +238,27 @@ class CssFormat(JinjaTextFormat):
         return filename
 
     def get_context(self, *args, **kwargs):
+        """Return the context required to render this format. The css
+        context is only generated once per format and output directory, and
+        every call returns its own deep copy, so formats can modify it."""
+        key = ('css_context', type(self), self.output_dir())
+        if key not in self.sprite.cache:
+            self.sprite.cache[key] = self._generate_css_context(*args, **kwargs)
+        return copy.deepcopy(self.sprite.cache[key])
+
+    def _generate_css_context(self, *args, **kwargs):
 
         context = super(CssFormat, self).get_context(*args, **kwargs)
 
         # Generate css labels
+        names = self.css_names()
+        images = []
         for image in context['images']:
-            image['label'], image['pseudo'] = self.generate_css_name(image['filename'])
+            label, pseudo = names[image['filename']]
+            images.append(dict(image, label=label, pseudo=pseudo))
+        context['images'] = images
+        context['ratios'] = dict((r, dict(ratio)) for r, ratio in context['ratios'].items())
+        context['sprite_variable'] = 'glue-{0}'.format(self.invalid_characters_re.sub('', self.sprite.name))
 
         if self.sprite.config['css_url']:
             context['sprite_path'] = '{0}{1}'.format(self.sprite.config['css_url'], context['sprite_filename'])
@@ -177,16 +277,26 @@ class CssFormat(JinjaTextFormat):
             for r, ratio in context['ratios'].items():
                 ratio['sprite_path'] = apply_cachebuster(ratio['sprite_path'])
 
+        # Embed small sprite images as data URIs
+        if self.sprite.config.get('css_inline'):
+            image_format = ImageFormat(self.sprite)
+            for r, ratio in context['ratios'].items():
+                data = image_format.encode_inline(r, int(self.sprite.config['css_inline']))
+                if data is not None:
+                    ratio['sprite_path'] = 'data:image/png;base64,{0}'.format(base64.b64encode(data).decode('ascii'))
+                    if ratio['sprite_filename'] == context['sprite_filename']:
+                        context['sprite_path'] = ratio['sprite_path']
+
         return context
 
     def generate_css_name(self, filename):
         filename = filename.rsplit('.', 1)[0]
         separator = self.sprite.config['css_separator']
-        namespace = [re.sub(r'[^\w\-_]', '', filename)]
+        namespace = [self.invalid_characters_re.sub('', filename)]
 
         # Add sprite namespace if required
         if self.sprite.config['css_sprite_namespace']:
-            sprite_name = re.sub(r'[^\w\-_]', '', self.sprite.name)
+            sprite_name = self.invalid_characters_re.sub('', self.sprite.name)
             sprite_namespace = self.sprite.config['css_sprite_namespace']
 
             # Support legacy 0.4 format
@@ -30,6 +30,7 @@ class HtmlFormat(CssFormat):
             <p><em>Generated using <a href="http://gluecss.com"/>Glue v{{ version }}</a></em></p>
             </body>
         </html>"""
+    minified_template = None
 
     @classmethod
     def populate_argument_parser(cls, parser):
@@ -50,11 +51,15 @@ class HtmlFormat(CssFormat):
 
     def get_context(self, *args, **kwargs):
         context = super(HtmlFormat, self).get_context(*args, **kwargs)
-        context['css_path'] = os.path.relpath(os.path.join(self.sprite.config['css_dir'], '{0}.css'.format(self.sprite.name)), self.output_dir())
+        css_name = self.sprite.config.get('css_bundle') or self.sprite.name
+        context['css_path'] = os.path.relpath(os.path.join(self.sprite.config['css_dir'], '{0}.css'.format(css_name)), self.output_dir())
         return context
 
     def needs_rebuild(self):
         return True
 
+    def get_precompressors(self):
+        return []
+
     def validate(self):
         return True
@@ -1,13 +1,48 @@
+import io
 import os
+import math
+import collections
+from concurrent.futures import ThreadPoolExecutor
 
 from PIL import Image as PILImage
 from PIL import PngImagePlugin
 
 from glue import __version__
-from glue.helpers import round_up, cached_property
+from glue.helpers import round_up, cached_property, AtomicFile, read_head
+from glue.png import PNGWriter, deflate_band, read_png_text
 from .base import BaseFormat
 
 
+def _resize_supports_box():
+    """Return ``True`` if this Pillow version is able to resize only a
+    region of an image (Pillow >= 4.2)."""
+    try:
+        PILImage.new('RGBA', (2, 2)).resize((1, 1), PILImage.ANTIALIAS, box=(0, 0, 2, 2))
+    except TypeError:
+        return False
+    return True
+
+RESIZE_SUPPORTS_BOX = _resize_supports_box()
+
+
+class _LimitExceeded(Exception):
+    pass
+
+
+class _LimitedBuffer(io.BytesIO):
+    """In-memory file raising :class:`_LimitExceeded` as soon as more than
+    ``limit`` bytes are written to it."""
+
+    def __init__(self, limit):
+        super(_LimitedBuffer, self).__init__()
+        self.limit = limit
+
+    def write(self, data):
+        if self.tell() + len(data) > self.limit:
+            raise _LimitExceeded()
+        return super(_LimitedBuffer, self).write(data)
+
+
 class ImageFormat(BaseFormat):
 
     build_per_ratio = True
@@ -68,36 +103,209 @@ class ImageFormat(BaseFormat):
                            const='2,1',
                            help="Shortcut for --ratios=2,1")
 
+        group.add_argument("--resample-images",
+                           dest="resample_images",
+                           action='store_true',
+                           default=os.environ.get('GLUE_RESAMPLE_IMAGES', False),
+                           help=("Create the sprite of each ratio scaling every "
+                                 "image individually instead of scaling down "
+                                 "the biggest sprite"))
+
+        group.add_argument("--native-ratios",
+                           dest="native_ratios",
+                           action='store_true',
+                           default=os.environ.get('GLUE_NATIVE_RATIOS', False),
+                           help=("Use source images named name@<ratio>x as "
+                                 "the native version of name for that ratio"))
+
+        group.add_argument("--strip-height",
+                           dest="strip_height",
+                           type=int,
+                           default=os.environ.get('GLUE_STRIP_HEIGHT', None),
+                           metavar='ROWS',
+                           help=("Compose and write sprite images in strips of "
+                                 "this height instead of creating the whole "
+                                 "canvas in memory"))
+
+    @classmethod
+    def apply_parser_contraints(cls, parser, options):
+        strip_height = getattr(options, 'strip_height', None)
+        if strip_height is not None and int(strip_height) < 1:
+            parser.error("--strip-height must be greater than 0.")
+
     def output_filename(self, *args, **kwargs):
         filename = super(ImageFormat, self).output_filename(*args, **kwargs)
         if self.sprite.config['css_cachebuster_filename'] or self.sprite.config['css_cachebuster_only_sprites']:
             return '{0}_{1}'.format(filename, self.sprite.hash)
         return filename
 
-    def needs_rebuild(self):
-        for ratio in self.sprite.config['ratios']:
-            image_path = self.output_path(ratio)
-            try:
-                existing = PILImage.open(image_path)
-                assert existing.info['Software'] == 'glue-%s' % __version__
-                assert existing.info['Comment'] == self.sprite.hash
-                continue
-            except Exception:
-                return True
-        return False
+    def read_fingerprint(self, path):
+        text = read_png_text(read_head(path, self.fingerprint_size))
+        software = text.get('Software', '')
+        if software.startswith('glue-') and 'Comment' in text:
+            return software[len('glue-'):], text['Comment']
+        return None
 
-    @cached_property
-    def _raw_canvas(self):
-        # Create the sprite canvas
+    def canvas_size(self, ratio):
+        """Return the width and height of the canvas for this ratio."""
         width, height = self.sprite.canvas_size
-        canvas = PILImage.new('RGBA', (width, height), (0, 0, 0, 0))
+        if ratio == self.sprite.max_ratio:
+            return width, height
+        return (round_up((width / self.sprite.max_ratio) * ratio),
+                round_up((height / self.sprite.max_ratio) * ratio))
+
+    def _image_position(self, image, ratio):
+        """Return the position of ``image`` inside the canvas of this ratio."""
+        x = image.x + (image.padding[3] + image.margin[3]) * self.sprite.max_ratio
+        y = image.y + (image.padding[0] + image.margin[0]) * self.sprite.max_ratio
+        if ratio == self.sprite.max_ratio:
+            return round_up(x), round_up(y)
+        return (round_up(x / self.sprite.max_ratio * ratio),
+                round_up(y / self.sprite.max_ratio * ratio))
 
-        # Paste the images inside the canvas
+    def _compose_canvas(self, ratio):
+        """Return a new canvas for this ratio pasting every image already
+        scaled to it instead of resizing the max ratio canvas."""
+        canvas = PILImage.new('RGBA', self.canvas_size(ratio), (0, 0, 0, 0))
+
+        for image in self.sprite.images:
+            canvas.paste(image.scaled(ratio), self._image_position(image, ratio))
+        return canvas
+
+    def _placements(self, ratio):
+        """Return a list of ``(top, bottom, x, image)`` tuples with every
+        :class:`~glue.core.Image` of this ratio and its position, ordered
+        by ``top``."""
+        placements = []
         for image in self.sprite.images:
-            canvas.paste(image.image,
-                (round_up(image.x + (image.padding[3] + image.margin[3]) * self.sprite.max_ratio),
-                 round_up(image.y + (image.padding[0] + image.margin[0]) * self.sprite.max_ratio)))
+            x, y = self._image_position(image, ratio)
+            placements.append((y, y + image.scaled_size(ratio)[1], x, image))
+        return sorted(placements, key=lambda p: p[0])
+
+    def band_height(self, ratio):
+        """Return the height of every band of the canvas of this ratio."""
+        if self.sprite.config['strip_height']:
+            return int(self.sprite.config['strip_height'])
+        # Split the canvas in several bands per job to balance the work.
+        height = self.canvas_size(ratio)[1]
+        jobs = int(self.sprite.config['jobs'])
+        return max(64, -(-height // (jobs * 4)))
+
+    def _resize_scale(self, ratio):
+        """Return how many rows of the biggest canvas are resized into every
+        row of the canvas of this ratio."""
+        return self.canvas_size(self.sprite.max_ratio)[1] / float(self.canvas_size(ratio)[1])
+
+    def _source_rows(self, ratio, top, bottom):
+        """Return the rows of the source canvas required to create the rows
+        between ``top`` and ``bottom`` of the canvas of this ratio.
+
+        Canvases composed pasting every image are their own source. Other
+        ratios are resized from the biggest canvas, so every band needs the
+        matching rows of it plus the ones around them the antialias filter
+        reads.
+        """
+        if self.composed_per_image(ratio):
+            return top, bottom
+        height = self.canvas_size(self.sprite.max_ratio)[1]
+        scale = self._resize_scale(ratio)
+        margin = int(math.ceil(3 * max(scale, 1))) + 2
+        return (max(0, int(top * scale) - margin),
+                min(height, int(math.ceil(bottom * scale)) + margin))
 
+    def _bands(self, ratio):
+        """Yield a ``(top, bottom, placements)`` tuple for every band of the
+        canvas of this ratio, where ``placements`` are the images inside
+        the source rows of this band (see :meth:`_source_rows`) already
+        scaled to the source ratio.
+
+        Images are only scaled while they are inside the current bands, so
+        the scaled versions of every image are never in memory at once."""
+        height = self.canvas_size(ratio)[1]
+        band_height = self.band_height(ratio)
+        if self.composed_per_image(ratio):
+            source_ratio = ratio
+        else:
+            source_ratio = self.sprite.max_ratio
+        placements = self._placements(source_ratio)
+        active, index = [], 0
+
+        for top in range(0, height, band_height):
+            bottom = min(top + band_height, height)
+            source_top, source_bottom = self._source_rows(ratio, top, bottom)
+
+            # Images are sorted by top so we only need to check the ones
+            # that are already active or start before this band ends.
+            while index < len(placements) and placements[index][0] < source_bottom:
+                image_top, image_bottom, x, image = placements[index]
+                active.append((image_top, image_bottom, x, image.scaled(source_ratio, cache=False)))
+                index += 1
+            active = [p for p in active if p[1] > source_top]
+            # Bands can be composed later in other threads, so they get
+            # their own copy of the list we keep updating.
+            yield top, bottom, tuple(active)
+
+    def _paste_band(self, ratio, top, bottom, placements):
+        """Return a new image with the rows between ``top`` and ``bottom``
+        of the canvas of this ratio."""
+        width = self.canvas_size(ratio)[0]
+        band = PILImage.new('RGBA', (width, bottom - top), (0, 0, 0, 0))
+        for image_top, image_bottom, x, img in placements:
+            band.paste(img, (x, image_top - top))
+        return band
+
+    def _compose_band(self, ratio, top, bottom, placements):
+        """Return the rows between ``top`` and ``bottom`` of the canvas of
+        this ratio as raw RGBA bytes."""
+        if self.composed_per_image(ratio):
+            return self._paste_band(ratio, top, bottom, placements).tobytes()
+
+        # Resize only the rows of the biggest canvas this band comes from
+        source_top, source_bottom = self._source_rows(ratio, top, bottom)
+        band = self._paste_band(self.sprite.max_ratio, source_top, source_bottom, placements)
+        scale = self._resize_scale(ratio)
+        box = (0, top * scale - source_top, band.size[0], bottom * scale - source_top)
+        size = (self.canvas_size(ratio)[0], bottom - top)
+        return band.resize(size, PILImage.ANTIALIAS, box=box).tobytes()
+
+    def _deflate_band(self, ratio, top, bottom, placements):
+        """Compose and deflate one band of the canvas of this ratio."""
+        height = self.canvas_size(ratio)[1]
+        data = self._compose_band(ratio, top, bottom, placements)
+        return deflate_band(data, self.canvas_size(ratio)[0] * 4, bottom == height)
+
+    def _write_bands(self, ratio, f):
+        """Compose and write the canvas of this ratio band by band, so the
+        required memory depends on the strip height instead of the canvas
+        area.
+
+        If more than one job is available, bands will be composed and
+        deflated in parallel.
+        """
+        width, height = self.canvas_size(ratio)
+        jobs = int(self.sprite.config['jobs'])
+        text = [('Software', 'glue-%s' % __version__),
+                ('Comment', self.sprite.hash)]
+
+        writer = PNGWriter(f, width, height, text=text)
+        if jobs > 1:
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                pending = collections.deque()
+                for band in self._bands(ratio):
+                    pending.append(executor.submit(self._deflate_band, ratio, *band))
+                    # Limit the number of bands in memory
+                    if len(pending) > jobs * 2:
+                        writer.write_deflated(pending.popleft().result())
+                while pending:
+                    writer.write_deflated(pending.popleft().result())
+        else:
+            for band in self._bands(ratio):
+                writer.write(self._compose_band(ratio, *band))
+        writer.close()
+
+    def _finalize_canvas(self, canvas):
+        """Return the canvas ready to be saved and the options required
+        to save it."""
         meta = PngImagePlugin.PngInfo()
         meta.add_text('Software', 'glue-%s' % __version__)
         meta.add_text('Comment', self.sprite.hash)
@@ -121,27 +329,109 @@ class ImageFormat(BaseFormat):
             kwargs.update({'transparency': 255})
         return canvas, kwargs
 
-    def save(self, ratio):
-        width, height = self.sprite.canvas_size
+    @cached_property
+    def _raw_canvas(self):
+        return self._finalize_canvas(self._compose_canvas(self.sprite.max_ratio))
+
+    def canvas(self, ratio):
+        """Return the canvas for this ratio and the options required to
+        save it."""
+
+        # The biggest canvas is always composed using the source images.
+        if self.sprite.max_ratio == ratio:
+            return self._raw_canvas
+
+        # Compose this canvas using each image scaled individually (or its
+        # native variant for this ratio). This is cheaper than resizing the
+        # full canvas and prevents neighboring images from bleeding into
+        # each other.
+        if self.sprite.config['resample_images'] or self.sprite.config['native_ratios']:
+            return self._finalize_canvas(self._compose_canvas(ratio))
+
+        # If this canvas isn't the biggest one scale it using the ratio
         canvas, kwargs = self._raw_canvas
+        reduced_canvas = canvas.resize(self.canvas_size(ratio), PILImage.ANTIALIAS)
+        # TODO: Use Imagemagick if it's available
+        return reduced_canvas, kwargs
+
+    def composed_per_image(self, ratio):
+        """Return ``True`` if the canvas of this ratio is composed pasting
+        every image scaled to it instead of resizing the biggest canvas."""
+        return (ratio == self.sprite.max_ratio or bool(self.sprite.config['resample_images']) or
+                bool(self.sprite.config['native_ratios']))
+
+    def use_bands(self, ratio):
+        """Flag to determine if the canvas of this ratio is composed band
+        by band. png8 requires the whole canvas to create its palette.
 
-        # Loop all over the ratios and save one image for each one
-        for ratio in self.sprite.config['ratios']:
+        Canvases composed pasting every image are split if
+        ``--strip-height`` or ``--jobs`` are used, as their pixels don't
+        change. Resized canvases are only split if ``--strip-height`` is
+        used, as resizing every band on its own could change a few pixels
+        by a few levels.
+        """
+        if self.sprite.config['png8']:
+            return False
+        if self.composed_per_image(ratio):
+            return bool(self.sprite.config['strip_height'] or int(self.sprite.config['jobs']) > 1)
+        return bool(self.sprite.config['strip_height']) and RESIZE_SUPPORTS_BOX
+
+    def _write(self, ratio, f):
+        # Compose the canvas strip by strip (in parallel if possible) if
+        # required.
+        if self.use_bands(ratio):
+            self._write_bands(ratio, f)
+        else:
+            canvas, kwargs = self.canvas(ratio)
+            canvas.save(f, format='PNG', **kwargs)
 
-            # Create the destination directory if required
-            if not os.path.exists(self.output_dir(ratio=ratio)):
-                os.makedirs(self.output_dir(ratio=ratio))
+    def encode(self, ratio):
+        """Return the PNG image of this ratio as bytes.
 
-            image_path = self.output_path(ratio=ratio)
+        The result is cached in the sprite, so formats embedding the image
+        and :meth:`save` encode each ratio only once.
+        """
+        key = ('png', ratio)
+        if key not in self.sprite.cache:
+            f = io.BytesIO()
+            self._write(ratio, f)
+            self.sprite.cache[key] = f.getvalue()
+        return self.sprite.cache[key]
 
-            # If this canvas isn't the biggest one scale it using the ratio
-            if self.sprite.max_ratio != ratio:
+    def encode_inline(self, ratio, limit):
+        """Return the PNG image of this ratio as bytes if it isn't bigger
+        than ``limit`` bytes, otherwise ``None``.
+
+        Encoding stops as soon as the image exceeds ``limit``, so images
+        too big to be embedded are never kept in memory and :meth:`save`
+        streams them to disk as usual.
+        """
+        key = ('png', ratio)
+        if key not in self.sprite.cache:
+            if self.sprite.cache.get(('png_exceeds', ratio), -1) >= limit:
+                return None
+            f = _LimitedBuffer(limit)
+            try:
+                self._write(ratio, f)
+            except _LimitExceeded:
+                self.sprite.cache[('png_exceeds', ratio)] = limit
+                return None
+            self.sprite.cache[key] = f.getvalue()
+        data = self.sprite.cache[key]
+        return data if len(data) <= limit else None
+
+    def to_bytes(self, ratio):
+        return self.encode(ratio)
+
+    def save(self, ratio):
+        # Create the destination directory if required
+        if not os.path.exists(self.output_dir(ratio=ratio)):
+            os.makedirs(self.output_dir(ratio=ratio))
 
-                reduced_canvas = canvas.resize(
-                                    (round_up((width / self.sprite.max_ratio) * ratio),
-                                     round_up((height / self.sprite.max_ratio) * ratio)),
-                                     PILImage.ANTIALIAS)
-                reduced_canvas.save(image_path, **kwargs)
-                # TODO: Use Imagemagick if it's available
+        # Images embedded by other formats were already encoded in memory
+        data = self.sprite.cache.get(('png', ratio))
+        with AtomicFile(self.output_path(ratio=ratio)) as f:
+            if data is not None:
+                f.write(data)
             else:
-                canvas.save(image_path, **kwargs)
+                self._write(ratio, f)
@@ -6,7 +6,7 @@ try:
 except ImportError:
     from ordereddict import OrderedDict
 
-from .base import BaseJSONFormat
+from .base import BaseJSONFormat, LazyObject, iterencode_compact, json_backends
 
 
 class JSONFormat(BaseJSONFormat):
@@ -34,30 +34,63 @@ class JSONFormat(BaseJSONFormat):
                            choices=['array', 'hash'],
                            help=("JSON structure format (array, hash)"))
 
+        group.add_argument("--json-compact",
+                           dest="json_compact",
+                           action='store_true',
+                           default=os.environ.get('GLUE_JSON_COMPACT', False),
+                           help="Generate compact JSON files without indentation")
+
+        group.add_argument("--json-backend",
+                           dest="json_backend",
+                           metavar='NAME',
+                           type=str,
+                           default=os.environ.get('GLUE_JSON_BACKEND', 'json'),
+                           choices=sorted(json_backends),
+                           help=("JSON library used to encode compact JSON "
+                                 "files: json, simplejson, ujson or orjson "
+                                 "(default: json)"))
+
+    @classmethod
+    def apply_parser_contraints(cls, parser, options):
+        if options.json_backend != 'json':
+            if not options.json_compact:
+                parser.error("You can't use --json-backend without --json-compact.")
+            try:
+                json_backends[options.json_backend]()
+            except ImportError:
+                parser.error("--json-backend={0} requires {0} to be installed.".format(options.json_backend))
+
+    def get_frame(self, image):
+        """Return the frame of an image context."""
+        return {'filename': image['filename'],
+                'frame': {'x': image['x'],
+                          'y': image['y'],
+                          'w': image['width'],
+                          'h': image['height']},
+                'rotated': False,
+                'trimmed': False,
+                'spriteSourceSize': {'x': image['x'],
+                                     'y': image['y'],
+                                     'w': image['width'],
+                                     'h': image['height']},
+                'sourceSize': {'w': image['original_width'],
+                               'h': image['original_height']}}
+
+    def get_meta(self, context):
+        """Return the meta object of a sprite context."""
+        return {'version': context['version'],
+                'hash': context['hash'],
+                'name': context['name'],
+                'sprite_path': context['sprite_path'],
+                'sprite_filename': context['sprite_filename'],
+                'width': context['width'],
+                'height': context['height']}
+
     def get_context(self, *args, **kwargs):
         context = super(JSONFormat, self).get_context(*args, **kwargs)
 
-        frames = OrderedDict([[i['filename'], {'filename': i['filename'],
-                                        'frame': {'x': i['x'],
-                                                  'y': i['y'],
-                                                  'w': i['width'],
-                                                  'h': i['height']},
-                                        'rotated': False,
-                                        'trimmed': False,
-                                        'spriteSourceSize': {'x': i['x'],
-                                                             'y': i['y'],
-                                                             'w': i['width'],
-                                                             'h': i['height']},
-                                        'sourceSize': {'w': i['original_width'],
-                                                       'h': i['original_height']}}] for i in context['images']])
-
-        data = OrderedDict(frames=None, meta={'version': context['version'],
-                                       'hash': context['hash'],
-                                       'name': context['name'],
-                                       'sprite_path': context['sprite_path'],
-                                       'sprite_filename': context['sprite_filename'],
-                                       'width': context['width'],
-                                       'height': context['height']})
+        frames = OrderedDict([[i['filename'], self.get_frame(i)] for i in context['images']])
+        data = OrderedDict(frames=None, meta=self.get_meta(context))
 
         if self.sprite.config['json_format'] == 'array':
             data['frames'] = list(frames.values())
@@ -65,3 +98,17 @@ class JSONFormat(BaseJSONFormat):
             data['frames'] = frames
 
         return data
+
+    def generate(self, *args, **kwargs):
+        if not self.sprite.config.get('json_compact'):
+            return super(JSONFormat, self).generate(*args, **kwargs)
+
+        # Stream every frame while it is generated instead of building the
+        # whole context first.
+        context = super(JSONFormat, self).get_context(*args, **kwargs)
+        if self.sprite.config['json_format'] == 'array':
+            frames = (self.get_frame(i) for i in context['images'])
+        else:
+            frames = LazyObject((i['filename'], self.get_frame(i)) for i in context['images'])
+        data = OrderedDict(frames=frames, meta=self.get_meta(context))
+        return iterencode_compact(data, json_backends[self.sprite.config.get('json_backend', 'json')]())
@@ -0,0 +1,106 @@
+from array import array
+
+from glue.helpers import round_up
+
+
+class FrameStore(object):
+    """Columnar store of the geometry of every image of a sprite.
+
+    Every column is an ``array`` with one value per image, using the same
+    order as ``sprite.images``. Algorithms write the position of each
+    image into ``x`` and ``y`` (through :attr:`glue.core.Image.x` and
+    :attr:`glue.core.Image.y`) and formats read the scaled geometry of each
+    ratio using :meth:`scaled`.
+    """
+
+    position_columns = ('x', 'y')
+    size_columns = ('width', 'height', 'original_width', 'original_height',
+                    'padding_top', 'padding_right', 'padding_bottom', 'padding_left',
+                    'margin_top', 'margin_right', 'margin_bottom', 'margin_left')
+
+    def __init__(self, images, ratios):
+        """FrameStore constructor.
+
+        :param images: List of :class:`~glue.core.Image`.
+        :param ratios: List of the ratios of the sprite.
+        """
+        self.ratios = ratios
+        self.max_ratio = max(ratios)
+        self.filenames = [image.filename for image in images]
+        self._scaled = {}
+
+        for column in self.position_columns:
+            setattr(self, column, array('d', [0] * len(images)))
+        for column in self.size_columns:
+            setattr(self, column, array('l', [0] * len(images)))
+
+        for index, image in enumerate(images):
+            self.width[index], self.height[index] = image.width, image.height
+            self.original_width[index] = image.original_width
+            self.original_height[index] = image.original_height
+            (self.padding_top[index], self.padding_right[index],
+             self.padding_bottom[index], self.padding_left[index]) = image.padding
+            (self.margin_top[index], self.margin_right[index],
+             self.margin_bottom[index], self.margin_left[index]) = image.margin
+            image.attach(self, index)
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def invalidate(self):
+        """Discard every scaled geometry computed using old positions."""
+        self._scaled.clear()
+
+    def scaled(self, ratio):
+        """Return the geometry of every image for this ratio as a dictionary
+        of columns (``x``, ``y``, ``abs_x``, ``abs_y``, ``width`` and
+        ``height``). ``x`` and ``y`` are the css background position.
+
+        The result is computed once per ratio.
+
+        :param ratio: Ratio.
+        """
+        if ratio not in self._scaled:
+            max_ratio = self.max_ratio
+
+            def scale(values):
+                return array('l', [round_up(v / max_ratio * ratio) for v in values])
+
+            margin_left = [m * max_ratio for m in self.margin_left]
+            margin_top = [m * max_ratio for m in self.margin_top]
+            abs_x = [x + m for x, m in zip(self.x, margin_left)]
+            abs_y = [y + m for y, m in zip(self.y, margin_top)]
+
+            self._scaled[ratio] = {
+                'x': scale([-x - m for x, m in zip(self.x, margin_left)]),
+                'y': scale([-y - m for y, m in zip(self.y, margin_top)]),
+                'abs_x': scale(abs_x),
+                'abs_y': scale(abs_y),
+                'width': scale([w + l + r for w, l, r in zip(self.width, self.padding_left, self.padding_right)]),
+                'height': scale([h + t + b for h, t, b in zip(self.height, self.padding_top, self.padding_bottom)]),
+            }
+        return self._scaled[ratio]
+
+    def css_sizes(self):
+        """Return the width and height of every image in css pixels. Unlike
+        :meth:`scaled`, paddings are never scaled."""
+        if 'css_sizes' not in self._scaled:
+            max_ratio = self.max_ratio
+            self._scaled['css_sizes'] = {
+                'width': array('l', [round_up((w / max_ratio) + l + r) for w, l, r in zip(self.width, self.padding_left, self.padding_right)]),
+                'height': array('l', [round_up((h / max_ratio) + t + b) for h, t, b in zip(self.height, self.padding_top, self.padding_bottom)]),
+            }
+        return self._scaled['css_sizes']
+
+    def frames(self, ratio=None):
+        """Return the geometry of every image as a list of dictionaries.
+
+        :param ratio: If set, return the scaled geometry of this ratio.
+        """
+        if ratio is None:
+            columns = dict(self.scaled(1.0), **self.css_sizes())
+        else:
+            columns = self.scaled(ratio)
+        names = sorted(columns)
+        return [dict(zip(names, values), filename=filename)
+                for filename, values in zip(self.filenames, zip(*[columns[n] for n in names]))]
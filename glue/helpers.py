@@ -1,5 +1,9 @@
 import os
 import sys
+import errno
+import binascii
+import hashlib
+import threading
 import contextlib
 from io import StringIO
 
@@ -24,6 +28,56 @@ def nearest_fration(value):
         return '%i/100' % int(float(value) * 100)
 
 
+def split_list(value, separator=','):
+    """Return the non-empty items of a ``separator`` separated string."""
+    return [item.strip() for item in (value or '').split(separator) if item.strip()]
+
+
+def default_cache_dir():
+    """Return the default directory where glue stores its caches."""
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'glue')
+
+
+def get_cache_dir(cache_dir, name):
+    """Return the path of the ``name`` cache inside ``cache_dir`` creating it
+    if required. If caching is disabled or the directory can't be created,
+    return ``None``.
+
+    :param cache_dir: glue cache directory.
+    :param name: Name of the cache.
+    """
+    if not cache_dir:
+        return None
+    path = os.path.join(cache_dir, name)
+    try:
+        if not os.path.isdir(path):
+            os.makedirs(path)
+    except OSError:
+        return None
+    return path
+
+
+def read_head(path, size):
+    """Return at most the first ``size`` bytes of ``path``."""
+    with open(path, 'rb') as f:
+        return f.read(size)
+
+
+def read_tail(path, size):
+    """Return at most the last ``size`` bytes of ``path``."""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - size))
+        return f.read()
+
+
+def read_file(path):
+    """Return the content of ``path``."""
+    with open(path, 'rb') as f:
+        return f.read()
+
+
 class _Missing(object):
     """ Missing object necessary for cached_property"""
     def __repr__(self):
@@ -60,9 +114,162 @@ class cached_property(object):
         return value
 
 
+class ThreadLocalStream(object):
+    """File-like object writing into a different stream for each thread.
+
+    Long-running processes running several builds at the same time (e.g.
+    ``glue daemon``) install it as ``sys.stdout`` and ``sys.stderr``, so
+    :func:`redirect_stdout` only redirects the output of the current thread.
+    """
+
+    def __init__(self, default):
+        """Stream constructor.
+
+        :param default: Stream used by threads without their own stream.
+        """
+        self.default = default
+        self.local = threading.local()
+
+    @property
+    def stream(self):
+        return getattr(self.local, 'stream', None) or self.default
+
+    def redirect(self, stream):
+        """Use ``stream`` for the current thread and return the previous one."""
+        previous = getattr(self.local, 'stream', None)
+        self.local.stream = stream
+        return previous
+
+    def write(self, data):
+        return self.stream.write(data)
+
+    def flush(self):
+        return self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
 @contextlib.contextmanager
+def redirect_stream(name, stream):
+    """Redirect ``sys.<name>`` to ``stream`` and restore it afterwards. If it
+    is a :class:`ThreadLocalStream`, only the current thread is redirected.
+
+    :param name: ``stdout`` or ``stderr``.
+    :param stream: Destination stream.
+    """
+    current = getattr(sys, name)
+    if isinstance(current, ThreadLocalStream):
+        previous = current.redirect(stream)
+        try:
+            yield
+        finally:
+            current.redirect(previous)
+    else:
+        setattr(sys, name, stream)
+        try:
+            yield
+        finally:
+            setattr(sys, name, current)
+
+
 def redirect_stdout(stream=None):
-    stream = stream or StringIO()
-    sys.stdout = stream
-    yield
-    sys.stdout = sys.__stdout__
+    return redirect_stream('stdout', stream or StringIO())
+
+
+def redirect_stderr(stream=None):
+    return redirect_stream('stderr', stream or StringIO())
+
+
+class AtomicFile(object):
+    """File-like object that writes into a temporary file next to ``path``
+    and only renames it over ``path`` on close if its content changed.
+
+    Readers never see half-written files and unchanged files keep their
+    modification time.
+    """
+
+    chunk_size = 1 << 16
+
+    def __init__(self, path, encoding=None):
+        """AtomicFile constructor.
+
+        :param path: Final path of this file.
+        :param encoding: If set, text will be encoded using this encoding.
+        """
+        self.path = path
+        self.encoding = encoding
+        self.changed = None
+        self._hash = hashlib.sha1()
+        self._size = 0
+        self._file = self._create_tmp_file()
+
+    def _create_tmp_file(self):
+        # Create the file using the default mode as open() does, so the
+        # umask applies to it without reading it (which would require
+        # changing it).
+        dirname, basename = os.path.split(self.path)
+        flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+        while True:
+            self.tmp_path = os.path.join(dirname or '.', '.{0}.{1}.tmp'.format(
+                basename, binascii.hexlify(os.urandom(4)).decode('ascii')))
+            try:
+                fd = os.open(self.tmp_path, flags, 0o666)
+            except OSError as e:
+                if e.errno == errno.EEXIST:
+                    continue
+                raise
+            return os.fdopen(fd, 'wb')
+
+    def write(self, data):
+        if self.encoding and not isinstance(data, bytes):
+            data = data.encode(self.encoding)
+        self._hash.update(data)
+        self._size += len(data)
+        self._file.write(data)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        """Sync the temporary file and replace ``path`` with it if the
+        content is different."""
+        if self._file.closed:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+        self.changed = not self._is_unchanged()
+        if self.changed:
+            os.replace(self.tmp_path, self.path)
+        else:
+            os.remove(self.tmp_path)
+
+    def discard(self):
+        """Close and remove the temporary file leaving ``path`` untouched."""
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def _is_unchanged(self):
+        try:
+            if os.path.getsize(self.path) != self._size:
+                return False
+            existing = hashlib.sha1()
+            with open(self.path, 'rb') as f:
+                for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                    existing.update(chunk)
+        except OSError:
+            return False
+        return existing.digest() == self._hash.digest()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
@@ -1,3 +1,4 @@
 from .project import ProjectManager
+from .serve import ServeManager
 from .simple import SimpleManager
 from .watch import WatchManager
@@ -1,5 +1,9 @@
+import os
+
 from glue.core import Sprite
+from glue.discovery import Discovery
 from glue.formats import formats
+from glue.helpers import cached_property
 
 
 class BaseManager(object):
@@ -8,11 +12,30 @@ class BaseManager(object):
         self.config = kwargs
         self.sprites = []
 
+        # Optional callable run before every expensive step. It can raise
+        # BuildCancelled to abort the current build (e.g. --watch does it
+        # if the sources change again while building).
+        self.cancel_check = None
+
     def process(self):
-        self.find_sprites()
+        self.discover()
         self.validate()
         self.save()
 
+    @cached_property
+    def discovery(self):
+        """:class:`~glue.discovery.Discovery` shared by every sprite of this
+        manager."""
+        return Discovery.from_config(self.config['source'], self.config)
+
+    def discover(self):
+        """Find every sprite and print how long discovery took if
+        ``discovery_stats`` is enabled."""
+        self.find_sprites()
+        if self.config.get('discovery_stats'):
+            print("{0}, {1} images found.".format(self.discovery.summary(),
+                                                  sum(len(s.images) for s in self.sprites)))
+
     def add_sprite(self, path):
         """Create a new Sprite using this path and name and append it to the
         sprites list.
@@ -20,24 +43,78 @@ class BaseManager(object):
         :param path: Sprite path.
         :param name: Sprite name.
         """
-        sprite = Sprite(path=path, config=self.config)
+        self.check_cancelled()
+        sprite = Sprite(path=path, config=self.config, discovery=self.discovery)
         self.sprites.append(sprite)
 
+    def check_cancelled(self):
+        if self.cancel_check is not None:
+            self.cancel_check()
+
     def find_sprites(self):
         raise NotImplementedError
 
-    def validate(self):
-        """Validate all sprites inside this manager."""
+    def refresh_sprites(self, paths):
+        """Create again only the sprites affected by the changed ``paths``.
+        The rest of the sprites keep their current objects. Return the list
+        of new sprites.
+
+        Return ``None`` if any change is outside the existing sprites
+        (e.g. a new sprite folder or a project-level config file), so the
+        whole manager must be processed again.
+
+        :param paths: List of changed absolute paths.
+        """
+        changed = set()
+        for path in paths:
+            sprite = self.find_sprite(path)
+            if sprite is None or not os.path.isdir(sprite.path):
+                return None
+            changed.add(sprite)
+
+        sprites = []
+        for index, sprite in enumerate(self.sprites):
+            if sprite in changed:
+                self.check_cancelled()
+                self.sprites[index] = Sprite(path=sprite.path, config=self.config, discovery=self.discovery)
+                sprites.append(self.sprites[index])
+        return sprites
+
+    def find_sprite(self, path):
+        """Return the sprite whose folder contains ``path`` or ``None``.
 
+        :param path: Absolute path.
+        """
         for sprite in self.sprites:
+            sprite_path = os.path.abspath(sprite.path)
+            if path == sprite_path or path.startswith(sprite_path + os.sep):
+                return sprite
+        return None
+
+    def validate(self, sprites=None):
+        """Validate all sprites inside this manager.
+
+        :param sprites: If set, only validate these sprites.
+        """
+
+        for sprite in (self.sprites if sprites is None else sprites):
             sprite.validate()
 
-    def save(self):
-        """Save all sprites inside this manager."""
+    def enabled_formats(self):
+        """Return the name of every format to build for each sprite."""
+        return self.config['enabled_formats']
+
+    def save(self, sprites=None):
+        """Save all sprites inside this manager.
 
-        for format_name in self.config['enabled_formats']:
+        :param sprites: If set, only save these sprites.
+        """
+
+        sprites = self.sprites if sprites is None else sprites
+        for format_name in self.enabled_formats():
             format_cls = formats[format_name]
-            for sprite in self.sprites:
+            for sprite in sprites:
+                self.check_cancelled()
                 format = format_cls(sprite=sprite)
                 format.validate()
                 if format.needs_rebuild() or sprite.config['force']:
@@ -45,3 +122,21 @@ class BaseManager(object):
                     format.build()
                 else:
                     print(("Format '{0}'' for sprite '{1}' already exists...".format(format_name, sprite.name)))
+
+        # Long-running processes (e.g. --watch) keep the decoded images
+        # in Image.cache for their next builds.
+        for sprite in sprites:
+            for image in sprite.images:
+                image.remember()
+
+    def output_paths(self):
+        """Return the absolute path of every file this manager generates."""
+        paths = set()
+        for format_name in self.enabled_formats():
+            for sprite in self.sprites:
+                format = formats[format_name](sprite=sprite)
+                for path in format.output_paths():
+                    paths.add(os.path.abspath(path))
+                    paths.update(os.path.abspath('{0}.{1}'.format(path, extension))
+                                 for extension, compressor in format.get_precompressors())
+        return paths
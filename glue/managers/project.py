@@ -3,6 +3,7 @@ import os
 from glue.exceptions import NoSpritesFoldersFoundError
 from .base import BaseManager
 from glue.core import ConfigurableFromFile
+from glue.formats.bundle import CssBundle
 
 
 class ProjectManager(BaseManager, ConfigurableFromFile):
@@ -18,20 +19,41 @@ class ProjectManager(BaseManager, ConfigurableFromFile):
 
     def find_sprites(self):
 
-        for filename in sorted(os.listdir(self.config['source'])):
-
-            # Only process folders
-            path = os.path.join(self.config['source'], filename)
-
-            # Ignore filenames starting with '.'
-            if filename.startswith('.'):
-                continue
-
-            # Ignore symlinks if necessary.
-            if not os.path.isdir(path) and not (os.path.islink(path) and self.config['follow_links']):
-                continue
-
+        # Every directory is a sprite unless it's hidden or excluded
+        for path in self.discovery.find_directories(self.config['source']):
             self.add_sprite(path=path)
 
         if not self.sprites:
             raise NoSpritesFoldersFoundError(self.config['source'])
+
+    def validate(self, sprites=None):
+        super(ProjectManager, self).validate(sprites)
+
+        # The bundle is always validated using every sprite
+        if self.config.get('css_bundle'):
+            self.bundle = CssBundle(self.sprites, self.config)
+            self.bundle.validate()
+
+    def enabled_formats(self):
+        # The css of every sprite is part of the bundle
+        formats = super(ProjectManager, self).enabled_formats()
+        if self.config.get('css_bundle'):
+            return [f for f in formats if f != 'css']
+        return formats
+
+    def save(self, sprites=None):
+        super(ProjectManager, self).save(sprites)
+
+        if self.config.get('css_bundle'):
+            self.check_cancelled()
+            if self.bundle.needs_rebuild() or self.config['force']:
+                print("CSS bundle '{0}' needs rebuild...".format(self.bundle.name))
+                self.bundle.save()
+            else:
+                print("CSS bundle '{0}' already exists...".format(self.bundle.name))
+
+    def output_paths(self):
+        paths = super(ProjectManager, self).output_paths()
+        if self.config.get('css_bundle'):
+            paths.update(os.path.abspath(path) for path in self.bundle.output_paths())
+        return paths
@@ -0,0 +1,139 @@
+import os
+import mimetypes
+import threading
+import socketserver
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlsplit, unquote
+
+from glue.formats import formats
+from .watch import WatchManager
+
+
+class SpriteRequestHandler(BaseHTTPRequestHandler):
+    """Serve the outputs of a :class:`ServeManager` from memory."""
+
+    def do_GET(self):
+        self.respond(body=True)
+
+    def do_HEAD(self):
+        self.respond(body=False)
+
+    def respond(self, body):
+        path = unquote(urlsplit(self.path).path)
+        files = self.server.manager.files
+
+        if path == '/':
+            links = ''.join('<li><a href="{0}">{0}</a></li>'.format(url) for url in sorted(files))
+            content, content_type, etag = ('<ul>{0}</ul>'.format(links).encode('utf-8'),
+                                           'text/html; charset=utf-8', None)
+        elif path in files:
+            content, content_type, etag = files[path]
+        else:
+            self.send_error(404)
+            return
+
+        # Browsers revalidate every request, so rebuilt sprites are used as
+        # soon as they are ready and unchanged ones are never sent again.
+        if etag and etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('Cache-Control', 'no-cache')
+        if etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        if body:
+            self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SpriteServer(socketserver.ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, manager):
+        self.manager = manager
+        HTTPServer.__init__(self, address, SpriteRequestHandler)
+
+
+class ServeManager(WatchManager):
+    """Keep glue running like :class:`WatchManager`, but render the outputs
+    in memory and serve them over HTTP instead of writing them.
+
+    Every output is available using its path relative to the common
+    directory of the enabled formats, e.g. ``/icons.css`` and
+    ``/icons.png``. The ETag of every output is the hash of its sprite.
+    """
+
+    def __init__(self, manager_cls, options):
+        super(ServeManager, self).__init__(manager_cls, options)
+
+        # Every output is served relative to the common output directory
+        directories = [options['{0}_dir'.format(f)] for f in options['enabled_formats']]
+        if options.get('css_bundle'):
+            directories.append(options['css_dir'])
+        self.root = os.path.commonpath([os.path.abspath(d) for d in directories])
+
+        # {url: (content, content type, etag)} of every output.
+        self.files = {}
+        self.sprite_files = {}
+        self.server = SpriteServer((options.get('serve_host', '127.0.0.1'),
+                                    int(options.get('serve_port', 8000))), self)
+
+    def url(self, path):
+        """Return the URL of the output ``path``."""
+        return '/' + os.path.relpath(os.path.abspath(path), self.root).replace(os.sep, '/')
+
+    def resources(self, outputs, hash):
+        """Return a dictionary with the resource of every output.
+
+        :param outputs: Iterable of ``(path, content)`` tuples.
+        :param hash: Hash of the sprite or bundle.
+        """
+        resources = {}
+        for path, content in outputs:
+            content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+            resources[self.url(path)] = (content, content_type, '"{0}"'.format(hash))
+        return resources
+
+    def save(self, manager, sprites=None):
+        sprite_files = {} if sprites is None else dict(self.sprite_files)
+        for sprite in (manager.sprites if sprites is None else sprites):
+            resources = {}
+            for format_name in manager.enabled_formats():
+                manager.check_cancelled()
+                format = formats[format_name](sprite=sprite)
+                format.validate()
+                resources.update(self.resources(format.outputs(), sprite.hash))
+            sprite_files[sprite.path] = resources
+            print("Sprite '{0}' ready...".format(sprite.name))
+
+            for image in sprite.images:
+                image.remember()
+
+        files = {}
+        for resources in sprite_files.values():
+            files.update(resources)
+        if manager.config.get('css_bundle'):
+            files.update(self.resources(manager.bundle.outputs(), manager.bundle.hash))
+
+        # Requests use the new outputs as soon as every sprite is ready
+        self.sprite_files, self.files = sprite_files, files
+
+    def process(self):
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        print("Serving sprites on http://{0}:{1}/".format(*self.server.server_address[:2]))
+        try:
+            super(ServeManager, self).process()
+        finally:
+            self.server.shutdown()
+            self.server.server_close()
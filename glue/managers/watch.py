@@ -1,43 +1,114 @@
-import os
 import sys
 import time
 import signal
-import hashlib
+
+from glue.cache import ImageCache
+from glue.core import Image
+from glue.discovery import Discovery
+from glue.exceptions import BuildCancelled
+from glue.watchers import get_watcher
 
 
 class WatchManager(object):
+    """Keep glue running and rebuild the sprites every time something
+    changes inside the source directory.
+
+    Changes are detected using :mod:`glue.watchers`. Outputs generated by
+    glue itself are ignored, so they can be inside the source directory.
+
+    Changes are coalesced until nothing changes for ``watch_debounce``
+    seconds, and if the sources change again while building, the build
+    is cancelled and starts over including the new changes.
+    """
 
     def __init__(self, manager_cls, options):
         self.manager_cls = manager_cls
         self.options = options
-        self.last_hash = self.manager = None
+        self.manager = None
+        self.watcher = get_watcher(options['source'],
+                                   options.get('watch_backend', 'auto'),
+                                   float(options.get('watch_interval', 0.2)),
+                                   Discovery.from_config(options['source'], options))
+        self.debounce = float(options.get('watch_debounce', 0.1))
+        self.last_check = 0
+
+        # Keep decoded images in memory, so rebuilds only decode the
+        # images that changed.
+        cache_size = int(options.get('watch_cache_size', 0)) * 1024 * 1024
+        self.image_cache = ImageCache(cache_size) if cache_size > 0 else None
         signal.signal(signal.SIGINT, self.signal_handler)
 
     def process(self):
+        Image.cache = self.image_cache
+        try:
+            changes = None
+            while True:
+                try:
+                    self.build(changes)
+                except BuildCancelled as e:
+                    print("Sources changed while building, starting over...")
+                    changes = (changes or set()) | self.wait_until_quiet(e.changes)
+                    continue
+                changes = self.wait_until_quiet(self.watcher.wait())
+        finally:
+            Image.cache = None
+
+    def wait_until_quiet(self, changes):
+        """Keep adding new changes to ``changes`` until nothing changes for
+        ``debounce`` seconds and return them.
+
+        :param changes: Set of changed paths.
+        """
         while True:
-            current_hash = self.generate_hash()
-            if self.last_hash != current_hash:
-                self.manager = self.manager_cls(**self.options)
-                self.manager.process()
-            self.last_hash = current_hash
-            time.sleep(0.2)
-
-    def generate_hash(self):
-        """ Return a hash of files and modification times to determine if a
-        change has occourred."""
-
-        hash_list = []
-        for root, dirs, files in os.walk(self.options['source']):
-            for f in sorted([f for f in files if not f.startswith('.')]):
-                hash_list.append(os.path.join(root, f))
-                hash_list.append(str(os.path.getmtime(os.path.join(root, f))))
-        hash_list = ''.join(hash_list)
-
-        if sys.version < '3':
-            return hashlib.sha1(hash_list).hexdigest()
-        return hashlib.sha1(hash_list.encode('utf-8')).hexdigest()
+            new_changes = self.watcher.wait(timeout=self.debounce)
+            if not new_changes:
+                return changes
+            changes |= new_changes
+
+    def check_changes(self):
+        """Raise :class:`~glue.exceptions.BuildCancelled` if something
+        changed since the current build started. The polling watcher scans
+        the whole tree, so it is checked at most once every interval."""
+        interval = getattr(self.watcher, 'interval', 0)
+        if time.time() - self.last_check < interval:
+            return
+        changes = self.watcher.wait(timeout=0)
+        self.last_check = time.time()
+        if changes:
+            raise BuildCancelled(changes)
+
+    def build(self, changes=None):
+        """Rebuild the sprites affected by ``changes``. If there is no
+        manager yet or the changes can't be mapped to its sprites, every
+        sprite is built again using a new manager.
+
+        :param changes: Set of changed paths.
+        """
+        self.last_check = time.time()
+        manager, sprites = self.manager, None
+        if manager and changes:
+            sprites = manager.refresh_sprites(changes)
+
+        if sprites is None:
+            # Until it is saved, a new manager can't be updated incrementally
+            self.manager = None
+            manager = self.manager_cls(**self.options)
+            manager.cancel_check = self.check_changes
+            manager.discover()
+
+        # Ignore the outputs before writing them
+        self.watcher.ignored_paths = manager.output_paths()
+        manager.validate(sprites)
+        self.save(manager, sprites)
+        self.manager = manager
+
+    def save(self, manager, sprites=None):
+        """Save the outputs of ``sprites`` or of every sprite of
+        ``manager`` if it isn't set."""
+        manager.save(sprites)
 
     def signal_handler(self, signal, frame):
         """ Gracefully close the app if Ctrl+C is pressed."""
         print('You pressed Ctrl+C!')
+        self.watcher.close()
         sys.exit(0)
@@ -0,0 +1,179 @@
+import struct
+import zlib
+
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+ZLIB_HEADER = b'\x78\x9c'
+ADLER_BASE = 65521
+
+
+def png_chunk(tag, data):
+    """Return a PNG chunk including its length and CRC.
+
+    :param tag: Chunk type (e.g. ``b'IDAT'``).
+    :param data: Chunk data.
+    """
+    crc = zlib.crc32(tag + data) & 0xffffffff
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', crc)
+
+
+def filter_rows(data, stride):
+    """Return ``data`` prefixing every row with the ``None`` filter type.
+
+    :param data: Raw bytes of one or more complete rows.
+    :param stride: Length of each row in bytes.
+    """
+    return b''.join([b'\x00' + data[i:i + stride] for i in range(0, len(data), stride)])
+
+
+def adler32_combine(adler1, adler2, length2):
+    """Return the adler32 checksum of two concatenated blocks of data
+    using only their checksums. Port of zlib's ``adler32_combine``.
+
+    :param adler1: Checksum of the first block.
+    :param adler2: Checksum of the second block.
+    :param length2: Length of the second block.
+    """
+    rem = length2 % ADLER_BASE
+    sum1 = adler1 & 0xffff
+    sum2 = (rem * sum1) % ADLER_BASE
+    sum1 += (adler2 & 0xffff) + ADLER_BASE - 1
+    sum2 += ((adler1 >> 16) & 0xffff) + ((adler2 >> 16) & 0xffff) + ADLER_BASE - rem
+    if sum1 >= ADLER_BASE:
+        sum1 -= ADLER_BASE
+    if sum1 >= ADLER_BASE:
+        sum1 -= ADLER_BASE
+    if sum2 >= (ADLER_BASE << 1):
+        sum2 -= (ADLER_BASE << 1)
+    if sum2 >= ADLER_BASE:
+        sum2 -= ADLER_BASE
+    return sum1 | (sum2 << 16)
+
+
+def deflate_band(data, stride, last, compress_level=6):
+    """Filter and deflate a band of raw rows independently of the rest of
+    the image, the same way pigz does.
+
+    Every band but the last one ends with a sync flush so the resulting
+    raw deflate streams can be concatenated into one valid stream by
+    :meth:`PNGWriter.write_deflated`.
+
+    Return a ``(compressed, checksum, length, rows)`` tuple.
+
+    :param data: Raw bytes of one or more complete rows.
+    :param stride: Length of each row in bytes.
+    :param last: Flag to determine if this is the last band of the image.
+    :param compress_level: zlib compression level.
+    """
+    filtered = filter_rows(data, stride)
+    compressor = zlib.compressobj(compress_level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    compressed = compressor.compress(filtered)
+    compressed += compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+    return compressed, zlib.adler32(filtered) & 0xffffffff, len(filtered), len(data) // stride
+
+
+def read_png_text(data):
+    """Return a dictionary with every tEXt chunk found before the image
+    data. Only the header of the PNG file is required, so this can be used
+    to read metadata without decoding (or even reading) the whole image.
+
+    :param data: First bytes of a PNG file.
+    """
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError("Not a PNG file.")
+
+    text, offset = {}, len(PNG_SIGNATURE)
+    while offset + 8 <= len(data):
+        length, tag = struct.unpack('>I4s', data[offset:offset + 8])
+        if tag in (b'IDAT', b'IEND') or offset + 12 + length > len(data):
+            break
+        if tag == b'tEXt':
+            key, value = data[offset + 8:offset + 8 + length].split(b'\x00', 1)
+            text[key.decode('latin-1')] = value.decode('latin-1')
+        offset += 12 + length
+    return text
+
+
+class PNGWriter(object):
+    """Write a RGBA PNG image band by band without requiring the whole
+    image to be in memory.
+
+    Every band must contain complete rows of raw RGBA pixels. Rows are
+    written using the ``None`` PNG filter. Bands could be written using
+    :meth:`write` or, if they were already deflated in parallel using
+    :func:`deflate_band`, using :meth:`write_deflated`, but both methods
+    can't be mixed.
+    """
+
+    idat_size = 1 << 16
+
+    def __init__(self, fileobj, width, height, text=None, compress_level=6):
+        """Writer constructor.
+
+        :param fileobj: Binary file-like object.
+        :param width: Image width.
+        :param height: Image height.
+        :param text: List of ``(key, value)`` tuples to save as tEXt chunks.
+        :param compress_level: zlib compression level.
+        """
+        self.fileobj = fileobj
+        self.width = width
+        self.height = height
+        self.stride = width * 4
+        self.rows = 0
+        self.compressor = zlib.compressobj(compress_level)
+        self.checksum = None
+        self._buffer = []
+        self._buffered = 0
+
+        fileobj.write(PNG_SIGNATURE)
+        fileobj.write(png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)))
+        for key, value in (text or []):
+            fileobj.write(png_chunk(b'tEXt', key.encode('latin-1') + b'\x00' + value.encode('latin-1')))
+
+    def write(self, data):
+        """Compress and write a band of raw RGBA rows.
+
+        :param data: Raw RGBA bytes of one or more complete rows.
+        """
+        if len(data) % self.stride:
+            raise ValueError("PNG bands must contain complete rows.")
+        self.rows += len(data) // self.stride
+        self._write_idat(self.compressor.compress(filter_rows(data, self.stride)))
+
+    def write_deflated(self, band):
+        """Write a band already deflated using :func:`deflate_band`.
+
+        :param band: ``(compressed, checksum, length, rows)`` tuple.
+        """
+        compressed, checksum, length, rows = band
+        if self.checksum is None:
+            self._write_idat(ZLIB_HEADER)
+            self.checksum = 1
+        self.checksum = adler32_combine(self.checksum, checksum, length)
+        self.rows += rows
+        self._write_idat(compressed)
+
+    def close(self):
+        """Flush the remaining compressed data and finish the image."""
+        if self.rows != self.height:
+            raise ValueError("Expected {0} rows but {1} were written.".format(self.height, self.rows))
+        if self.checksum is None:
+            self._write_idat(self.compressor.flush())
+        else:
+            self._write_idat(struct.pack('>I', self.checksum))
+        self._flush_idat()
+        self.fileobj.write(png_chunk(b'IEND', b''))
+
+    def _write_idat(self, data):
+        if data:
+            self._buffer.append(data)
+            self._buffered += len(data)
+        if self._buffered >= self.idat_size:
+            self._flush_idat()
+
+    def _flush_idat(self):
+        if self._buffered:
+            self.fileobj.write(png_chunk(b'IDAT', b''.join(self._buffer)))
+        self._buffer = []
+        self._buffered = 0
@@ -0,0 +1,367 @@
+import io
+import os
+import re
+import asyncio
+import threading
+from urllib.parse import parse_qs, urlencode
+
+from PIL import Image as PILImage
+
+from glue.api import Options, MemoryImage, MemorySprite, get_output_name, get_settings
+from glue.cache import MemoryCache
+from glue.core import Sprite
+from glue.discovery import Discovery
+from glue.exceptions import GlueError
+from glue.formats import ImageFormat
+from glue.formats.css import CssFormat
+from glue.formats.jsonformat import JSONFormat
+from glue.helpers import read_file
+
+
+class IconLibrary(object):
+    """Icons of a directory kept decoded in memory.
+
+    Every icon is named using its path relative to the directory without
+    the extension, e.g. ``home`` or ``social/twitter``. Its filename (and
+    so its css class) is its name using ``-`` instead of ``/``, e.g.
+    ``social-twitter.png``, so icons with the same name inside different
+    directories can be used in the same sprite.
+    """
+
+    def __init__(self, path, recursive=False, follow_links=False, include=None, exclude=None):
+        """Library constructor.
+
+        :param path: Directory of the icons.
+        :param recursive: Load the icons inside subdirectories too.
+        :param follow_links: Follow symlinks while loading recursively.
+        :param include: Glob patterns of the icons to load.
+        :param exclude: Glob patterns of the files and directories to skip.
+        """
+        self.path = path
+        self.recursive = recursive
+        self.discovery = Discovery(path, include, exclude, follow_links=follow_links)
+        self.icons = {}
+        self.version = 0
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """Read and decode every icon again. Sprites composed using the
+        previous icons are discarded."""
+        icons = {}
+        self.discovery.reset()
+        for path in self.discovery.find_images(self.path, Sprite.valid_extensions, self.recursive):
+            name = os.path.splitext(os.path.relpath(path, self.path))[0].replace(os.sep, '/')
+            data = read_file(path)
+            image = PILImage.open(io.BytesIO(data))
+            image.load()
+            icons[name] = (name.replace('/', '-') + os.path.splitext(path)[1], data, image)
+
+        with self.lock:
+            self.icons = icons
+            self.version += 1
+
+    def __contains__(self, name):
+        return name in self.icons
+
+    def __len__(self):
+        return len(self.icons)
+
+    def images(self, names):
+        """Return the filename, data and decoded image of every icon in
+        ``names`` and the version of the library they belong to.
+
+        :param names: Names of the icons.
+        """
+        with self.lock:
+            return [self.icons[name] for name in names], self.version
+
+
+class LibraryImage(MemoryImage):
+    """Image of an :class:`IconLibrary`. The icon is already decoded, so
+    only its conversion and crop depend on the sprite settings."""
+
+    def __init__(self, filename, data, image, config):
+        self.data = data
+        super(LibraryImage, self).__init__(filename, image, config)
+
+    def _load(self):
+        self._image_data = self.data
+        self._variants_data = {}
+
+
+class LibrarySprite(MemorySprite):
+    """Sprite using icons of an :class:`IconLibrary`."""
+
+    def _locate_images(self):
+        return self._sort_images([LibraryImage(filename, data, image, self.config)
+                                  for filename, data, image in self.sources])
+
+
+class QueryMixin(object):
+    """Add the query of the composed sprite to the url of its images."""
+
+    def with_query(self, path):
+        query = self.sprite.config['service_query']
+        if not query or path.startswith('data:'):
+            return path
+        return '{0}{1}{2}'.format(path, '&' if '?' in path else '?', query)
+
+
+class ServiceCssFormat(QueryMixin, CssFormat):
+
+    format_label = 'css'
+
+    def _generate_css_context(self, *args, **kwargs):
+        context = super(ServiceCssFormat, self)._generate_css_context(*args, **kwargs)
+        context['sprite_path'] = self.with_query(context['sprite_path'])
+        for ratio in context['ratios'].values():
+            ratio['sprite_path'] = self.with_query(ratio['sprite_path'])
+        return context
+
+
+class ServiceJSONFormat(QueryMixin, JSONFormat):
+
+    format_label = 'json'
+
+    def get_meta(self, context):
+        meta = super(ServiceJSONFormat, self).get_meta(context)
+        meta['sprite_path'] = self.with_query(meta['sprite_path'])
+        return meta
+
+
+class SpriteService(object):
+    """WSGI and ASGI application composing sprites on demand using the
+    icons of an :class:`IconLibrary`.
+
+    ``GET /<name>.css?icons=home,search`` returns the css of a sprite
+    named ``<name>`` with only those icons. The same query returns its
+    json (``/<name>.json``) and its images (``/<name>.png`` and
+    ``/<name>@<ratio>x.png``). Every output of a sprite is composed and
+    encoded at once and kept in an LRU cache bounded by ``cache_size``.
+    """
+
+    path_re = re.compile(r'^/(?P<name>[\w-]+)(@\d+(\.\d+)?x)?\.(?P<format>css|json|png)$')
+
+    content_types = {'css': 'text/css; charset=utf-8',
+                     'json': 'application/json',
+                     'png': 'image/png'}
+
+    def __init__(self, library, options=None, allowed_options=('algorithm', 'algorithm_ordering',
+                                                                'padding', 'margin', 'ratios'),
+                 cache_size=64 * 1024 * 1024, max_icons=1000, max_age=3600,
+                 max_spacing=100, max_ratio=4, max_pixels=4096 * 4096):
+        """Service constructor.
+
+        :param library: :class:`IconLibrary`.
+        :param options: :class:`~glue.api.Options` used by every sprite.
+        :param allowed_options: Settings each request can change using its
+                                query, e.g. ``?icons=home&padding=2``.
+        :param cache_size: Memory in bytes used to keep composed sprites.
+        :param max_icons: Maximum number of icons of every sprite.
+        :param max_age: Seconds clients can use a sprite without
+                        revalidating it.
+        :param max_spacing: Maximum padding and margin of every request.
+        :param max_ratio: Maximum ratio of every request.
+        :param max_pixels: Maximum area of the biggest canvas of a sprite.
+        """
+        options = options or Options()
+        # Every output is served next to each other, so the relative paths
+        # between them would point to files that don't exist.
+        for format in ('img', 'css', 'json'):
+            if isinstance(getattr(options, '{0}_dir'.format(format)), str):
+                raise ValueError("The service can't use '{0}_dir' as every output is "
+                                 "served using the same path.".format(format))
+        self.library = library
+        self.options = options
+        self.allowed_options = allowed_options
+        self.max_icons = max_icons
+        self.max_age = max_age
+        self.max_spacing = max_spacing
+        self.max_ratio = max_ratio
+        self.max_pixels = max_pixels
+        self.cache = MemoryCache(cache_size)
+
+    def get_options(self, params):
+        """Return the :class:`~glue.api.Options` of a request and the
+        canonical query of its sprite.
+
+        :param params: Dictionary with the query of the request.
+        """
+        names = sorted(set(n for n in params.pop('icons', '').split(',') if n))
+        if not names:
+            raise ValueError("The icons parameter is required.")
+        if len(names) > self.max_icons:
+            raise ValueError("Sprites can't use more than {0} icons.".format(self.max_icons))
+
+        settings = dict((dest, getattr(self.options, dest)) for dest in get_settings())
+        for key, value in params.items():
+            if key not in self.allowed_options:
+                raise ValueError("Unknown parameter '{0}'.".format(key))
+            self.check_option(key, value)
+            settings[key] = value
+        options = Options(**settings)
+        options.validate()
+
+        query = urlencode([('icons', ','.join(names))] + sorted(params.items()), safe=',/')
+        return names, options, query
+
+    def check_option(self, key, value):
+        """Raise ``ValueError`` if a setting of the query of a request is
+        out of the bounds of this service.
+
+        :param key: Name of the setting.
+        :param value: Value of the setting as a string.
+        """
+        if key in ('padding', 'margin'):
+            try:
+                values = [int(v) for v in value.replace(',', ' ').split()]
+            except ValueError:
+                raise ValueError("Invalid value for '{0}': {1!r}.".format(key, value))
+            if not 1 <= len(values) <= 4 or not all(0 <= v <= self.max_spacing for v in values):
+                raise ValueError("{0} must be between 0 and {1}.".format(key, self.max_spacing))
+        elif key == 'ratios':
+            try:
+                values = [float(v) for v in value.split(',') if v.strip()]
+            except ValueError:
+                raise ValueError("Invalid value for '{0}': {1!r}.".format(key, value))
+            if not 1 <= len(values) <= 4 or not all(0 < v <= self.max_ratio for v in values):
+                raise ValueError("ratios must be up to 4 values greater than 0 and "
+                                 "not greater than {0}.".format(self.max_ratio))
+
+    def compose(self, name, names, options, query=''):
+        """Return the outputs of the sprite ``name`` using the icons
+        ``names`` as a dictionary ``{filename: content}`` and its hash.
+        Composed sprites are cached.
+
+        :param name: Name of the sprite.
+        :param names: Names of the icons.
+        :param options: :class:`~glue.api.Options`.
+        :param query: Query added to the url of the images of the sprite.
+        """
+        missing = [n for n in names if n not in self.library]
+        if missing:
+            raise KeyError("Unknown icons: {0}.".format(', '.join(missing)))
+
+        images, version = self.library.images(names)
+        key = (name, query)
+        entry = self.cache.get(key, version)
+        if entry is not None:
+            return entry
+
+        config = options.get_config()
+        config['service_query'] = query
+        sprite = LibrarySprite(name, images, config)
+        sprite.validate()
+
+        # Icons are already packed, but no canvas was created yet
+        width, height = sprite.canvas_size
+        if width * height > self.max_pixels:
+            raise ValueError("The sprite would be bigger than {0} pixels.".format(self.max_pixels))
+
+        files = {}
+        for format_cls in (ServiceCssFormat, ServiceJSONFormat, ImageFormat):
+            format = format_cls(sprite=sprite)
+            format.validate()
+            for path, content in format.outputs():
+                files[get_output_name(path)] = content
+
+        entry = files, sprite.hash
+        self.cache.put(key, version, entry, sum(len(c) for c in files.values()))
+        return entry
+
+    def respond(self, method, path, query_string, if_none_match=''):
+        """Return the status, headers and body of a request.
+
+        :param method: HTTP method.
+        :param path: Path of the request.
+        :param query_string: Query of the request.
+        :param if_none_match: ``If-None-Match`` header of the request.
+        """
+        if method not in ('GET', 'HEAD'):
+            return self.error(405, "Method not allowed.")
+
+        match = self.path_re.match(path)
+        if not match:
+            return self.error(404, "Not found.")
+
+        params = dict((k, v[-1]) for k, v in parse_qs(query_string).items())
+        try:
+            names, options, query = self.get_options(params)
+            files, hash = self.compose(match.group('name'), names, options, query)
+        except KeyError as e:
+            return self.error(404, e.args[0])
+        except (ValueError, TypeError, GlueError) as e:
+            return self.error(400, str(e))
+
+        filename = path[1:]
+        if filename not in files:
+            return self.error(404, "Not found.")
+
+        etag = '"{0}"'.format(hash)
+        if etag in [tag.strip() for tag in if_none_match.split(',')]:
+            return 304, [('ETag', etag)], b''
+
+        content = files[filename]
+        headers = [('Content-Type', self.content_types[match.group('format')]),
+                   ('Content-Length', str(len(content))),
+                   ('Cache-Control', 'public, max-age={0}'.format(self.max_age)),
+                   ('ETag', etag)]
+        return 200, headers, content if method == 'GET' else b''
+
+    def error(self, status, message):
+        body = message.encode('utf-8')
+        return status, [('Content-Type', 'text/plain; charset=utf-8'),
+                        ('Content-Length', str(len(body)))], body
+
+    def __call__(self, environ, start_response):
+        """WSGI application."""
+        status, headers, body = self.respond(environ['REQUEST_METHOD'],
+                                             environ.get('PATH_INFO', '/'),
+                                             environ.get('QUERY_STRING', ''),
+                                             environ.get('HTTP_IF_NONE_MATCH', ''))
+        start_response('{0} {1}'.format(status, STATUS_REASONS[status]), headers)
+        return [body]
+
+    async def asgi(self, scope, receive, send):
+        """ASGI application. Sprites are composed in the default executor
+        of the event loop."""
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        if scope['type'] != 'http':
+            return
+
+        headers = dict((k.decode('latin-1').lower(), v.decode('latin-1')) for k, v in scope['headers'])
+        status, headers, body = await asyncio.get_running_loop().run_in_executor(
+            None, self.respond, scope['method'], scope['path'],
+            scope.get('query_string', b'').decode('latin-1'), headers.get('if-none-match', ''))
+
+        await send({'type': 'http.response.start',
+                    'status': status,
+                    'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]})
+        await send({'type': 'http.response.body', 'body': body})
+
+
+STATUS_REASONS = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request',
+                  404: 'Not Found', 405: 'Method Not Allowed'}
+
+
+def make_app(path, asgi=False, recursive=False, cache_size=64, **options):
+    """Return a :class:`SpriteService` application using the icons of
+    ``path``, e.g. ``gunicorn 'glue.service:make_app("icons")'``.
+
+    :param path: Directory of the icons.
+    :param asgi: Return the ASGI application instead of the WSGI one.
+    :param recursive: Load the icons inside subdirectories too.
+    :param cache_size: Memory in MB used to keep composed sprites.
+    :param options: Settings of every sprite, as :class:`~glue.api.Options`.
+    """
+    service = SpriteService(IconLibrary(path, recursive=recursive), Options(**options),
+                            cache_size=cache_size * 1024 * 1024)
+    return service.asgi if asgi else service
@@ -0,0 +1,259 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+
+def is_hidden(path):
+    """Return ``True`` if the file or directory name starts with ``.``.
+    glue ignores hidden files and writes its temporary files as hidden."""
+    return os.path.basename(path).startswith('.')
+
+
+class BaseWatcher(object):
+    """Watch a directory tree for changes.
+
+    Hidden files and every path in ``ignored_paths`` (e.g. the outputs
+    glue just wrote) never count as changes. If there is a ``discovery``,
+    the paths it excludes don't count either and excluded directories are
+    never scanned.
+    """
+
+    def __init__(self, path, discovery=None):
+        """Watcher constructor.
+
+        :param path: Directory to watch.
+        :param discovery: Optional :class:`~glue.discovery.Discovery`.
+        """
+        self.path = os.path.abspath(path)
+        self.ignored_paths = set()
+        self.discovery = discovery
+
+    def ignore(self, path):
+        if is_hidden(path) or path in self.ignored_paths:
+            return True
+        return self.discovery is not None and self.discovery.is_excluded(path)
+
+    def skip_directory(self, path):
+        """Return ``True`` if nothing inside the directory ``path`` can
+        change the sprites."""
+        return self.discovery is not None and self.discovery.is_excluded(path, is_dir=True)
+
+    def wait(self, timeout=None):
+        """Block until something changes and return the set of changed
+        paths. If ``timeout`` seconds pass without changes, return an empty
+        set.
+
+        :param timeout: Maximum number of seconds to wait.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class PollingWatcher(BaseWatcher):
+    """Detect changes comparing the size and modification time of every
+    file every ``interval`` seconds."""
+
+    def __init__(self, path, interval=0.2, discovery=None):
+        """Watcher constructor.
+
+        :param path: Directory to watch.
+        :param interval: Seconds between two scans.
+        :param discovery: Optional :class:`~glue.discovery.Discovery`.
+        """
+        super(PollingWatcher, self).__init__(path, discovery)
+        self.interval = interval
+        self.snapshot = self.scan()
+
+    def scan(self):
+        """Return a dictionary with the ``(mtime, size)`` of every file."""
+        if self.discovery is not None:
+            # Ignore files can change between scans
+            self.discovery.reset()
+        snapshot, pending = {}, [self.path]
+        while pending:
+            try:
+                entries = list(os.scandir(pending.pop()))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not self.skip_directory(entry.path):
+                            pending.append(entry.path)
+                    else:
+                        st = entry.stat()
+                        snapshot[entry.path] = (st.st_mtime_ns, st.st_size)
+                except OSError:
+                    continue
+        return snapshot
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            time.sleep(self.interval if deadline is None else max(0, min(self.interval, deadline - time.time())))
+            snapshot = self.scan()
+            changes = set(path for path in set(snapshot) | set(self.snapshot)
+                          if snapshot.get(path) != self.snapshot.get(path))
+            self.snapshot = snapshot
+            changes = set(path for path in changes if not self.ignore(path))
+            if changes or (deadline is not None and time.time() >= deadline):
+                return changes
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+inotify_event = struct.Struct('iIII')
+
+
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1, libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return libc
+
+
+class InotifyWatcher(BaseWatcher):
+    """Detect changes using Linux inotify events, so no file is scanned
+    unless it changes. Every directory of the tree is watched, including
+    the ones created later."""
+
+    libc = _load_libc()
+
+    @classmethod
+    def available(cls):
+        return cls.libc is not None
+
+    def __init__(self, path, discovery=None):
+        super(InotifyWatcher, self).__init__(path, discovery)
+        if not self.available():
+            raise OSError(errno.ENOSYS, "inotify is not available.")
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed.")
+        self.watches = {}
+        self.add_tree(self.path)
+
+    def add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd >= 0:
+            self.watches[wd] = path
+        elif ctypes.get_errno() == errno.ENOSPC:
+            raise OSError(errno.ENOSPC, "inotify watch limit reached, use --watch-backend=poll.")
+
+    def add_tree(self, path):
+        """Watch ``path`` and every directory inside it. Return the files
+        found, as they could have been created before being watched."""
+        files, pending = [], [path]
+        while pending:
+            directory = pending.pop()
+            self.add_watch(directory)
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    if not self.skip_directory(entry.path):
+                        pending.append(entry.path)
+                else:
+                    files.append(entry.path)
+        return files
+
+    def read_events(self):
+        """Return a list of ``(path, mask)`` tuples for every pending event."""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 1 << 16)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return events
+                raise
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = inotify_event.unpack_from(data, offset)
+                offset += inotify_event.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    events.append((self.path, mask))
+                elif wd in self.watches:
+                    directory = self.watches[wd]
+                    if mask & IN_IGNORED:
+                        del self.watches[wd]
+                    else:
+                        events.append((os.path.join(directory, os.fsdecode(name)) if name else directory, mask))
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            remaining = None if deadline is None else max(0, deadline - time.time())
+            if not select.select([self.fd], [], [], remaining)[0]:
+                return set()
+
+            if self.discovery is not None:
+                # Ignore files can change between events
+                self.discovery.reset()
+            changes = set()
+            for path, mask in self.read_events():
+                if self.ignore(path) or (mask & IN_ISDIR and self.skip_directory(path)):
+                    continue
+                changes.add(path)
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    changes.update(p for p in self.add_tree(path) if not self.ignore(p))
+            if changes:
+                return changes
+
+    def close(self):
+        os.close(self.fd)
+
+
+watcher_backends = ('auto', 'inotify', 'poll')
+
+
+def get_watcher(path, backend='auto', interval=0.2, discovery=None):
+    """Return a watcher for ``path`` using this backend. ``auto`` uses
+    inotify if it's available and polling otherwise.
+
+    :param path: Directory to watch.
+    :param backend: One of ``auto``, ``inotify`` or ``poll``.
+    :param interval: Seconds between scans of the polling watcher.
+    :param discovery: Optional :class:`~glue.discovery.Discovery` used to
+                      skip excluded paths.
+    """
+    if backend == 'inotify' or (backend == 'auto' and InotifyWatcher.available()):
+        return InotifyWatcher(path, discovery)
+    return PollingWatcher(path, interval, discovery)
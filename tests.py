@@ -1,16 +1,27 @@
+import io
 import os
 import sys
 import json
+import base64
+import asyncio
 import codecs
 import shutil
+import tempfile
 import unittest
 import logging
+import threading
+import plistlib
 
 try:
     from io import StringIO
 except ImportError:
     from io import StringIO
 
+try:
+    from http.client import HTTPConnection
+except ImportError:
+    from httplib import HTTPConnection
+
 from plistlib import readPlist
 
 from PIL import Image as PILImage
@@ -21,9 +32,22 @@ try:
 except ImportError:
     from unittest.mock import patch, Mock
 
+from glue.aio import AsyncBuilder
+from glue.api import build, Options
 from glue.bin import main
-from glue.core import Image
+from glue.cache import ImageCache
+from glue.core import Image, Sprite
+from glue.daemon import BuildDaemon, is_loopback, read_token, request
+from glue.discovery import Discovery
+from glue.exceptions import BuildCancelled
+from glue.service import IconLibrary, SpriteService
+from glue.formats.base import BaseTextFormat
+from glue.formats.atlas import AtlasFormat
+from glue.formats.css import CssFormat
+from glue.formats.img import ImageFormat
 from glue.helpers import redirect_stdout
+from glue.managers import ServeManager, WatchManager
+from glue.watchers import InotifyWatcher, PollingWatcher
 
 
 RED = (255, 0, 0, 255)
@@ -47,6 +71,18 @@ class TestGlue(unittest.TestCase):
 
     TEST_PATH = 'tests_tmp/'
 
+    @classmethod
+    def setUpClass(cls):
+        # Keep the caches of every run outside of the user cache directory
+        cls.cache_path = tempfile.mkdtemp(prefix='glue-tests-')
+        cls.environ = patch.dict(os.environ, {'GLUE_CACHE_DIR': cls.cache_path})
+        cls.environ.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.environ.stop()
+        shutil.rmtree(cls.cache_path, True)
+
     def setUp(self):
         cssutils.log.setLevel(logging.ERROR)
         self.base_path = os.path.dirname(os.path.abspath(__file__))
@@ -246,6 +282,41 @@ class TestGlue(unittest.TestCase):
                         'width': '64px',
                         'height': '64px'})
 
+    def test_discovery(self):
+        self.create_image("simple/red.png", RED)
+        self.create_image("simple/sub/green.png", GREEN)
+        self.create_image("simple/sub/draft-blue.png", BLUE)
+        self.create_image("simple/node_modules/pink.png", PINK)
+        self.create_image("simple/.git/yellow.png", YELLOW)
+        with open("simple/sub/.glueignore", "w") as f:
+            f.write("# Drafts\ndraft-*\n")
+
+        code, output = self.call("glue simple output --recursive --exclude=node_modules/,.*/ --discovery-stats",
+                                 capture=True)
+        self.assertEqual(code, 0)
+        added = sorted(line.split()[0] for line in output.splitlines() if 'added to sprite' in line)
+        self.assertEqual(added, ['green.png', 'red.png'])
+        self.assertTrue("Discovery scanned 2 directories" in output)
+
+        # Hidden directories are searched unless they are excluded
+        code, output = self.call("glue simple hidden --recursive --exclude=node_modules/", capture=True)
+        self.assertEqual(code, 0)
+        added = sorted(line.split()[0] for line in output.splitlines() if 'added to sprite' in line)
+        self.assertEqual(added, ['green.png', 'red.png', 'yellow.png'])
+
+        code, output = self.call("glue simple output2 --recursive --include=sub/*.png --ignore-file=",
+                                 capture=True)
+        added = sorted(line.split()[0] for line in output.splitlines() if 'added to sprite' in line)
+        self.assertEqual(added, ['draft-blue.png', 'green.png'])
+
+        discovery = Discovery("simple", exclude="node_modules/")
+        self.assertTrue(discovery.is_excluded("simple/node_modules/pink.png"))
+        self.assertTrue(discovery.is_excluded("simple/sub/draft-blue.png"))
+        self.assertFalse(discovery.is_excluded("simple/sub/green.png"))
+        self.assertFalse(discovery.is_excluded("simple/.git/yellow.png"))
+        self.assertTrue(discovery.is_excluded("simple/sub/.glueignore"))
+        self.assertEqual(discovery.find_directories("simple"), [os.path.join("simple", "sub")])
+
     def test_project(self):
         # Empty project
         os.mkdir("sprites")
@@ -554,6 +625,52 @@ class TestGlue(unittest.TestCase):
         assert red < blue
         assert blue < alpha_path
 
+    def test_project_css_bundle(self):
+        self.create_image("sprites/icons/red.png", RED)
+        self.create_image("sprites/icons/blue.png", BLUE)
+        self.create_image("sprites/menu/green.png", GREEN)
+        self.create_image("sprites/menu/yellow.png", YELLOW)
+        code = self.call("glue sprites output --project --css-bundle")
+        self.assertEqual(code, 0)
+
+        self.assertExists("output/icons.png")
+        self.assertExists("output/menu.png")
+        self.assertExists("output/sprites.css")
+        self.assertExists("output/sprites.json")
+        self.assertDoesNotExists("output/icons.css")
+        self.assertDoesNotExists("output/menu.css")
+
+        self.assertCSS("output/sprites.css", '.sprite-icons-blue',
+                       {'background-image': "url(icons.png)",
+                        'background-repeat': 'no-repeat',
+                        'background-position': '-64px 0',
+                        'width': '64px',
+                        'height': '64px'})
+
+        self.assertCSS("output/sprites.css", '.sprite-menu-yellow',
+                       {'background-image': "url(menu.png)",
+                        'background-repeat': 'no-repeat',
+                        'background-position': '0 0',
+                        'width': '64px',
+                        'height': '64px'})
+
+        with open("output/sprites.json") as f:
+            index = json.loads(f.read())
+        self.assertEqual(list(index['sprites'].keys()), ['icons', 'menu'])
+        self.assertEqual(index['sprites']['menu']['images']['green.png']['class'], 'sprite-menu-green')
+        self.assertEqual(index['meta']['css'], 'sprites.css')
+
+        code, output = self.call("glue sprites output --project --css-bundle", capture=True)
+        self.assertEqual(code, 0)
+        self.assertTrue("CSS bundle 'sprites' already exists" in output)
+
+        # Class names must be unique across sprites
+        self.create_image("sprites/more/red.png", RED)
+        code = self.call("glue sprites output --project --css-bundle --sprite-namespace=")
+        self.assertEqual(code, 3)
+
+        self.assertRaises(SystemExit, self.call, "glue sprites output --css-bundle")
+
     def test_css(self):
         self.create_image("simple/red.png", RED)
         self.create_image("simple/blue.png", BLUE)
@@ -585,6 +702,104 @@ class TestGlue(unittest.TestCase):
         code = self.call("glue simple output --recursive")
         self.assertEqual(code, 3)
 
+    def test_css_names_are_generated_once(self):
+        self.create_image("simple/red.png", RED)
+        self.create_image("simple/blue.png", BLUE)
+
+        generate_css_name = CssFormat.generate_css_name
+        with patch.object(CssFormat, 'generate_css_name', autospec=True,
+                          side_effect=generate_css_name) as mocked:
+            code = self.call("glue simple output --css --less --scss --html")
+            self.assertEqual(code, 0)
+            self.assertEqual(mocked.call_count, 2)
+
+    def test_css_minify(self):
+        self.create_image("simple/red.png", RED)
+        self.create_image("simple/blue.png", BLUE)
+        code = self.call("glue simple output --css-minify --css --less --retina")
+        self.assertEqual(code, 0)
+
+        with codecs.open("output/simple.css", 'r', 'utf-8') as f:
+            lines = f.read().split('\n')
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith('/* glue: '))
+        # Selectors are only listed once, every ratio only sets its url
+        self.assertEqual(lines[1].count('.sprite-simple-red,'), 1)
+        self.assertTrue("{:root{--glue-simple:url('simple@2x.png')}}" in lines[1])
+        self.assertTrue("background-image:var(--glue-simple);" in lines[1])
+
+        self.assertCSS("output/simple.css", '.sprite-simple-blue',
+                       {'background-image': "var(--glue-simple)",
+                        'background-repeat': 'no-repeat',
+                        '-webkit-background-size': '64px 32px',
+                        '-moz-background-size': '64px 32px',
+                        'background-size': '64px 32px',
+                        'background-position': '-32px 0',
+                        'width': '32px',
+                        'height': '32px'})
+
+        with codecs.open("output/simple.less", 'r', 'utf-8') as f:
+            self.assertEqual(len(f.read().split('\n')), 2)
+
+    def test_css_precompress(self):
+        import gzip
+        self.create_image("simple/red.png", RED)
+        self.create_image("simple/blue.png", BLUE)
+        code = self.call("glue simple output --css-precompress --html")
+        self.assertEqual(code, 0)
+
+        with open("output/simple.css", 'rb') as f:
+            css = f.read()
+        with gzip.open("output/simple.css.gz", 'rb') as f:
+            self.assertEqual(f.read(), css)
+        self.assertDoesNotExists("output/simple.html.gz")
+
+        code, output = self.call("glue simple output --css-precompress --html", capture=True)
+        self.assertEqual(code, 0)
+        self.assertTrue("Format 'css'' for sprite 'simple' already exists" in output)
+
+        os.remove("output/simple.css.gz")
+        code, output = self.call("glue simple output --css-precompress --html", capture=True)
+        self.assertEqual(code, 0)
+        self.assertTrue("Format 'css' for sprite 'simple' needs rebuild" in output)
+        self.assertExists("output/simple.css.gz")
+
+        # Copies of previous builds are removed once precompression is off
+        code, output = self.call("glue simple output --html", capture=True)
+        self.assertEqual(code, 0)
+        self.assertTrue("Format 'css' for sprite 'simple' needs rebuild" in output)
+        self.assertExists("output/simple.css")
+        self.assertDoesNotExists("output/simple.css.gz")
+
+        self.assertRaises(SystemExit, self.call, "glue simple output --css-precompress=zip")
+
+    def test_css_inline(self):
+        self.create_image("simple/red.png", RED)
+        self.create_image("simple/blue.png", BLUE)
+        code = self.call("glue simple output --css-inline=100000")
+        self.assertEqual(code, 0)
+
+        with open("output/simple.png", 'rb') as f:
+            data_uri = 'data:image/png;base64,{0}'.format(base64.b64encode(f.read()).decode('ascii'))
+        with codecs.open("output/simple.css", 'r', 'utf-8') as f:
+            css = f.read()
+        self.assertTrue("url('{0}')".format(data_uri) in css)
+        self.assertFalse("url('simple.png')" in css)
+
+        # Sprites bigger than the threshold are linked
+        code = self.call("glue simple output --css-inline=10")
+        self.assertEqual(code, 0)
+        with codecs.open("output/simple.css", 'r', 'utf-8') as f:
+            css = f.read()
+        self.assertTrue("url('simple.png')" in css)
+        self.assertFalse("data:image/png" in css)
+
+        # Linked sprites are streamed to disk as usual
+        code = self.call("glue simple plain")
+        self.assertEqual(code, 0)
+        self.assertEqual(PILImage.open("output/simple.png").tobytes(),
+                         PILImage.open("plain/simple.png").tobytes())
+
     def test_less(self):
         self.create_image("simple/red.png", RED)
         self.create_image("simple/blue.png", BLUE)
@@ -985,6 +1200,32 @@ class TestGlue(unittest.TestCase):
             content = f.read()
             self.assertEqual(content, "custom css template for {0}".format(12345))
 
+    def test_css_template_changes(self):
+        self.create_image("simple/red.png", RED)
+        with open('template.jinja', 'w') as f:
+            f.write("first template")
+
+        code = self.call("glue simple output --css-template=template.jinja --cache-dir=cache")
+        self.assertEqual(code, 0)
+        self.assertTrue(os.listdir("cache/templates"))
+
+        # The cache directory doesn't change the hash of the sprite
+        code = self.call("glue simple builtin --cache-dir=cache")
+        self.assertEqual(code, 0)
+        code, output = self.call("glue simple builtin --cache-dir=other", capture=True)
+        self.assertEqual(code, 0)
+        self.assertTrue("Format 'css'' for sprite 'simple' already exists" in output)
+
+        # Templates are cached but reloaded as soon as they change
+        with open('template.jinja', 'w') as f:
+            f.write("second template!")
+
+        code = self.call("glue simple output --css-template=template.jinja --cache-dir=cache --force")
+        self.assertEqual(code, 0)
+
+        with codecs.open('output/simple.css', 'r', 'utf-8-sig') as f:
+            self.assertEqual(f.read(), "second template!")
+
     @patch('glue.core.Sprite.hash')
     def test_less_template(self, mocked_hash):
         mocked_hash.__get__ = Mock(return_value="12345")
@@ -1048,8 +1289,14 @@ class TestGlue(unittest.TestCase):
             assert isinstance(data['frames'], list)
 
         # Rebuild in order to test the ``needs_rebuild`` method
-        code = self.call("glue simple output --json")
+        code, output = self.call("glue simple output --json", capture=True)
         self.assertEqual(code, 0)
+        self.assertTrue("Format 'json'' for sprite 'simple' already exists" in output)
+
+        self.create_image("simple/green.png", GREEN)
+        code, output = self.call("glue simple output --json", capture=True)
+        self.assertEqual(code, 0)
+        self.assertTrue("Format 'json' for sprite 'simple' needs rebuild" in output)
 
     def test_json_ratios(self):
         self.create_image("simple/red.png", RED)
@@ -1082,6 +1329,134 @@ class TestGlue(unittest.TestCase):
             data = json.loads(f.read())
             assert isinstance(data['frames'], dict)
 
+    def test_unchanged_outputs_are_not_rewritten(self):
+        self.create_image("simple/red.png", RED)
+        self.create_image("simple/blue.png", BLUE)
+        code = self.call("glue simple output --css --json --force")
+        self.assertEqual(code, 0)
+
+        for filename in ("simple.png", "simple.css", "simple.json"):
+            os.utime(os.path.join("output", filename), (0, 0))
+
+        code = self.call("glue simple output --css --json --force")
+        self.assertEqual(code, 0)
+
+        for filename in ("simple.png", "simple.css", "simple.json"):
+            self.assertEqual(os.path.getmtime(os.path.join("output", filename)), 0)
+
+        # Temporary files must be removed
+        self.assertEqual(sorted(os.listdir("output")),
+                         ["simple.css", "simple.json", "simple.png"])
+
+        self.create_image("simple/green.png", GREEN)
+        code = self.call("glue simple output --css --json")
+        self.assertEqual(code, 0)
+        for filename in ("simple.png", "simple.css", "simple.json"):
+            self.assertNotEqual(os.path.getmtime(os.path.join("output", filename)), 0)
+
+    def test_shared_context(self):
+        self.create_image("simple/red.png", RED)
+        self.create_image("simple/blue.png", BLUE)
+
+        generate_context = BaseTextFormat._generate_context
+        with patch.object(BaseTextFormat, '_generate_context', autospec=True,
+                          side_effect=generate_context) as mocked:
+            code = self.call("glue simple output --css --less --scss --json --cocos2d --retina")
+            self.assertEqual(code, 0)
+            self.assertEqual(mocked.call_count, 1)
+
+        # Every format gets its own copy of the shared contexts
+        with patch('glue.managers.base.BaseManager.save', autospec=True) as save:
+            code = self.call("glue simple output --css")
+            self.assertEqual(code, 0)
+        sprite = save.call_args[0][0].sprites[0]
+
+        class OtherCssFormat(CssFormat):
+            format_label = 'css'
+
+            def _generate_css_context(self, *args, **kwargs):
+                context = super(OtherCssFormat, self)._generate_css_context(*args, **kwargs)
+                context['sprite_path'] = 'other.png'
+                return context
+
+        css_context = CssFormat(sprite=sprite).get_context()
+        css_context['images'][0]['label'] = 'changed'
+        css_context['ratios'][1.0]['sprite_path'] = 'changed.png'
+        self.assertEqual(OtherCssFormat(sprite=sprite).get_context()['sprite_path'], 'other.png')
+        context = CssFormat(sprite=sprite).get_context()
+        self.assertEqual(context['images'][0]['label'], 'sprite-simple-red')
+        self.assertEqual(context['ratios'][1.0]['sprite_path'], 'simple.png')
+        self.assertEqual(context['sprite_path'], 'simple.png')
+        base_context = BaseTextFormat.get_context(CssFormat(sprite=sprite))
+        base_context['images'].pop()
+        self.assertEqual(len(BaseTextFormat.get_context(CssFormat(sprite=sprite))['images']), 2)
+
+        self.assertCSS("output/simple.css", '.sprite-simple-blue',
+                       {'background-image': "url(simple.png)",
+                        'background-repeat': 'no-repeat',
+                        'background-position': '-32px 0',
+                        'width': '32px',
+                        'height': '32px'})
+
+    def test_frame_store(self):
+        self.create_image("simple/red.png", RED)
+        self.create_image("simple/blue.png", BLUE, size=(32, 64))
+
+        with patch('glue.managers.base.BaseManager.save', autospec=True) as save:
+            code = self.call("glue simple output --retina --padding=2")
+            self.assertEqual(code, 0)
+
+        sprite = save.call_args[0][0].sprites[0]
+        frames = sprite.frames
+        self.assertEqual(frames.filenames, ['red.png', 'blue.png'])
+        self.assertEqual(list(frames.x), [0, 72])
+        self.assertEqual(list(frames.width), [64, 32])
+        self.assertEqual(list(frames.padding_left), [2, 2])
+        self.assertEqual(sprite.images[1].x, 72)
+
+        self.assertEqual(frames.frames(), [
+            {'filename': 'red.png', 'x': 0, 'y': 0, 'abs_x': 0, 'abs_y': 0,
+             'width': 36, 'height': 36},
+            {'filename': 'blue.png', 'x': -36, 'y': 0, 'abs_x': 36, 'abs_y': 0,
+             'width': 20, 'height': 36}])
+        self.assertEqual(frames.frames(2.0)[1],
+            {'filename': 'blue.png', 'x': -72, 'y': 0, 'abs_x': 72, 'abs_y': 0,
+             'width': 36, 'height': 68})
+
+    def test_json_compact(self):
+        self.create_image("simple/red.png", RED)
+        self.create_image("simple/blue.png", BLUE)
+        code = self.call("glue simple indented --json")
+        self.assertEqual(code, 0)
+        code = self.call("glue simple compact --json --json-compact")
+        self.assertEqual(code, 0)
+
+        with codecs.open('compact/simple.json', 'r', 'utf-8-sig') as f:
+            content = f.read()
+            self.assertFalse('\n' in content)
+            compact = json.loads(content)
+
+        with codecs.open('indented/simple.json', 'r', 'utf-8-sig') as f:
+            indented = json.loads(f.read())
+
+        del compact['meta']['hash'], indented['meta']['hash']
+        self.assertEqual(compact, indented)
+
+        code = self.call("glue simple hash --json --json-compact --json-format=hash")
+        self.assertEqual(code, 0)
+        with codecs.open('hash/simple.json', 'r', 'utf-8-sig') as f:
+            frames = json.loads(f.read())['frames']
+        self.assertEqual(list(frames), ['red.png', 'blue.png'])
+        self.assertEqual(frames['blue.png'], indented['frames'][1])
+
+        # Only json files are compact
+        code = self.call("glue simple caat --caat --json-compact")
+        self.assertEqual(code, 0)
+        with codecs.open('caat/simple.json', 'r', 'utf-8-sig') as f:
+            self.assertTrue('\n' in f.read())
+
+        self.assertRaises(SystemExit, self.call, "glue simple output --json --json-backend=ujson")
+
     def test_img(self):
         self.create_image("simple/red.png", RED)
         self.create_image("simple/blue.png", BLUE)
@@ -1459,6 +1834,148 @@ class TestGlue(unittest.TestCase):
                         'width': '32px',
                         'height': '32px'}, ratio=2)
 
+    def test_resample_images(self):
+        self.create_image("simple/red.png", RED)
+        self.create_image("simple/blue.png", BLUE)
+        code = self.call("glue simple output --retina --resample-images")
+        self.assertEqual(code, 0)
+
+        self.assertExists("output/simple.png")
+        self.assertExists("output/simple@2x.png")
+
+        # Images are scaled individually so they never bleed into each other
+        self.assertColor("output/simple.png", RED, ((0, 0), (31, 31)))
+        self.assertColor("output/simple.png", BLUE, ((32, 0), (63, 31)))
+        self.assertColor("output/simple@2x.png", RED, ((0, 0), (63, 63)))
+        self.assertColor("output/simple@2x.png", BLUE, ((64, 0), (127, 63)))
+
+    def test_native_ratios(self):
+        self.create_image("simple/red@2x.png", RED)
+        self.create_image("simple/red.png", GREEN, size=(32, 32))
+        self.create_image("simple/blue@2x.png", BLUE)
+        code = self.call("glue simple output --retina --native-ratios")
+        self.assertEqual(code, 0)
+
+        self.assertExists("output/simple.png")
+        self.assertExists("output/simple@2x.png")
+        self.assertColor("output/simple@2x.png", RED, ((0, 0), (63, 63)))
+        self.assertColor("output/simple@2x.png", BLUE, ((64, 0), (127, 63)))
+        self.assertColor("output/simple.png", GREEN, ((0, 0), (31, 31)))
+        self.assertColor("output/simple.png", BLUE, ((32, 0), (63, 31)))
+
+        self.assertCSS("output/simple.css", '.sprite-simple-red',
+                       {'background-image': "url(simple.png)",
+                        'background-repeat': 'no-repeat',
+                        'background-position': '0 0',
+                        'width': '32px',
+                        'height': '32px'})
+
+    def test_native_ratios_missing_variant(self):
+        self.create_image("simple/red.png", RED)
+        self.create_image("simple/red@1.5x.png", RED)
+        code = self.call("glue simple output --retina --ratios=2,1.5,1 --native-ratios")
+        self.assertEqual(code, 3)
+
+    def test_strip_height(self):
+        self.create_image("simple/red.png", RED)
+        self.create_image("simple/blue.png", BLUE, size=(64, 100))
+        code = self.call("glue simple output --retina --strip-height=7")
+        self.assertEqual(code, 0)
+
+        self.assertExists("output/simple.png")
+        self.assertExists("output/simple@2x.png")
+        self.assertColor("output/simple@2x.png", BLUE, ((0, 0), (63, 99)))
+        self.assertColor("output/simple@2x.png", RED, ((64, 0), (127, 63)))
+        self.assertColor("output/simple@2x.png", TRANSPARENT, ((64, 64), (127, 99)))
+        self.assertColor("output/simple.png", BLUE, ((0, 0), (30, 48)))
+        self.assertColor("output/simple.png", RED, ((33, 0), (63, 30)))
+
+        # Rebuild in order to test the ``needs_rebuild`` method
+        code, output = self.call("glue simple output --retina --strip-height=7", capture=True)
+        self.assertEqual(code, 0)
+        self.assertTrue("Format 'img'' for sprite 'simple' already exists" in output)
+
+        # Strips don't change the pixels of any ratio
+        code = self.call("glue simple canvas --retina")
+        self.assertEqual(code, 0)
+        for filename in ("simple.png", "simple@2x.png"):
+            strips = PILImage.open(os.path.join("output", filename))
+            canvas = PILImage.open(os.path.join("canvas", filename))
+            self.assertEqual(strips.tobytes(), canvas.tobytes())
+
+        # Smaller ratios are resized strip by strip too, so the whole
+        # canvas is never created.
+        with patch.object(ImageFormat, '_compose_canvas') as compose_canvas:
+            code = self.call("glue simple strips --ratios=2,1.5,1 --strip-height=7")
+        self.assertEqual(code, 0)
+        self.assertFalse(compose_canvas.called)
+        code = self.call("glue simple canvas --ratios=2,1.5,1")
+        self.assertEqual(code, 0)
+        for filename in ("simple.png", "simple@1.5x.png", "simple@2x.png"):
+            strips = PILImage.open(os.path.join("strips", filename))
+            canvas = PILImage.open(os.path.join("canvas", filename))
+            self.assertEqual(strips.size, canvas.size)
+            self.assertEqual(strips.tobytes(), canvas.tobytes())
+
+        self.assertRaises(SystemExit, self.call, "glue simple output --strip-height=0")
+        self.assertRaises(SystemExit, self.call, "glue simple output --strip-height=-5")
+
+    def test_unhashed_settings(self):
+        self.create_image("simple/red.png", RED)
+        code = self.call("glue simple output --cachebuster-filename")
+        self.assertEqual(code, 0)
+
+        # Settings that don't change the outputs don't change the hash
+        for option in ("--jobs=2", "--strip-height=7", "--watch-backend=poll", "--watch-interval=1",
+                       "--watch-cache-size=16", "--watch-debounce=1", "--serve-host=0.0.0.0",
+                       "--serve-port=9000", "--discovery-stats"):
+            code, output = self.call("glue simple output --cachebuster-filename {0}".format(option), capture=True)
+            self.assertEqual(code, 0)
+            self.assertTrue("Format 'img'' for sprite 'simple' already exists" in output, option)
+            self.assertTrue("Format 'css'' for sprite 'simple' already exists" in output, option)
+        self.assertEqual(len(os.listdir("output")), 2)
+
+    def test_output_mode(self):
+        self.create_image("simple/red.png", RED)
+        umask = os.umask(0o027)
+        try:
+            code = self.call("glue simple output")
+        finally:
+            os.umask(umask)
+        self.assertEqual(code, 0)
+        # Output files honor the umask as files created by open()
+        self.assertEqual(os.stat("output/simple.png").st_mode & 0o777, 0o640)
+        self.assertEqual(os.stat("output/simple.css").st_mode & 0o777, 0o640)
+        self.assertEqual([f for f in os.listdir("output") if f.endswith('.tmp')], [])
+
+    def test_jobs(self):
+        self.create_image("simple/red.png", RED)
+        self.create_image("simple/blue.png", BLUE, size=(64, 100))
+        self.create_image("simple/green.png", GREEN, size=(30, 30))
+        code = self.call("glue simple sequential --retina --strip-height=7")
+        self.assertEqual(code, 0)
+        code = self.call("glue simple parallel --retina --strip-height=7 --jobs=3")
+        self.assertEqual(code, 0)
+
+        for filename in ("simple.png", "simple@2x.png"):
+            sequential = PILImage.open(os.path.join("sequential", filename))
+            parallel = PILImage.open(os.path.join("parallel", filename))
+            self.assertEqual(sequential.size, parallel.size)
+            self.assertEqual(sequential.tobytes(), parallel.tobytes())
+
+        # Jobs alone don't change the pixels of any ratio
+        code = self.call("glue simple canvas --retina")
+        self.assertEqual(code, 0)
+        code = self.call("glue simple jobs --retina --jobs=3")
+        self.assertEqual(code, 0)
+
+        for filename in ("simple.png", "simple@2x.png"):
+            canvas = PILImage.open(os.path.join("canvas", filename))
+            jobs = PILImage.open(os.path.join("jobs", filename))
+            self.assertEqual(canvas.tobytes(), jobs.tobytes())
+
+        self.assertRaises(SystemExit, self.call, "glue simple output --jobs=0")
+
     def test_retina_url(self):
         self.create_image("simple/red.png", RED)
         self.create_image("simple/blue.png", BLUE)
@@ -1575,8 +2092,481 @@ class TestGlue(unittest.TestCase):
         self.assertEqual(set(meta.keys()), set(['frames', 'metadata']))
         self.assertEqual(set(meta['frames'].keys()), set(['blue.png', 'red.png']))
 
-        code = self.call("glue simple output --cocos2d")
+        code, output = self.call("glue simple output --cocos2d", capture=True)
+        self.assertEqual(code, 0)
+        self.assertTrue("Format 'cocos2d'' for sprite 'simple' already exists" in output)
+
+    def test_cocos2d_binary(self):
+        self.create_image("simple/red.png", RED)
+        self.create_image("simple/blue.png", BLUE)
+        code = self.call("glue simple output --cocos2d --cocos2d-binary")
+        self.assertEqual(code, 0)
+
+        with open("output/simple.plist", 'rb') as f:
+            self.assertEqual(f.read(8), b'bplist00')
+            f.seek(0)
+            meta = plistlib.load(f)
+        self.assertEqual(set(meta['frames'].keys()), set(['blue.png', 'red.png']))
+        self.assertEqual(meta['metadata']['textureFileName'], 'simple.png')
+
+        code, output = self.call("glue simple output --cocos2d --cocos2d-binary", capture=True)
         self.assertEqual(code, 0)
+        self.assertTrue("Format 'cocos2d'' for sprite 'simple' already exists" in output)
+
+    def test_atlas(self):
+        self.create_image("simple/red.png", RED)
+        self.create_image("simple/blue.png", BLUE)
+        code = self.call("glue simple output --atlas --retina")
+        self.assertEqual(code, 0)
+
+        self.assertExists("output/simple.atlas")
+        self.assertExists("output/simple@2x.atlas")
+
+        with open("output/simple.atlas", 'rb') as f:
+            data = f.read()
+        header = AtlasFormat.header_struct.unpack_from(data)
+        self.assertEqual(header[0], b'GLUEATLS')
+        self.assertEqual(header[3:7], (2, 64, 32, 1.0))
+
+        frames_offset, frame_size, strings_offset = header[7:10]
+        strings = data[strings_offset:]
+        frames = []
+        for i in range(header[3]):
+            frame = AtlasFormat.frame_struct.unpack_from(data, frames_offset + i * frame_size)
+            name = strings[frame[0]:frame[0] + frame[1]].decode('utf-8')
+            frames.append((name,) + frame[2:])
+        self.assertEqual(frames, [('blue.png', 32, 0, 32, 32, 32, 32),
+                                  ('red.png', 0, 0, 32, 32, 32, 32)])
+
+        code, output = self.call("glue simple output --atlas --retina", capture=True)
+        self.assertEqual(code, 0)
+        self.assertTrue("Format 'atlas'' for sprite 'simple' already exists" in output)
+
+    def test_watchers(self):
+        backends = [lambda path: PollingWatcher(path, interval=0.05)]
+        if InotifyWatcher.available():
+            backends.append(InotifyWatcher)
+
+        for backend in backends:
+            shutil.rmtree("simple", True)
+            os.makedirs("simple/sub")
+            watcher = backend("simple")
+            try:
+                self.create_image("simple/sub/red.png", RED)
+                self.assertEqual(watcher.wait(timeout=1), set([os.path.abspath("simple/sub/red.png")]))
+
+                # Hidden files and ignored paths are not changes
+                watcher.ignored_paths = set([os.path.abspath("simple/simple.png")])
+                self.create_image("simple/simple.png", RED)
+                self.create_image("simple/.hidden.png", RED)
+                self.assertEqual(watcher.wait(timeout=0.3), set())
+
+                # New directories are watched too
+                self.create_image("simple/new/blue.png", BLUE)
+                self.assertTrue(os.path.abspath("simple/new/blue.png") in watcher.wait(timeout=1))
+            finally:
+                watcher.close()
+
+    @patch('glue.managers.watch.signal.signal')
+    def test_watch(self, mock_signal):
+        self.create_image("simple/red.png", RED)
+        self.create_image("simple/blue.png", BLUE)
+
+        events = [set(['red.png'])]
+
+        def changes(timeout=None):
+            if timeout is not None:
+                return set()
+            if not events:
+                raise KeyboardInterrupt
+            return events.pop(0)
+
+        with patch.object(PollingWatcher, 'wait', side_effect=changes):
+            with patch('glue.managers.watch.WatchManager.build', autospec=True,
+                       side_effect=WatchManager.build) as mock_build:
+                self.assertRaises(KeyboardInterrupt, self.call,
+                                  "glue simple simple --watch --watch-backend=poll")
+                self.assertEqual(mock_build.call_count, 2)
+                watcher = mock_build.call_args[0][0].watcher
+                self.assertTrue(os.path.abspath("simple/simple.png") in watcher.ignored_paths)
+                self.assertTrue(os.path.abspath("simple/simple.css") in watcher.ignored_paths)
+
+        self.assertRaises(SystemExit, self.call, "glue simple output --watch --watch-interval=0")
+
+    @patch('glue.managers.watch.signal.signal')
+    def test_watch_rebuilds_changed_sprites(self, mock_signal):
+        self.create_image("sprites/icons/red.png", RED)
+        self.create_image("sprites/icons/blue.png", BLUE)
+        self.create_image("sprites/menu/green.png", GREEN)
+        self.create_image("sprites/menu/yellow.png", YELLOW)
+
+        def changes(timeout=None):
+            if timeout is not None:
+                return set()
+            if os.path.exists("sprites/icons/pink.png"):
+                raise KeyboardInterrupt
+            self.create_image("sprites/icons/pink.png", PINK)
+            return set([os.path.abspath("sprites/icons/pink.png")])
+
+        with patch.object(PollingWatcher, 'wait', side_effect=changes):
+            with patch('glue.managers.base.Sprite', autospec=True, side_effect=Sprite) as mock_sprite:
+                self.assertRaises(KeyboardInterrupt, self.call,
+                                  "glue sprites output --project --watch --watch-backend=poll")
+
+                # Only the icons sprite is created again
+                self.assertEqual([c[1]['path'] for c in mock_sprite.call_args_list],
+                                 [os.path.abspath("sprites/icons"), os.path.abspath("sprites/menu"),
+                                  os.path.abspath("sprites/icons")])
+
+        with codecs.open("output/icons.css", 'r', 'utf-8') as f:
+            self.assertTrue('.sprite-icons-pink' in f.read())
+
+    @patch('glue.managers.watch.signal.signal')
+    def test_watch_image_cache(self, mock_signal):
+        self.create_image("sprites/icons/red.png", RED)
+        self.create_image("sprites/icons/blue.png", BLUE)
+        self.create_image("sprites/menu/green.png", GREEN)
+
+        def changes(timeout=None):
+            if timeout is not None:
+                return set()
+            if os.path.exists("sprites/icons/pink.png"):
+                raise KeyboardInterrupt
+            self.create_image("sprites/icons/pink.png", PINK)
+            return set([os.path.abspath("sprites/icons/pink.png")])
+
+        with patch.object(PollingWatcher, 'wait', side_effect=changes):
+            with patch.object(Image, '_decode', autospec=True, side_effect=Image._decode) as mock_decode:
+                self.assertRaises(KeyboardInterrupt, self.call,
+                                  "glue sprites output --project --watch --watch-backend=poll")
+
+                # Only the new image is decoded while rebuilding icons
+                self.assertEqual([os.path.basename(c[0][0].path) for c in mock_decode.call_args_list],
+                                 ['blue.png', 'red.png', 'green.png', 'pink.png'])
+        self.assertEqual(Image.cache, None)
+
+    @patch('glue.managers.watch.signal.signal')
+    def test_watch_debounce(self, mock_signal):
+        self.create_image("sprites/icons/red.png", RED)
+        self.create_image("sprites/menu/green.png", GREEN)
+        red = os.path.abspath("sprites/icons/red.png")
+        green = os.path.abspath("sprites/menu/green.png")
+
+        events = [set([red])]
+        quiet_events = [set(), set([green]), set()]
+
+        def changes(timeout=None):
+            if timeout is not None:
+                return quiet_events.pop(0)
+            if not events:
+                raise KeyboardInterrupt
+            return events.pop(0)
+
+        # The first build is cancelled before creating any sprite
+        check_changes = Mock(side_effect=[BuildCancelled(set([green]))] + [None] * 20)
+
+        with patch.object(PollingWatcher, 'wait', side_effect=changes):
+            with patch.object(WatchManager, 'check_changes', check_changes):
+                with patch('glue.managers.watch.WatchManager.build', autospec=True,
+                           side_effect=WatchManager.build) as mock_build:
+                    self.assertRaises(KeyboardInterrupt, self.call,
+                                      "glue sprites output --project --watch --watch-backend=poll")
+
+                    # Changes are coalesced until nothing changes
+                    self.assertEqual([c[0][1] for c in mock_build.call_args_list],
+                                     [None, set([green]), set([red, green])])
+
+        self.assertTrue(os.path.isfile("output/icons.png"))
+        self.assertTrue(os.path.isfile("output/menu.css"))
+        self.assertRaises(SystemExit, self.call, "glue sprites output --watch --watch-debounce=-1")
+
+    @patch('glue.managers.watch.signal.signal')
+    def test_serve(self, mock_signal):
+        self.create_image("simple/red.png", RED)
+        self.create_image("simple/blue.png", BLUE)
+        responses = {}
+
+        def get(manager, path, headers={}):
+            connection = HTTPConnection(*manager.server.server_address[:2])
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                return response.status, response.getheader('ETag'), response.read()
+            finally:
+                connection.close()
+
+        def changes(timeout=None):
+            if timeout is not None:
+                return set()
+            manager = mock_save.call_args[0][0]
+            responses['png'] = get(manager, '/simple.png')
+            responses['css'] = get(manager, '/simple.css')
+            responses['cached'] = get(manager, '/simple.png', {'If-None-Match': responses['png'][1]})
+            responses['missing'] = get(manager, '/missing.png')
+            raise KeyboardInterrupt
+
+        with patch.object(PollingWatcher, 'wait', side_effect=changes):
+            with patch('glue.managers.serve.ServeManager.save', autospec=True,
+                       side_effect=ServeManager.save) as mock_save:
+                self.assertRaises(KeyboardInterrupt, self.call,
+                                  "glue serve simple --watch-backend=poll --serve-port=0")
+                sprite = mock_save.call_args[0][1].sprites[0]
+
+        status, etag, content = responses['png']
+        self.assertEqual(status, 200)
+        self.assertEqual(etag, '"{0}"'.format(sprite.hash))
+        self.assertEqual(PILImage.open(io.BytesIO(content)).size, (128, 64))
+        self.assertTrue(b'.sprite-simple-red' in responses['css'][2])
+        self.assertEqual(responses['cached'][0], 304)
+        self.assertEqual(responses['missing'][0], 404)
+
+        # Nothing is written to disk
+        self.assertEqual(sorted(os.listdir("simple")), ['blue.png', 'red.png'])
+
+    def test_api(self):
+        red = io.BytesIO()
+        PILImage.new('RGB', (64, 64), RED).save(red, 'PNG')
+        self.create_image("images/blue.png", BLUE)
+
+        with open("images/blue.png", 'rb') as blue:
+            result = build({'red.png': red.getvalue(),
+                            'blue.png': blue,
+                            'green.png': PILImage.new('RGB', (32, 32), GREEN)},
+                           Options(ratios='2,1', json_dir=True, css_dir='css'), name='icons')
+        shutil.rmtree("images")
+
+        self.assertEqual(list(result.files), ['css/icons.css', 'icons.png', 'icons@2x.png',
+                                              'icons.json', 'icons@2x.json'])
+        self.assertEqual(result.layout(2.0), [{'filename': 'blue.png', 'x': 0, 'y': 0, 'width': 64, 'height': 64},
+                                              {'filename': 'red.png', 'x': 64, 'y': 0, 'width': 64, 'height': 64},
+                                              {'filename': 'green.png', 'x': 0, 'y': 64, 'width': 32, 'height': 32}])
+        self.assertEqual(result.canvas(2.0).size, (128, 96))
+        self.assertEqual(result.files['icons@2x.png'], result.png(2.0))
+        self.assertEqual(PILImage.open(io.BytesIO(result.files['icons.png'])).size, (64, 48))
+
+        css = result.files['css/icons.css'].decode('utf-8')
+        self.assertTrue(".sprite-icons-green" in css)
+        self.assertTrue("url('../icons.png')" in css)
+        self.assertEqual(json.loads(result.files['icons.json'].decode('utf-8'))['meta']['hash'], result.hash)
+
+        # Nothing is written or printed
+        self.assertEqual(os.listdir('.'), [])
+        self.assertEqual(sys.stdout.getvalue(), '')
+
+    def test_api_options(self):
+        self.assertEqual(Options(padding=4, jobs='2').padding, '4')
+        self.assertEqual(Options(jobs='2').jobs, 2)
+        self.assertRaises(TypeError, Options, source='sprites')
+        self.assertRaises(ValueError, Options, algorithm='unknown')
+        self.assertRaises(ValueError, build, {'red.png': b''}, Options(jobs=0))
+        self.assertRaises(TypeError, build, {'red.png': None})
+
+    def test_aio(self):
+        self.create_image("sprites/icons/red.png", RED)
+        self.create_image("sprites/icons/blue.png", BLUE)
+        red = io.BytesIO()
+        PILImage.new('RGB', (64, 64), RED).save(red, 'PNG')
+        red.seek(0)
+
+        started, release = threading.Event(), threading.Event()
+
+        def blocking_read():
+            started.set()
+            release.wait(5)
+            return red.getvalue()
+
+        builder = AsyncBuilder(limit=1)
+
+        async def run():
+            results = await asyncio.gather(builder.build({'red.png': red}, Options(json_dir=True), name='one'),
+                                           builder.build_directory("sprites/icons"))
+
+            # Builds over the limit wait until another one finishes
+            cancelled = asyncio.ensure_future(builder.build({'red.png': Mock(read=blocking_read)}))
+            waiting = asyncio.ensure_future(builder.build({'red.png': red.getvalue()}, name='waiting'))
+            await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+            await asyncio.sleep(0.05)
+            self.assertFalse(waiting.done())
+
+            cancelled.cancel()
+            release.set()
+            with self.assertRaises(asyncio.CancelledError):
+                await cancelled
+            return results + [await waiting]
+
+        async def contend():
+            return await asyncio.gather(*[builder.build({'red.png': red.getvalue()}, name=name)
+                                          for name in ('first', 'second')])
+
+        try:
+            one, icons, waiting = asyncio.run(run())
+            # Builders can be used by another event loop
+            first, second = asyncio.run(contend())
+        finally:
+            builder.close()
+
+        self.assertEqual(list(one.files), ['one.png', 'one.json'])
+        self.assertEqual(one.layout()[0]['filename'], 'red.png')
+        self.assertEqual(icons.name, 'icons')
+        self.assertEqual(sorted(i['filename'] for i in icons.layout()), ['blue.png', 'red.png'])
+        self.assertEqual(waiting.name, 'waiting')
+        self.assertEqual((first.name, second.name), ('first', 'second'))
+
+    def test_service(self):
+        self.create_image("icons/home.png", RED)
+        self.create_image("icons/search.png", GREEN)
+        self.create_image("icons/social/twitter.png", BLUE)
+        self.create_image("icons/social/home.png", PINK)
+
+        service = SpriteService(IconLibrary("icons", recursive=True))
+
+        def get(path, query, if_none_match=''):
+            response = {}
+
+            def start_response(status, headers):
+                response.update(status=status, headers=dict(headers))
+
+            environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query,
+                       'HTTP_IF_NONE_MATCH': if_none_match}
+            body = b''.join(service(environ, start_response))
+            return response['status'], response['headers'], body
+
+        status, headers, css = get("/page.css", "icons=search,social/twitter&padding=1")
+        self.assertEqual(status, '200 OK')
+        css = css.decode('utf-8')
+        self.assertTrue(".sprite-page-social-twitter" in css)
+        self.assertFalse(".sprite-page-home" in css)
+        self.assertTrue("url('page.png?icons=search,social/twitter&padding=1')" in css)
+
+        # Every output of a sprite is composed at once
+        status, png_headers, png = get("/page.png", "padding=1&icons=social/twitter,search")
+        self.assertEqual(png_headers['ETag'], headers['ETag'])
+        self.assertEqual(PILImage.open(io.BytesIO(png)).size, (132, 66))
+        self.assertEqual(len(service.cache), 1)
+        self.assertEqual(get("/page.png", "icons=search,social/twitter&padding=1", headers['ETag'])[0],
+                         '304 Not Modified')
+
+        self.assertEqual(get("/page.css", "icons=unknown")[0], '404 Not Found')
+        self.assertEqual(get("/page.css", "icons=home&crop=1")[0], '400 Bad Request')
+        self.assertEqual(get("/page.css", "")[0], '400 Bad Request')
+
+        # The least recently used sprites are discarded first
+        service.cache.max_size = service.cache.size + 100
+        get("/other.css", "icons=home")
+        self.assertEqual(list(service.cache.entries), [('other', 'icons=home')])
+
+        # Icons with the same name inside different directories
+        status, headers, css = get("/page.css", "icons=home,social/home")
+        self.assertEqual(status, '200 OK')
+        self.assertTrue(".sprite-page-home" in css.decode('utf-8'))
+        self.assertTrue(".sprite-page-social-home" in css.decode('utf-8'))
+
+        # Settings out of bounds are rejected before composing anything
+        for query in ("margin=3000", "padding=-5", "padding=a", "ratios=0", "ratios=100"):
+            self.assertEqual(get("/page.css", "icons=home&" + query)[0], '400 Bad Request')
+        service.max_pixels = 64 * 64
+        self.assertEqual(get("/page.css", "icons=home,search")[0], '400 Bad Request')
+
+        # Outputs inside other directories would never be served
+        for option in ('img_dir', 'css_dir', 'json_dir'):
+            self.assertRaises(ValueError, SpriteService, IconLibrary("icons"), Options(**{option: 'sprites'}))
+        SpriteService(IconLibrary("icons"), Options(json_dir=True))
+
+    def test_daemon(self):
+        self.create_image("sprites/icons/red.png", RED)
+        self.create_image("sprites/menu/green.png", GREEN)
+
+        daemon = BuildDaemon(cache_size=16)
+        daemon.listen_unix("glue.sock")
+        token = read_token("token")
+        self.assertEqual(read_token("token"), token)
+        self.assertEqual(os.stat("token").st_mode & 0o777, 0o600)
+        http_server = daemon.listen_http('127.0.0.1', 0, token)
+        thread = threading.Thread(target=daemon.serve_forever)
+        thread.start()
+        try:
+            responses = {}
+
+            def build(name):
+                responses[name] = request([os.path.abspath("sprites/" + name), os.path.abspath("output")], "glue.sock")
+
+            builds = [threading.Thread(target=build, args=(name, )) for name in ('icons', 'menu')]
+            for build_thread in builds:
+                build_thread.start()
+            for build_thread in builds:
+                build_thread.join()
+
+            # Every response only contains the output of its own build
+            self.assertEqual(responses['icons']['code'], 0)
+            self.assertTrue('red.png' in responses['icons']['stdout'])
+            self.assertFalse('green.png' in responses['icons']['stdout'])
+            self.assertEqual(responses['menu']['code'], 0)
+            self.assertTrue('green.png' in responses['menu']['stdout'])
+            self.assertFalse('red.png' in responses['menu']['stdout'])
+
+            response = request([os.path.abspath("sprites/icons"), "--watch"], "glue.sock")
+            self.assertEqual(response['code'], 2)
+            self.assertTrue('--watch' in response['stderr'])
+
+            def post(headers):
+                connection = HTTPConnection('127.0.0.1', http_server.server_address[1])
+                body = json.dumps({'argv': [os.path.abspath("sprites/icons"), os.path.abspath("http")]})
+                try:
+                    connection.request('POST', '/', body, headers)
+                    response = connection.getresponse()
+                    return response.status, json.loads(response.read().decode('utf-8'))
+                finally:
+                    connection.close()
+
+            # Only JSON requests using the token and not sent by web pages
+            # are accepted
+            status, response = post({'Content-Type': 'application/json'})
+            self.assertEqual(status, 401)
+            status, response = post({'Content-Type': 'application/json', 'X-Glue-Token': 'wrong'})
+            self.assertEqual(status, 401)
+            status, response = post({'Content-Type': 'text/plain', 'X-Glue-Token': token})
+            self.assertEqual(status, 415)
+            status, response = post({'Content-Type': 'application/json', 'X-Glue-Token': token,
+                                     'Origin': 'http://example.com'})
+            self.assertEqual(status, 403)
+            self.assertDoesNotExists("http/icons.png")
+            status, response = post({'Content-Type': 'application/json', 'X-Glue-Token': token})
+            self.assertEqual(status, 200)
+            self.assertEqual(response['code'], 0)
+            self.assertExists("http/icons.png")
+        finally:
+            daemon.shutdown()
+            thread.join()
+
+        self.assertExists("output/icons.png")
+        self.assertExists("output/menu.css")
+        self.assertDoesNotExists("glue.sock")
+        self.assertRaises(SystemExit, self.call, "glue daemon --http=abc")
+        self.assertRaises(ValueError, daemon.listen_http, '127.0.0.1', 0, '')
+        self.assertTrue(is_loopback('127.0.0.1'))
+        self.assertTrue(is_loopback('localhost'))
+        self.assertFalse(is_loopback('0.0.0.0'))
+
+    def test_image_cache(self):
+        cache = ImageCache(100)
+        cache.put('a.png', 1, 'a', 40)
+        cache.put('b.png', 1, 'b', 40)
+        self.assertEqual(cache.get('a.png', 1), 'a')
+        self.assertEqual(cache.get('a.png', 2), None)
+
+        # New versions replace old ones
+        cache.put('b.png', 2, 'b2', 40)
+        self.assertEqual(cache.get('b.png', 1), None)
+        self.assertEqual(cache.size, 80)
+
+        # The least recently used entry is discarded
+        cache.put('c.png', 1, 'c', 40)
+        self.assertEqual(cache.get('a.png', 1), None)
+        self.assertEqual(cache.get('b.png', 2), 'b2')
+        self.assertEqual(cache.get('c.png', 1), 'c')
+
+        cache.put('d.png', 1, 'd', 101)
+        self.assertEqual(cache.get('d.png', 1), None)
 
     @patch('glue.managers.simple.SimpleManager.process')
     def test_debug(self, mock_process):